@@ -3,4 +3,5 @@ module.exports = {
   Region: require('./src/region'),
   Coordinates: require('./src/coordinates'),
   Parser: require('./src/arg_parser.js'),
+  RpcServer: require('./src/rpc_server'),
 }
@@ -0,0 +1,48 @@
+const RpcServer = require('./src/rpc_server');
+const setGoogleUrl = require('./src/apis').setGoogleUrl;
+const ArgumentParser = require('argparse').ArgumentParser;
+const resolve = require('path').resolve;
+
+const parser = new ArgumentParser({
+  addHelp: true,
+  description: 'Serves the S3 engine (panorama links, metadata, image downloads) over a Unix socket.',
+});
+parser.addArgument(['-s', '--socket'], { help: 'The Unix socket to listen on.', required: true });
+parser.addArgument(['-k', '--keys'], { help: 'The path to the api keys (the first one is used).', required: false });
+parser.addArgument(['-a', '--api-key'], { help: 'The API key, instead of --keys.', required: false });
+parser.addArgument(['-g', '--google-url'], { help: 'Base URL replacing that of the Google APIs (e.g. a fake_google.py server).', required: false });
+parser.addArgument(['-m', '--maps-script'], { help: 'URL replacing that of the Google Javascript API.', required: false });
+parser.addArgument(['-c', '--concurrency'], { help: 'The maximum number of images downloading at once.', type: 'int', defaultValue: 8 });
+parser.addArgument(['-l', '--lifeline'], { help: 'Stop once STDIN closes (e.g. when the process that started the engine exits).', action: 'storeTrue' });
+parser.addArgument(['-v', '--verbose'], { help: 'Log the connections.', action: 'storeTrue' });
+const args = parser.parseArgs();
+
+if(!args.keys && !args.api_key) parser.error('One of --keys or --api-key is required.');
+if(args.google_url) setGoogleUrl(args.google_url);
+
+const server = new RpcServer({
+  socketPath: resolve(args.socket),
+  apiKey: args.api_key || require(resolve(args.keys)).apiKeys[0],
+  mapsScriptUrl: args.maps_script,
+  concurrency: args.concurrency,
+  verbose: args.verbose,
+});
+
+// The engine serves until told to stop, removing its socket on the way out
+['SIGINT', 'SIGTERM'].forEach(signal => process.on(signal, () => {
+  server.stop();
+  process.exit(0);
+}));
+
+if(args.lifeline) {
+  process.stdin.on('end', () => {
+    server.stop();
+    process.exit(0);
+  });
+  process.stdin.resume();
+}
+
+server.start().catch(err => {
+  console.error(err);
+  process.exit(1);
+});
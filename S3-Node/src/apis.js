@@ -1,5 +1,6 @@
 const axios = require('axios');
 const fs = require('fs');
+const promisify = require('util').promisify;
 const Coordinates = require('./coordinates.js');
 const ndarray = require('ndarray');
 const PNG = require('pngjs').PNG;
@@ -8,6 +9,22 @@ const APILimitError = require('./errors.js').APILimitError;
 // CONSTANTS
 const BATCH_LIMIT = 100;
 
+// The API endpoints; setGoogleUrl points them all below another base URL (e.g. a fake_google.py server)
+const urls = {
+  staticMap: 'http://maps.googleapis.com/maps/api/staticmap',
+  roads: 'https://roads.googleapis.com/v1/nearestRoads',
+  metadata: 'https://maps.googleapis.com/maps/api/streetview/metadata',
+  streetView: 'https://maps.googleapis.com/maps/api/streetview',
+};
+
+function setGoogleUrl(baseUrl) {
+  const base = baseUrl.replace(/\/+$/, '');
+  urls.staticMap = `${base}/maps/api/staticmap`;
+  urls.roads = `${base}/v1/nearestRoads`;
+  urls.metadata = `${base}/maps/api/streetview/metadata`;
+  urls.streetView = `${base}/maps/api/streetview`;
+}
+
 function decodePng(image) {
   return new Promise((resolve, reject) => {
     const png = new PNG();
@@ -21,7 +38,7 @@ function decodePng(image) {
 
 // FUNCTIONS
 async function checkForWater({ coordinates, apiKey }) {
-  const query = `http://maps.googleapis.com/maps/api/staticmap?center=${coordinates.asString()}&zoom=20`
+  const query = `${urls.staticMap}?center=${coordinates.asString()}&zoom=20`
         + `&size=1x1&maptype=roadmap&sensor=false&key=${apiKey}`;
   try {
     const response = await axios.get(query, {responseType: 'arraybuffer'});
@@ -44,7 +61,7 @@ async function fetchSnappedCoordinates({ coordinates, apiKey }) {
   const formattedCoordinates = coordinates
         .map(pair => pair.asString())
         .join('|');
-  const query = `https://roads.googleapis.com/v1/nearestRoads?points=${formattedCoordinates}&key=${apiKey}`;
+  const query = `${urls.roads}?points=${formattedCoordinates}&key=${apiKey}`;
   try {
     const response =  await axios.get(query);
 
@@ -78,7 +95,7 @@ async function fetchSnappedCoordinates({ coordinates, apiKey }) {
 async function fetchImages({ coordinates, settings, apiKey, heading }) {
   const { width, height, pitch, fov, destination, filesPrefix } = settings; //TODO allow for multiple headings
 
-  const query = `https://maps.googleapis.com/maps/api/streetview?size=${width}x${height}&location=${coordinates.asString()}&fov=${fov}&heading=${heading}&pitch=${pitch}&key=${apiKey}`;
+  const query = `${urls.streetView}?size=${width}x${height}&location=${coordinates.asString()}&fov=${fov}&heading=${heading}&pitch=${pitch}&key=${apiKey}`;
   const requestParams = {
     responseType:'stream',
   };
@@ -94,9 +111,62 @@ async function fetchImages({ coordinates, settings, apiKey, heading }) {
   }
 }
 
+async function fetchMetadata({ coordinates, apiKey }) {
+  const query = `${urls.metadata}?location=${coordinates.asString()}&key=${apiKey}`;
+  try {
+    const response = await axios.get(query);
+    return { status: response.data.status, pano_id: response.data.pano_id || null };
+  } catch(err) {
+    if(err.response && (err.response.status === 403 || err.response.status === 429)) {
+      throw new APILimitError('Street View', apiKey);
+    }
+    throw err;
+  }
+}
+
+/**
+ * Streams the response of a GET to a file, through a .part file renamed once complete.
+ * @param {string} url
+ * @param {string} filename
+ * @returns {number} The number of bytes written.
+ */
+async function downloadToFile({ url, filename }) {
+  let response;
+  try {
+    response = await axios.get(url, { responseType: 'stream' });
+  } catch(err) {
+    if(err.response && (err.response.status === 403 || err.response.status === 429)) {
+      throw new APILimitError('Street View', '');
+    }
+    throw err;
+  }
+  const file = fs.createWriteStream(`${filename}.part`);
+  try {
+    const size = await new Promise((resolve, reject) => {
+      let bytes = 0;
+      response.data.on('data', chunk => { bytes += chunk.length; });
+      response.data.on('error', reject);
+      file.on('error', reject);
+      file.on('finish', () => resolve(bytes));
+      response.data.pipe(file);
+    });
+    await promisify(fs.rename)(`${filename}.part`, filename);
+    return size;
+  } catch(err) {
+    // The stream failed partway: no partial image is left behind
+    response.data.unpipe(file);
+    file.destroy();
+    await promisify(fs.unlink)(`${filename}.part`).catch(() => {});
+    throw err;
+  }
+}
+
 module.exports = {
   BATCH_LIMIT,
+  setGoogleUrl,
   fetchSnappedCoordinates,
   fetchImages,
+  fetchMetadata,
+  downloadToFile,
   checkForWater,
 };
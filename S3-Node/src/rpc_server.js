@@ -0,0 +1,196 @@
+/**
+ * Contains the RpcServer, which serves the S3 engine to other processes (e.g. the Python sampler of
+ * S3-Python, see node_engine.py) over a Unix socket. They then share one persistent, concurrent engine
+ * instead of spawning a JSDOM and the Google Javascript API for every lookup.
+ *
+ * Requests and replies are JSON objects, one per line, matched on their id:
+ *   {"id": 7, "method": "adjacency", "params": {"radius": 50, "locations": [[45.42, -75.69], ...]}}
+ *     --> {"id": 7, "results": [{"status": "OK", "links": [["<pano id>", 243.1, 45.42, -75.69], ...]}, ...]}
+ *         (null for a lookup that timed out or failed with a status other than OK or ZERO_RESULTS; lat and
+ *         lon of a link are null when they could not be resolved)
+ *   {"id": 8, "method": "metadata", "params": {"locations": [[45.42, -75.69], ...]}}
+ *     --> {"id": 8, "results": [{"status": "OK", "pano_id": "<pano id>"}, ...]} (null for a failed lookup)
+ *   {"id": 9, "method": "download", "params": {"jobs": [["<Street View URL>", "<filename>"], ...]}}
+ *     --> {"id": 9, "results": [{"bytes": 20817}, {"error": {"code": "API_LIMIT", "message": "..."}}, ...]}
+ *   A request that fails as a whole is answered with {"id": 9, "error": {"code": "...", "message": "..."}}.
+ * Requests are served concurrently, so replies may come back in any order; there is one result per
+ * location or job, in request order.
+ *
+ * @file   This file exports the RpcServer class.
+ */
+
+const net = require('net');
+const fs = require('fs');
+const readline = require('readline');
+const GSVClient = require('./street_view_client');
+const api = require('./apis');
+const Coordinates = require('./coordinates');
+
+const SEARCH_RADIUS = 50;
+const LOOKUP_TIMEOUT = 30000; // Milliseconds before a panorama lookup is given up...
+
+class RpcError extends Error {
+  constructor(code, ...args) {
+    super(...args);
+    this.code = code;
+  }
+}
+
+class RpcServer {
+
+  /**
+   * Constructor for the RpcServer object.
+   * @param {string} socketPath The Unix socket to listen on.
+   * @param {string} apiKey The API key of the lookups (downloads carry their own in their URL).
+   * @param {string} mapsScriptUrl URL replacing that of the Google Javascript API (e.g. a stub for offline runs).
+   * @param {int} concurrency The maximum number of images downloading at once, over all requests.
+   * @param {bool} verbose If true, the server logs its connections to the console.
+   */
+  constructor({ socketPath, apiKey, mapsScriptUrl, concurrency = 8, verbose }) {
+    this._socketPath = socketPath;
+    this._apiKey = apiKey;
+    this._mapsScriptUrl = mapsScriptUrl;
+    this._concurrency = concurrency;
+    this._verbose = verbose;
+    this._downloading = 0;
+    this._waiting = [];
+  }
+
+  log(message) {
+    if(this._verbose) console.error(`${new Date().toISOString()}: ${message}`);
+  }
+
+  /**
+   * Loads the Google Javascript API, then listens: the socket only appears once the engine is ready.
+   */
+  async start() {
+    this._GSVClient = await GSVClient({ apiKey: this._apiKey, mapsScriptUrl: this._mapsScriptUrl });
+
+    // A socket left behind by an engine that did not shut down cleanly...
+    if(fs.existsSync(this._socketPath)) fs.unlinkSync(this._socketPath);
+    this._server = net.createServer(socket => this._serve(socket));
+    await new Promise((resolve, reject) => {
+      this._server.once('error', reject);
+      this._server.listen(this._socketPath, resolve);
+    });
+    this.log(`Listening on ${this._socketPath}...`);
+  }
+
+  stop() {
+    if(!this._server) return;
+    this._server.close();
+    this._server = null;
+    if(fs.existsSync(this._socketPath)) fs.unlinkSync(this._socketPath);
+  }
+
+  _serve(socket) {
+    this.log('Client connected...');
+    const reply = message => {
+      if(!socket.destroyed) socket.write(JSON.stringify(message) + '\n');
+    };
+    socket.on('error', err => this.log(`Connection error: ${err.message}`)); // The client went away...
+    readline.createInterface({ input: socket }).on('line', async line => {
+      if(!line.trim()) return;
+      let request;
+      try {
+        request = JSON.parse(line);
+      } catch (err) {
+        return reply({ id: null, error: { code: 'BAD_REQUEST', message: 'The request is not JSON.' } });
+      }
+      try {
+        reply({ id: request.id, results: await this.handle(request) });
+      } catch (err) {
+        reply({ id: request.id, error: { code: err.code || 'ERROR', message: err.message } });
+      }
+    });
+  }
+
+  async handle({ method, params = {} }) {
+    switch(method) {
+      case 'adjacency': return this.adjacency(params);
+      case 'metadata': return this.metadata(params);
+      case 'download': return this.download(params);
+      default: throw new RpcError('BAD_METHOD', `Unknown method: ${method}`);
+    }
+  }
+
+  /**
+   * Looks up the panoramas adjacent to each location, every location at once.
+   */
+  async adjacency({ locations = [], radius = SEARCH_RADIUS }) {
+    return Promise.all(locations.map(([lat, lng]) => this._links(lat, lng, radius)));
+  }
+
+  _getPanorama(request) {
+    return new Promise(resolve => {
+      const timer = setTimeout(() => resolve({ data: null, status: null }), LOOKUP_TIMEOUT);
+      this._GSVClient.getPanorama(request, (data, status) => {
+        clearTimeout(timer);
+        resolve({ data, status });
+      });
+    });
+  }
+
+  async _links(lat, lng, radius) {
+    const { data, status } = await this._getPanorama({ location: { lat, lng }, radius });
+    // Only ZERO_RESULTS answers the lookup for good: a timeout or a transient status (UNKNOWN_ERROR,
+    // OVER_QUERY_LIMIT, ...) is a failed lookup, left for the client to retry.
+    if(status === 'ZERO_RESULTS') return { status, links: [] };
+    if(status !== 'OK') return null;
+
+    // The link heading is that of the original point (rear-facing): add 180 to face forward.
+    const links = data.links.map(link => [link.pano, link.heading + 180, null, null]);
+    await Promise.all(links.map(async link => {
+      const linked = await this._getPanorama({ pano: link[0] });
+      if(linked.status === 'OK') {
+        link[2] = linked.data.location.latLng.lat();
+        link[3] = linked.data.location.latLng.lng();
+      }
+    }));
+    return { status: 'OK', links };
+  }
+
+  /**
+   * Looks up the Street View metadata of each location, every location at once.
+   */
+  async metadata({ locations = [] }) {
+    return Promise.all(locations.map(async ([lat, lng]) => {
+      try {
+        return await api.fetchMetadata({ coordinates: new Coordinates(lat, lng), apiKey: this._apiKey });
+      } catch (err) {
+        if(err.code === 'API_LIMIT') throw err;
+        return null;
+      }
+    }));
+  }
+
+  /**
+   * Downloads the images of the jobs, at most concurrency at once over all requests.
+   */
+  async download({ jobs = [] }) {
+    return Promise.all(jobs.map(([url, filename]) => this._limited(async () => {
+      try {
+        return { bytes: await api.downloadToFile({ url, filename }) };
+      } catch (err) {
+        return { error: { code: err.code || 'ERROR', message: err.message } };
+      }
+    })));
+  }
+
+  _limited(task) {
+    return new Promise((resolve, reject) => {
+      const run = () => {
+        this._downloading += 1;
+        const done = () => {
+          this._downloading -= 1;
+          if(this._waiting.length) this._waiting.shift()();
+        };
+        task().then(result => { done(); resolve(result); }, err => { done(); reject(err); });
+      };
+      if(this._downloading < this._concurrency) run();
+      else this._waiting.push(run);
+    });
+  }
+}
+
+module.exports = RpcServer;
@@ -12,9 +12,10 @@ const JSDOM = require('jsdom').JSDOM;
  * Returns a Google Street View client object.
  *
  * @param {string} apiKey
+ * @param {string} mapsScriptUrl URL replacing that of the Google Javascript API (e.g. a stub for offline runs)
  * @returns {Object} GoogleStreetView client
  */
-function GSVClient({ apiKey }) {
+function GSVClient({ apiKey, mapsScriptUrl }) {
   return new Promise((resolve, reject) => {
       //const deasync = require('deasync');
   const timeLaunch = new Date().getTime();
@@ -40,7 +41,7 @@ function GSVClient({ apiKey }) {
 
      /* Load the script */
      window.getClient = function (callback) {
-      loadScript("https://maps.googleapis.com/maps/api/js?key=${apiKey}", function() { var client = new google.maps.StreetViewService(); callback(client); })
+      loadScript("${mapsScriptUrl || `https://maps.googleapis.com/maps/api/js?key=${apiKey}`}", function() { var client = new google.maps.StreetViewService(); callback(client); })
     }
     </script>
     </html>
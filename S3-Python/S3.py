@@ -11,17 +11,26 @@
 #  streetview panorama, and grabs  #
 #  various images...               #
 ####################################
-import os, sys
+import os
 import math
-import urllib, urllib2
+import time
+import functools
+import threading
+import numpy as np
 import json
 import requests
-from shapely.geometry import Point
 from shapely.geometry import Polygon
-from shapely.geometry.polygon import LinearRing
+from shapely.geometry import box
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+from shapely import vectorized
 from scipy import ndimage
 import cStringIO
 import subprocess
+from lookup_cache import MISSING
+from panorama_workers import LINK_DTYPE, decode_reply
+from road_snapper import RoadSnapper
+from quota_scheduler import QuotaExhausted, STATIC_MAPS, ROADS, STREETVIEW, METADATA
 
 
 # Default Parameters - To be user-specified and overwritten...
@@ -32,6 +41,24 @@ IMAGE_HEIGHT  = '360'
 DEFAULT_PITCH = 0 
 NUM_STEPS     = 1    # Acquire a Single point at each location...
 VERBOSE       = False
+GRID_CHUNK    = 4096 # Grid points generated per chunk...
+COORDINATE_BLOCK = 1 << 20 # Bytes of a coordinate file parsed at a time...
+CACHE         = None # A LookupCache shared by the water, roads and panorama lookups...
+PANORAMA_WORKERS = None # A PanoramaWorkerPool (or NodeEngine); None spawns get_next_panorama.js for every step...
+DOWNLOADER    = None # An ImageDownloader (or NodeEngine); None downloads the images one at a time...
+LAND_MASK     = None # A TiledLandMask; None checks each point with its own 1x1 Static Maps request...
+VISITED       = None # A VisitedPanoramas shared by the walks of a run; None lets walks overlap...
+SCHEDULER     = None # A QuotaScheduler pacing every Google API request; None sends them unpaced...
+MANIFEST      = None # A ManifestWriter recording every saved image; None leaves the filenames as the only record...
+COVERAGE      = None # A CoverageIndex of the panoramas collected; None walks from every snapped road...
+METADATA_GATE = None # A MetadataGate checking the Street View metadata of jobs before download; None downloads every job...
+METRICS       = None # A Metrics timing the stages and API calls of a run; None records nothing...
+SNAPPER       = None # The RoadSnapper filling the Roads requests and passing each road on once; None until road_snapper() sets one...
+SNAPPER_LOCK  = threading.Lock()
+STREETVIEW_URL = 'https://maps.googleapis.com/maps/api/streetview'
+METADATA_URL   = 'https://maps.googleapis.com/maps/api/streetview/metadata'
+STATICMAP_URL  = 'http://maps.googleapis.com/maps/api/staticmap'
+ROADS_URL      = 'https://roads.googleapis.com/v1/nearestRoads'
 
 # Constants - Must be left unchanged!
 GOOGLE_BLUE = (163, 203, 255) # Hopefully this wont change...
@@ -40,42 +67,138 @@ EARTH_RADIUS = 6371.001       # On average...
 NORTH, EAST, SOUTH, WEST = 0, 90, 180, 270
  
 
+class APILimitError(Exception):
+	""" APILimitError
+	Raised when a Google API refuses a call, most likely because its daily limit is exhausted.
+	Carries the API name and the coordinates of the refused call.
+	"""
+	def __init__(self, api, lat, lon):
+		Exception.__init__(self, 'GOOGLE ' + api + ' API LIMIT at coordinates: (' + str(lat) + ', ' + str(lon) + ')')
+		self.api = api
+		self.lat = lat
+		self.lon = lon
+
+def instrumented(name, items = None, size = None):
+	""" instrumented
+	Decorator timing every call of a function as the name stage of the METRICS, when set.
+	items(*args) gives the number of items a call processes (1 by default); size(result) the bytes it moved.
+	Stages nest: the time of a walk includes that of its panorama lookups.
+	"""
+	def decorate(function):
+		@functools.wraps(function)
+		def timed(*args, **kwargs):
+			if METRICS is None: return function(*args, **kwargs)
+			with METRICS.time(name, 1 if items is None else items(*args)) as timer:
+				result = function(*args, **kwargs)
+				if size is not None: timer.bytes = size(result)
+				return result
+		return timed
+	return decorate
+
+def google_get(api, url, lat, lon, **kwargs):
+	""" google_get
+	Sends a GET request to a Google API, paced and retried by the SCHEDULER when set.
+	Each call is timed as the 'api.<api>' stage of the METRICS, when set, with the bytes received
+	(a response other than 200 counts as an error).
+	Raises APILimitError (for the lat,lon of the call) if the SCHEDULER finds the daily budget of the api used up.
+	"""
+	start = time.time()
+	try:
+		response = requests.get(url, **kwargs) if SCHEDULER is None else SCHEDULER.get(api, url, **kwargs)
+	except QuotaExhausted:
+		raise APILimitError(api, lat, lon)
+	except Exception:
+		if METRICS is not None: METRICS.record('api.' + api, time.time() - start, error = True)
+		raise
+	if METRICS is not None: METRICS.record('api.' + api, time.time() - start, size = len(response.content), error = response.status_code != 200)
+	return response
+
+def set_google_url(base_url):
+	""" set_google_url
+	Points the Google API URLs at another server (eg: a fake_google.py server, for offline runs and benchmarks).
+	"""
+	global STREETVIEW_URL, METADATA_URL, STATICMAP_URL, ROADS_URL
+	base_url = base_url.rstrip('/')
+	STREETVIEW_URL = base_url + '/maps/api/streetview'
+	METADATA_URL   = base_url + '/maps/api/streetview/metadata'
+	STATICMAP_URL  = base_url + '/maps/api/staticmap'
+	ROADS_URL      = base_url + '/v1/nearestRoads'
+
 def write_to_file(target_file, data):
         f_write = open(target_file, 'a')
         f_write.write(data + '\n')
         f_write.close()
 
+def coordinate_blocks(filename, block_size = COORDINATE_BLOCK):
+	""" coordinate_blocks
+	Streams the lon,lat lines of a coordinate file, parsed in bulk by NumPy block_size bytes at a time.
+	Fields past the first two (e.g. lon,lat,alt lines) are ignored.
+	Input: The file path + name, and the bytes read per block.
+	Output: A generator of (n, 2) arrays of the lat, lon pairs of each block, in file order.
+	"""
+	with open(filename, 'r') as f:
+		rest = ''
+		while True:
+			block = f.read(block_size)
+			text  = rest + block
+			end   = len(text) if not block else text.rfind('\n') + 1 # Only whole lines, but all of them at the end...
+			rest  = text[end:]
+			lines = text[:end]
+			if lines.strip():
+				yield coordinate_lines(lines, filename)[:, ::-1] # lon,lat --> lat,lon
+			if not block: return
+
+def coordinate_lines(lines, filename):
+	""" coordinate_lines
+	Parses whole lines of comma separated numbers in bulk, whatever the number of fields of each line.
+	Output: An (n, 2) array of the first two fields of each non-blank line.
+	"""
+	if not lines.endswith('\n'): lines += '\n'
+	text   = np.frombuffer(lines, dtype = np.uint8)
+	ends   = np.flatnonzero(text == ord('\n'))
+	commas = np.diff(np.concatenate(([0], np.cumsum(text == ord(','))[ends])))
+	filled = np.diff(np.concatenate(([0], np.cumsum(text > ord(' '))[ends]))) > 0 # Lines that are not blank...
+	fields = commas[filled] + 1
+	values = np.fromstring(lines.replace(',', ' '), dtype = np.float64, sep = ' ')
+	if fields.min() < 2 or len(values) != fields.sum(): raise ValueError('Malformed lon,lat line in ' + filename)
+	starts = np.cumsum(fields) - fields # Index of the first field of each line...
+	return np.column_stack((values[starts], values[starts + 1]))
+
+def load_coordinate_array(filename):
+	""" load_coordinate_array
+	Loads from file the lat,lon coordinate pairs.
+	Output: An (n, 2) array of lat,lon pairs.
+	"""
+	blocks = list(coordinate_blocks(filename))
+	return np.concatenate(blocks) if blocks else np.empty((0, 2))
+
 def load_coordinates(filename):
 	""" load_coordinates
 	Loads from file the lat,lon coordinate pairs.
 	Input: The file path + name
 	Output: List of lat,lon tuples
 	"""
-	coordinates = []
-	f = open(filename, 'r')
-	for line in f:
-		lon = float(line.split(',')[0])
-                lat = float(line.split(',')[1])
-		coordinates.append((lat, lon))
-	return coordinates
+	return [tuple(point) for point in load_coordinate_array(filename).tolist()]
 
 def get_regional_polygon(region_file, cities_files):
 	""" get_regional_polygon
 	Loads the coordinates of the boundingbox of a search region and creates a Polygon object.
 	Also loads each city/region to exlude.
 	Input: The search region filename, a list of filenames for exclusion
-	Output: A Polygon object of the bounding search region, a list of Polygon objects for each exlusion.
+	Output: A Polygon object of the bounding search region, a list of Polygon objects for each exlusion,
+	        and the RegionFilter built over both for bulk validity checks.
 	"""
-	region_poly = Polygon(load_coordinates(region_file))
+	region_poly = Polygon(load_coordinate_array(region_file))
 
 	# Iterated over list of cities files to exclude
 	city_exclusions = []
 	for city_file in cities_files:
-		city_polygon = Polygon(load_coordinates(city_file))
+		city_polygon = Polygon(load_coordinate_array(city_file))
 		city_exclusions.append(city_polygon)
 
-	return region_poly, city_exclusions
+	return region_poly, city_exclusions, RegionFilter(region_poly, city_exclusions)
 
+@instrumented('teleport')
 def teleport(start_lat, start_lon, bearing, distance):
 	"""
     	Input: Start lat, lon, the bearing (usually Cardinal, in degrees), and distance in m.
@@ -97,6 +220,183 @@ def teleport(start_lat, start_lon, bearing, distance):
 
 	return end_lat, end_lon
 
+def teleport_batch(start_lats, start_lons, bearing, distance):
+	""" teleport_batch
+	Vectorized form of teleport: applies the same great-circle step to every lat, lon pair at once.
+	Input: Arrays (or scalars) of start lats, lons, the bearing in degrees and distance(s) in m.
+	Output: Two numpy arrays with the lats, lons at the teleportation points.
+	"""
+	start_lats = np.radians(np.asarray(start_lats, dtype = np.float64))
+	start_lons = np.radians(np.asarray(start_lons, dtype = np.float64))
+	bearing = np.radians(bearing)
+	angle = np.asarray(distance, dtype = np.float64) / 1000 / EARTH_RADIUS
+
+	end_lats = np.arcsin(np.sin(start_lats) * np.cos(angle) + \
+	                     np.cos(start_lats) * np.sin(angle) * np.cos(bearing))
+	end_lons = start_lons + np.arctan2(np.sin(bearing) * np.sin(angle) * np.cos(start_lats), \
+	                                   np.cos(angle) - np.sin(start_lats) * np.sin(end_lats))
+
+	return np.degrees(end_lats), np.degrees(end_lons)
+
+def grid_row_segments(row_lat, west_lon, end_lon, skip_distance, segment_size = GRID_CHUNK):
+	""" grid_row_segments
+	Computes the points of a W-->E row as chained EAST teleports of skip_distance from the western edge.
+	Stepping east along a great circle drifts south: after k steps sin(lat_k) = sin(lat_0) * cos(d)^k,
+	so every step is obtained directly from its index, without a Python-level loop over the points,
+	and the row is produced segment_size points at a time, whatever its length.
+	As in the original loop, the row stops at the first point at or past the eastern edge (inclusive).
+	Input: The row latitude, the western and eastern longitudes, the spacing in m and the points per segment.
+	Output: A generator of (lats, lons) numpy arrays of consecutive points of the row.
+	"""
+	angle = float(skip_distance) / 1000 / EARTH_RADIUS
+	lat_0 = math.radians(row_lat)
+	lon_0 = math.radians(west_lon)
+	end_lon = math.radians(end_lon)
+	if lon_0 >= end_lon: return # Nothing to sample...
+
+	sin_lat_0 = np.sin(lat_0)
+	# The first segment is sized to the row (its first step is the longest in longitude, plus a few for the
+	# drift), so short rows do not pay for segment_size points. Should the row not end within it, the segment
+	# is redone at segment_size, keeping the segments (and chunk columns) those of the row at full size.
+	size  = min(segment_size, int((end_lon - lon_0) * math.cos(lat_0) / angle) + 2)
+	first = 1
+	total = 0.0 # Longitude covered by the steps of the prior segments...
+	while True:
+		steps = np.arange(first, first + size, dtype = np.float64)
+		sin_lats = sin_lat_0 * np.power(math.cos(angle), steps)
+		prior_sin_lats = sin_lat_0 * np.power(math.cos(angle), steps - 1)
+		if first == 1: prior_sin_lats[0] = math.sin(lat_0)
+		step_lons = np.arctan2(math.sin(angle) * np.sqrt(1 - prior_sin_lats ** 2), \
+		                       math.cos(angle) - prior_sin_lats * sin_lats)
+		# Accumulated from the prior segments' total, as a single cumsum over the whole row would...
+		covered = np.cumsum(np.concatenate(([total], step_lons)))[1:]
+		row_lons = lon_0 + covered
+		row_lats = np.arcsin(sin_lats)
+
+		past_edge = np.nonzero(row_lons >= end_lon)[0]
+		if len(past_edge) != 0:
+			yield np.degrees(row_lats[:past_edge[0] + 1]), np.degrees(row_lons[:past_edge[0] + 1])
+			return
+		if size < segment_size:
+			size = segment_size # Longer than estimated...
+			continue
+		yield np.degrees(row_lats), np.degrees(row_lons)
+		first += segment_size
+		total = covered[-1]
+
+def grid_row(row_lat, west_lon, end_lon, skip_distance):
+	""" grid_row
+	The whole W-->E row of grid_row_segments at once.
+	Output: Two numpy arrays with the lats, lons of the row.
+	"""
+	segments = list(grid_row_segments(row_lat, west_lon, end_lon, skip_distance))
+	if not segments: return np.empty(0), np.empty(0)
+	return np.concatenate([lats for lats, lons in segments]), np.concatenate([lons for lats, lons in segments])
+
+def grid_chunks(bounding_box, skip_distance, start_lat = None, chunk_size = GRID_CHUNK, window = None):
+	""" grid_chunks
+	Generates the search grid over a bounding box from N-->S and W-->E, identically to repeated calls of teleport:
+	each row starts one SOUTH step below the last point of the prior row, at the western edge.
+	Rows are generated chunk by chunk, so memory stays bounded by chunk_size however large the region.
+	With a window (S, W, N, E), only the grid points in [S, N) x [W, E) are yielded: the rows are still laid out
+	over the whole bounding box (so a shard gets the very points of the full grid), but those north of the window
+	are only stepped over and the sweep ends below it.
+	Input: The bounds (S, W, N, E) of the search region, the spacing in m, an optional latitude to
+	       restart from (replaces N), the maximum number of points per chunk and an optional window.
+	Output: A generator of (row, col, lats, lons): the row number, the column of the first point of the chunk
+	        and the numpy arrays of at most chunk_size points. (row, col) identifies a chunk for a given grid.
+	"""
+	south, west, north, east = bounding_box
+	cur_lat = north if start_lat is None else start_lat
+	row = 0
+	while cur_lat > south:
+		row_lat = cur_lat - math.degrees(float(skip_distance) / 1000 / EARTH_RADIUS) # Due SOUTH: along the meridian
+		if window is not None and row_lat < window[0]: return # The rest of the grid is south of the window...
+		col = 0
+		for lats, lons in grid_row_segments(row_lat, west, east, skip_distance, chunk_size):
+			if window is None:
+				yield row, col, lats, lons
+			elif lats[0] >= window[0] and lats[-1] < window[2]:
+				# Along a row lons increase and lats decrease: the points in the window are consecutive...
+				inside = np.flatnonzero((lats >= window[0]) & (lats < window[2]) & (lons >= window[1]) & (lons < window[3]))
+				if len(inside):
+					first, last = int(inside[0]), int(inside[-1]) + 1
+					yield row, col + first, lats[first:last], lons[first:last]
+			col += len(lats)
+		if col == 0: return # Empty bounding box...
+		cur_lat = lats[-1]
+		row += 1
+
+def grid_points(bounding_box, skip_distance, start_lat = None, chunk_size = GRID_CHUNK):
+	""" grid_points
+	grid_chunks without the chunk positions.
+	Output: A generator of (lats, lons) numpy array pairs, each holding at most chunk_size points.
+	"""
+	for row, col, lats, lons in grid_chunks(bounding_box, skip_distance, start_lat, chunk_size):
+		yield lats, lons
+
+class RegionFilter(object):
+	""" RegionFilter
+	Bulk form of regional_validity, built once per search region by get_regional_polygon.
+	The region and exclusions are prepared geometries and the exclusions are indexed in an STRtree,
+	so a chunk of grid points is only tested against the exclusions whose bounds it overlaps.
+	A tile (S, W, N, E) restricts the valid points to [S, N) x [W, E): the share of a sharded survey.
+	"""
+	def __init__(self, region, exclusions, tile = None):
+		self.region     = region
+		self.exclusions = list(exclusions)
+		self.tile       = tile
+		self.prepared_region     = prep(region)
+		self.prepared_exclusions = [prep(city) for city in self.exclusions]
+		self.exclusion_tree      = STRtree(self.exclusions) if self.exclusions else None
+		self.exclusion_index     = dict((id(city), i) for i, city in enumerate(self.exclusions))
+
+	def grid_window(self):
+		""" grid_window
+		The window of grid_chunks holding every point the filter may keep: the tile, within the region bounds (None without a tile).
+		"""
+		if self.tile is None: return None
+		south, west, north, east = self.region.bounds
+		return (max(south, self.tile[0]), max(west, self.tile[1]), min(north, self.tile[2]), min(east, self.tile[3]))
+
+	def candidate_exclusions(self, lats, lons):
+		""" candidate_exclusions
+		Returns the indices of the exclusions whose envelopes intersect the bounding box of the points.
+		"""
+		if self.exclusion_tree is None or len(lats) == 0: return []
+		hits = self.exclusion_tree.query(box(lats.min(), lons.min(), lats.max(), lons.max()))
+		# Shapely < 2.0 returns the geometries, Shapely >= 2.0 their indices...
+		return sorted(int(h) if isinstance(h, (int, long, np.integer)) else self.exclusion_index[id(h)] for h in hits)
+
+	@instrumented('region_mask', items = lambda self, lats, lons: len(lats))
+	def mask(self, lats, lons):
+		""" mask
+		Input: Arrays of lats, lons.
+		Output: A boolean array, True where the point is inside the region (and tile) and outside all exclusions.
+		"""
+		lats = np.asarray(lats, dtype = np.float64)
+		lons = np.asarray(lons, dtype = np.float64)
+		if self.tile is None:
+			inside = vectorized.contains(self.prepared_region, lats, lons)
+		else:
+			south, west, north, east = self.tile
+			inside = (lats >= south) & (lats < north) & (lons >= west) & (lons < east)
+			if inside.any(): inside[inside] = vectorized.contains(self.prepared_region, lats[inside], lons[inside])
+		if not inside.any(): return inside
+
+		for i in self.candidate_exclusions(lats[inside], lons[inside]):
+			min_lat, min_lon, max_lat, max_lon = self.exclusions[i].bounds
+			query = inside & (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+			if query.any(): inside[query] = ~vectorized.contains(self.prepared_exclusions[i], lats[query], lons[query])
+		return inside
+
+	def is_valid(self, lat, lon):
+		""" is_valid
+		Scalar convenience wrapper around mask; equivalent to regional_validity(Point(lat, lon), ...).
+		"""
+		return bool(self.mask([lat], [lon])[0])
+
+@instrumented('regional_validity')
 def regional_validity(query_point, regional_inclusion, regional_exclusions):
 	""" regional_validity
 	Returns whether a coordinate point is inside a polygon and outside of excluded regions.
@@ -111,88 +411,208 @@ def regional_validity(query_point, regional_inclusion, regional_exclusions):
 		return True
 	return False
 
+@instrumented('land_validity')
 def land_validity(lat, lon):
 	""" land_validity
 	Returns whether a lat,lon pair are over land (not over water) or not.
 	Input: A latitude and longitude value.
 	Output: True if the coordinates are NOT over water, False otherwise.
 	"""
+	if LAND_MASK is not None: return bool(LAND_MASK.land_mask([lat], [lon])[0])
 	r, g, b = google_check_over_water(lat, lon)
         if (r, g, b) == GOOGLE_BLUE: return False
 	return True
 
-def get_forward_path_images(coord_path, path_ref):
+@instrumented('land_mask', items = lambda lats, lons, candidates: int(np.count_nonzero(candidates)))
+def land_validity_mask(lats, lons, candidates):
+	""" land_validity_mask
+	Bulk form of land_validity, only evaluated for the candidate points (e.g. those inside the region).
+	With a LAND_MASK, all the candidates of a block are classified from a single map tile.
+	Input: Arrays of lats, lons, and a boolean array of the points to check.
+	Output: A boolean array, True where the point is a candidate and NOT over water.
+	"""
+	valid = np.zeros(len(lats), dtype = bool)
+	if LAND_MASK is not None:
+		valid[candidates] = LAND_MASK.land_mask(np.asarray(lats)[candidates], np.asarray(lons)[candidates])
+		return valid
+	for i in np.nonzero(candidates)[0]: valid[i] = land_validity(float(lats[i]), float(lons[i]))
+	return valid
+
+def get_forward_path_images(coord_path, path_ref, jobs = None):
 	""" get_forward_path_images
 	Iterates over all coordinate points in a series and acquires the forward-facing google street view image.
-	Input: List of lat,lon,heading tuples corresponding to a walked series of adjacent panoramas; path reference id for this unique series.
+	Input: List of lat,lon,heading,pano tuples corresponding to a walked series of adjacent panoramas; path reference id for this unique series;
+	       optionally a list to append the (lat, lon, heading, filename, ref, step, pano) download jobs to instead of downloading them now.
 	Output: None. Saves all the files to the IMG_DIR
 	"""
+	path_jobs = []
 	for step in range(1, len(coord_path)): # Ignore the initial point with non-meaningful heading...
-        	step_lat      = str(coord_path[step][0])
-                step_lon      = str(coord_path[step][1])
-                step_heading  = str(coord_path[step][2])
-                write_to_file(true_file, step_lat + ',' + step_lon + ',truepnt_' + str(true_count) + '_step_' + str(step))
+		step_lat      = str(coord_path[step][0])
+		step_lon      = str(coord_path[step][1])
+		step_heading  = str(coord_path[step][2])
+		step_pano     = coord_path[step][3] if len(coord_path[step]) > 3 else None
 
-                # Create Unique Filename
-                filename = IMG_DIR + 'img_ref_' + str(path_ref) + '_stp_' + str(step) + '_lat_' + step_lat + '_lon_' + step_lon + '_hdg_' + str(step_heading) + '.jpg'
+		# Create Unique Filename
+		filename = IMG_DIR + 'img_ref_' + str(path_ref) + '_stp_' + str(step) + '_lat_' + step_lat + '_lon_' + step_lon + '_hdg_' + str(step_heading) + '.jpg'
 
-                # Here we now grab the image and build up our automatic dataset!
-                if VERBOSE: print 'Saving Image : ' + filename
-		request_and_save(IMAGE_WIDTH, IMAGE_HEIGHT, step_lat, step_lon, step_heading, DEFAULT_PITCH, API_KEY, filename)
+		# Here we now grab the image and build up our automatic dataset!
+		if VERBOSE: print 'Saving Image : ' + filename
+		path_jobs.append((step_lat, step_lon, step_heading, filename, path_ref, step, step_pano))
 
+	if jobs is None: download_images(path_jobs)
+	else:            jobs.extend(path_jobs)
 
-def get_bidirectional_path_images(coord_path, path_ref):
-        """ get_bidirectional_path_images
-        Iterates over all coordinate points in a series and acquires both the forward-facing and rear-facing google street view image.
-        Input: List of lat,lon,heading tuples corresponding to a walked series of adjacent panoramas; path reference id for this unique series.
-        Output: None. Saves all the files to the IMG_DIR
-        """
-        for step in range(0, len(coord_path)): # Ignore the initial point with non-meaningful heading...'
-                step_lat      = str(coord_path[step][0])
-                step_lon      = str(coord_path[step][1])
-                step_hdg_f    = str(coord_path[step][2])
+
+def get_bidirectional_path_images(coord_path, path_ref, jobs = None):
+	""" get_bidirectional_path_images
+	Iterates over all coordinate points in a series and acquires both the forward-facing and rear-facing google street view image.
+	Input: List of lat,lon,heading,pano tuples corresponding to a walked series of adjacent panoramas; path reference id for this unique series;
+	       optionally a list to append the (lat, lon, heading, filename, ref, step, pano) download jobs to instead of downloading them now.
+	Output: None. Saves all the files to the IMG_DIR
+	"""
+	path_jobs = []
+	for step in range(0, len(coord_path)): # Ignore the initial point with non-meaningful heading...'
+		step_lat      = str(coord_path[step][0])
+		step_lon      = str(coord_path[step][1])
+		step_hdg_f    = str(coord_path[step][2])
 		step_hdg_r    = str(float(step_hdg_f) + 180)
+		step_pano     = coord_path[step][3] if len(coord_path[step]) > 3 else None
 
-                # Create Unique Filename
-                filename_f = IMG_DIR + 'img_ref_' + str(path_ref) + '_stp_' + str(step) + '_lat_' + step_lat + '_lon_' + step_lon + '_hdg_' + str(step_hdg_f) + '.jpg'
+		# Create Unique Filename
+		filename_f = IMG_DIR + 'img_ref_' + str(path_ref) + '_stp_' + str(step) + '_lat_' + step_lat + '_lon_' + step_lon + '_hdg_' + str(step_hdg_f) + '.jpg'
 		filename_r = IMG_DIR + 'img_ref_' + str(path_ref) + '_stp_' + str(step) + '_lat_' + step_lat + '_lon_' + step_lon + '_hdg_' + str(step_hdg_r) + '.jpg'
-                
+
 		# Here we now grab the image and build up our automatic dataset!
-                if VERBOSE: print 'Saving Images : ' + filename_f + '\t' + filename_r
-                request_and_save(IMAGE_WIDTH, IMAGE_HEIGHT, step_lat, step_lon, step_hdg_f, DEFAULT_PITCH, API_KEY, filename_f)
-		request_and_save(IMAGE_WIDTH, IMAGE_HEIGHT, step_lat, step_lon, step_hdg_r, DEFAULT_PITCH, API_KEY, filename_r)
+		if VERBOSE: print 'Saving Images : ' + filename_f + '\t' + filename_r
+		path_jobs.append((step_lat, step_lon, step_hdg_f, filename_f, path_ref, step, step_pano))
+		path_jobs.append((step_lat, step_lon, step_hdg_r, filename_r, path_ref, step, step_pano))
+
+	if jobs is None: download_images(path_jobs)
+	else:            jobs.extend(path_jobs)
 
 
 def process_batch_coordinates(roads_list):
 	""" process_batch_coordinates
 	For the coordinate input we run the walk_algorithm and acquire corresponding images.
+	The images of every walk in the batch are downloaded together once all walks are done.
 	Input: List of lat,lon pairs corresponding to roads.
 	Output: None; all images are saved to IMG_DIR.
 	"""
-	for coord in roads_list:
-        	if coord == None:
-                        #write_to_file(false_file, str(cur_lon) + ',' + str(cur_lat) + ',false_pnt' + str(false_count))
-                        continue
-		# Unpack, get path coordinates, grab corresponding Street View images!
-                road_lat, road_lon = coord
-                path = walk_algorithm(road_lat, road_lon, NUM_STEPS)
-                get_bidirectional_path_images(path, 0) # TODO: Put a reference counter here...
+	download_images(batch_jobs(roads_list))
+
+def batch_jobs(roads_list, grid_list = None):
+	""" batch_jobs
+	Runs the walk_algorithm from every road of a batch.
+	Input: List of lat,lon pairs corresponding to roads (None entries are skipped), and optionally the
+	       grid points they were snapped from.
+	Output: The list of (lat, lon, heading, filename, ref, step, pano, grid_lat, grid_lon) download jobs of all the walks.
+	"""
+	return [job for jobs in batch_walks(roads_list, grid_list) for job in jobs]
+
+def batch_walks(roads_list, grid_list = None):
+	""" batch_walks
+	batch_jobs, with the download jobs of each road kept apart.
+	Roads within the radius of the COVERAGE already collected, when set, are skipped too.
+	Output: The list of the download jobs of the walk from each road of roads_list, in order; empty for the roads skipped.
+	"""
+	walks = [[] for _ in roads_list]
+	grid_list = grid_list or [(None, None)] * len(roads_list)
+	roads = [(i, coord, grid) for i, (coord, grid) in enumerate(zip(roads_list, grid_list)) if coord != None]
+	if COVERAGE is not None: roads = [(i, coord, grid) for i, coord, grid in roads if COVERAGE.claim(coord[0], coord[1])]
+	# The first step of every walk of the batch is looked up at once...
+	start_links = adjacent_points_many([coord for i, coord, grid in roads]) if int(NUM_STEPS) > 0 else [None] * len(roads)
+	for (i, (road_lat, road_lon), grid), links in zip(roads, start_links):
+		# Get path coordinates, grab corresponding Street View images!
+		path = walk_algorithm(road_lat, road_lon, NUM_STEPS, VISITED, links)
+		if COVERAGE is not None: COVERAGE.add([step[:2] for step in path[1:]])
+		path_jobs = []
+		get_bidirectional_path_images(path, 0, path_jobs) # TODO: Put a reference counter here...
+		walks[i] = [job + tuple(grid) for job in path_jobs]
+	return walks
+
+def download_images(jobs, saved = None):
+	""" download_images
+	Acquires the Street View image of every (lat, lon, heading, filename, ...) job.
+	Uses the concurrent DOWNLOADER when set; otherwise downloads one at a time with request_and_save.
+	With a METADATA_GATE, jobs without imagery or repeating an image already taken are skipped.
+	Every image saved is recorded in the MANIFEST when set, and passed to saved(filename, bytes) if given
+	(eg: to journal it), before an APILimitError is raised for the images the Street View API refused.
+	The images saved and failed are counted in the METRICS.
+	Output: A list of (filename, bytes written, error) in job order, for the jobs not skipped; bytes is None on error.
+	"""
+	if METADATA_GATE is not None: jobs = metadata_filter(jobs)
+	if DOWNLOADER is None:
+		results = []
+		for lat, lon, heading, filename in [job[:4] for job in jobs]:
+			try:
+				request_and_save(IMAGE_WIDTH, IMAGE_HEIGHT, lat, lon, heading, DEFAULT_PITCH, API_KEY, filename)
+				results.append((filename, os.path.getsize(filename), None))
+			except (IOError, OSError) as err:
+				results.append((filename, None, err))
+			except APILimitError as err:
+				results.append((filename, None, err))
+				break # The images saved so far are recorded first...
+	else:
+		queries = [streetview_query(IMAGE_WIDTH, IMAGE_HEIGHT, job[0], job[1], job[2], DEFAULT_PITCH, API_KEY) for job in jobs]
+		results = DOWNLOADER.download(zip(queries, [job[3] for job in jobs]))
+
+	refused = None
+	for (filename, size, error), job in zip(results, jobs):
+		if isinstance(error, QuotaExhausted): error = APILimitError(error.api, job[0], job[1])
+		if isinstance(error, APILimitError):
+			refused = refused or error
+			continue
+		if error is not None and VERBOSE: print 'Failed Image : ' + filename + ' (' + str(error) + ')'
+		if error is None and MANIFEST is not None: MANIFEST.append(manifest_row(job, size))
+		if error is None and saved is not None: saved(filename, size)
+		if METRICS is not None: METRICS.count('images_saved' if error is None else 'images_failed')
+	if refused is not None: raise refused
+	return results
+
+@instrumented('metadata_gate', items = len)
+def metadata_filter(jobs):
+	return METADATA_GATE.filter(jobs)
+
+def manifest_row(job, size):
+	""" manifest_row
+	The manifest row of a saved image from its download job (the grid point is NaN for walks without one).
+	"""
+	lat, lon, heading, filename, ref, step, pano, grid_lat, grid_lon = job
+	nan = float('nan')
+	return (ref, step, float(lat), float(lon), float(heading), pano or '', \
+	        nan if grid_lat is None else grid_lat, nan if grid_lon is None else grid_lon, time.time(), size, filename)
 
 def google_check_over_water(lat, lon):
-	query = 'http://maps.googleapis.com/maps/api/staticmap?center=' + \
+	if CACHE is not None:
+		cached = CACHE.get('water', lat, lon, (20,))
+		if cached is not MISSING: return tuple(cached)
+
+	query = STATICMAP_URL + '?center=' + \
 		 str(lat) + ',' + str(lon) + \
 		 '&zoom=' + str(20) + '&size=1x1&maptype=roadmap&sensor=false&key=' + API_KEY
 	
 	# Submit Query, Obtain response, format as image, return R,G,B components
-	try:
-		f = cStringIO.StringIO(urllib2.urlopen(query).read())
-	except urllib2.HTTPError:
-		print 'GOOGLE Static Maps API LIMIT\nRestart the search at the following coordiantes: (' + str(lat) + ', ' + str(lon) + ')'
-		email_notification()
-                sys.exit(0)
-		
+	response = google_get(STATIC_MAPS, query, lat, lon)
+	if response.status_code != 200: raise APILimitError('Static Maps', lat, lon)
+	f = cStringIO.StringIO(response.content)
+
 	image = ndimage.imread(f, mode='RGB')[0][0]
-        return image[0], image[1], image[2]
+	rgb = int(image[0]), int(image[1]), int(image[2])
+	if CACHE is not None: CACHE.put('water', lat, lon, rgb, (20,))
+        return rgb
+
+def google_static_map_tile(lat, lon, zoom, size):
+	""" google_static_map_tile
+	Fetches the size x size roadmap centered at lat,lon (without labels, which would hide water), for a TiledLandMask.
+	Output: The decoded size x size x 3 RGB array.
+	"""
+	query = STATICMAP_URL + '?center=' + \
+		 str(lat) + ',' + str(lon) + \
+		 '&zoom=' + str(zoom) + '&size=' + str(size) + 'x' + str(size) + \
+		 '&maptype=roadmap&style=element:labels%7Cvisibility:off&sensor=false&key=' + API_KEY
+	response = google_get(STATIC_MAPS, query, lat, lon)
+	if response.status_code != 200: raise APILimitError('Static Maps', lat, lon)
+	return ndimage.imread(cStringIO.StringIO(response.content), mode='RGB')
 
 # Legacy. Kept around for one-off API calls...
 def google_snap_to_nearest_road(lat, lon):
@@ -200,10 +620,10 @@ def google_snap_to_nearest_road(lat, lon):
 	Calls the Google Roads API which returns the coordinates of the nearest road to a lat,lon point.
 	CAUTION: Consumes one request of the 2500 Request/Day limit of the Free developper api.
 	"""
-	query = 'https://roads.googleapis.com/v1/nearestRoads?' + \
+	query = ROADS_URL + '?' + \
 		'points=' + str(lat) + ',' + str(lon) + \
 		'&key=' + API_KEY
-	response = json.loads(requests.get(query).text)
+	response = json.loads(google_get(ROADS, query, lat, lon).text)
         
 	if not response: # Empty dictionaries evaluate to False
 		return None, None
@@ -213,152 +633,279 @@ def google_snap_to_nearest_road(lat, lon):
 		return road_lat, road_lon
 
 	except KeyError: # Likely due to hitting the limits of the Google Roads API
-		print 'GOOGLE ROADS API LIMIT\nRestart the search at the following coordiantes: (' + str(lat) + ', ' + str(lon) + ')'
-		sys.exit(0)
+		raise APILimitError('Roads', lat, lon)
 	
 def google_snap_to_nearest_road_batch(latlon_list):
         """ google_snap_to_nearrest_road_batch
         Optimizes the calls to the Google Roads API by submitting batches of 100 lat,lon pairs at a time.
-        Need to extract the corresponding results from the returned JSON object.
         Input: A list of 100 tuples of lat,lon pairs
         Output: A list of 100 new tuples of lat,lon pairs corresponding to nearest roads.
 		The last if multiple snapped roads; None if nothing returned.
+		Looked up by the road_snapper(), which answers the points snapped before locally (or from the CACHE).
         """
-        points = '|'.join([str(coord[0]) + ',' + str(coord[1]) for coord in latlon_list])
-        query = 'https://roads.googleapis.com/v1/nearestRoads?' + \
-                'points=' + points + \
-                '&key=' + API_KEY
-        response = json.loads(requests.get(query).text)
-        response_list = [None] * len(latlon_list) # Initialize output list...
-        for r in response['snappedPoints']:
-        	response_list[r['originalIndex']] = (r['location']['latitude'], r['location']['longitude'])
+	return [roads[-1] if roads else None for roads in road_snapper().snap(latlon_list)]
 
-	return response_list
+@instrumented('snap_batch', items = len)
+def google_nearest_roads(latlon_list):
+	""" google_nearest_roads
+	Calls the Google Roads API once for a list of up to BATCH_LIMIT lat,lon pairs.
+	Output: The list of every road (lat, lon) snapped from each pair, in order; empty if nothing was returned.
+	"""
+	points = '|'.join([str(lat) + ',' + str(lon) for lat, lon in latlon_list])
+	query = ROADS_URL + '?' + \
+		'points=' + points + \
+		'&key=' + API_KEY
+	try:
+		reply    = google_get(ROADS, query, latlon_list[0][0], latlon_list[0][1])
+		response = json.loads(reply.text) if reply.status_code == 200 else {'error': reply.status_code}
+	except (requests.RequestException, ValueError): # No answer (or not JSON) once the retries are spent...
+		response = {'error': None}
+	if 'error' in response: # Likely due to hitting the limits of the Google Roads API: stop, to be resumed
+		raise APILimitError('Roads', latlon_list[0][0], latlon_list[0][1])
+	roads = [[] for _ in latlon_list]
+	for r in response.get('snappedPoints', []): # Empty dictionaries: nothing snapped
+		roads[r['originalIndex']].append((r['location']['latitude'], r['location']['longitude']))
+	return roads
+
+def road_snapper():
+	""" road_snapper
+	Returns the SNAPPER, first setting it to a RoadSnapper of google_nearest_roads with the defaults if unset.
+	"""
+	global SNAPPER
+	with SNAPPER_LOCK:
+		if SNAPPER is None: SNAPPER = RoadSnapper(google_nearest_roads, BATCH_LIMIT, cache = CACHE)
+	return SNAPPER
+
+def snap_roads(latlon_list, lookahead = None):
+	""" snap_roads
+	Snaps a batch of grid points to their roads with the road_snapper(): full requests of the points not
+	snapped before (filled with lookahead(n), the next n points due), every road found, each road once per run.
+	Output: A list of (road lat, road lon, grid lat, grid lon), one per road to walk from.
+	"""
+	return road_snapper().snap_batch(latlon_list, lookahead)
 
 def coordinate_distance(lat1, lon1, lat2, lon2):
 	""" coordinate_distance
 	Computes the Equirectangular approximation of the distance between two coordinate points.
+	lat2, lon2 may also be numpy arrays, giving the distance from lat1, lon1 to each of their points.
 	Returns: Distance, d, in planar space.
 	"""
-	x = (lon2 - lon1) * math.cos((lat1 + lat2) / 2)
+	x = (lon2 - lon1) * np.cos((lat1 + lat2) / 2)
 	y = lat2 - lat1
-	d = math.sqrt(x ** 2 + y ** 2) * EARTH_RADIUS
+	d = np.sqrt(x ** 2 + y ** 2) * EARTH_RADIUS
 	return d
 
-def walk_algorithm(start_lat, start_lon, num_steps):
+class VisitedPanoramas(object):
+	""" VisitedPanoramas
+	The lat,lon pairs and pano ids already on the path of some walk of a run, shared by all its walks
+	so that walks from neighbouring roads do not step onto (and download) the same panoramas twice.
+	Safe to share between threads.
+	"""
+	def __init__(self):
+		self.coords = set()
+		self.panos  = set()
+		self.lock   = threading.Lock()
+
+	def claim(self, coord, pano = None):
+		""" claim
+		Marks a panorama visited.
+		Output: False if another walk already visited it, True otherwise.
+		"""
+		with self.lock:
+			if coord in self.coords or (pano is not None and pano in self.panos): return False
+			self.coords.add(coord)
+			if pano is not None: self.panos.add(pano)
+			return True
+
+	def restore(self, jobs):
+		""" restore
+		Marks visited the panoramas of the (lat, lon, heading, filename, ref, step, pano, ...) download jobs of earlier walks
+		(eg: those journaled by the run resumed).
+		"""
+		with self.lock:
+			for job in jobs:
+				self.coords.add((float(job[0]), float(job[1])))
+				if len(job) > 6 and job[6] is not None: self.panos.add(job[6])
+
+@instrumented('walk')
+def walk_algorithm(start_lat, start_lon, num_steps, visited = None, start_links = None):
 	""" walk_algorithm
-	
-	Returns: An array of tuples with each lat,lon,heading relative to the prior.
+	Walks up to num_steps adjacent panoramas from the start, stepping each time to the unvisited
+	panorama maximizing the distance from the current one.
+	Cycles are prevented with a set of the lat,lon pairs and pano ids on the path, so each step costs
+	the same however long the walk, and the path is kept in an array sized for the whole walk.
+	visited: optional VisitedPanoramas shared by the walks of a run; panoramas already visited by another
+	walk are skipped, and a start already visited gives an empty path.
+	start_links: optional adjacent_points of the start, when already looked up.
+	Returns: An array of tuples with each lat,lon,heading relative to the prior, and the pano id (None for the start).
 	"""
-	cur_lat = start_lat
-	cur_lon = start_lon
-	
-	path = [(cur_lat, cur_lon, 0)] # Initialize a dummy heading to remain consistent
-	while num_steps > 0:
-		num_steps -= 1
-		data = adjacent_points(cur_lat, cur_lon)
-		
-		# Get matching lists for each element...
-		keys, headings, panos, coords = process_data(data)
-		
-		# Prevent Cycles: If the lat,lon pair already exist on the path, remove it...
-		# CAUTION: This becomes a bottleneck when creating long paths! ==> O(n^2) comparisons...
-		for prior_lat, prior_lon, prior_heading in path:
-			if (prior_lat, prior_lon) in coords: coords.remove((prior_lat, prior_lon))
-		
+	num_steps = int(num_steps)
+	if visited is not None and not visited.claim((start_lat, start_lon)): return []
+
+	path = np.empty((num_steps + 1, 3)) # lat, lon, heading of every step...
+	path[0] = start_lat, start_lon, 0
+	length = 1
+	path_panos  = [None] # The pano id of every step (unknown for the start)...
+	seen_coords = set([(start_lat, start_lon)])
+	seen_panos  = set()
+	while length <= num_steps:
+		cur_lat, cur_lon = path[length - 1, :2].tolist()
+		links = start_links if length == 1 and start_links is not None else adjacent_points(cur_lat, cur_lon)
+		if links is None: break # The lookup failed...
+		coords = zip(links['lat'].tolist(), links['lon'].tolist())
+		panos  = links['pano'].tolist()
+
+		# Prevent Cycles: drop the candidates already on this path...
+		candidates = [i for i in range(len(links)) if coords[i] not in seen_coords and panos[i] not in seen_panos]
+
 		# Theoretically there will always be a remaining coordinate on a mapped bi-directional road...
 		# Otherwise we hit a dead-end or more specifically, the end of the mapping.
-		if not coords: return path # The list is empty so simply return the existing path
-
-		# Select the coordinate pair that maximizes the distance from the prior point
-		dists = [abs(coordinate_distance(cur_lat, cur_lon, x[0], x[1])) for x in coords]
-		idx = dists.index(max(dists))
-		
-		# Grab the new coords and heading based on the mazimizing distance from index, idx
-		cur_lat, cur_lon = coords[idx]
-		heading = headings[idx]		
-		path.append((cur_lat, cur_lon, heading))
-		
+		if not candidates: break
+
+		# Select the coordinate pair that maximizes the distance from the prior point, or the
+		# farthest one not already visited by another walk.
+		dists = coordinate_distance(cur_lat, cur_lon, links['lat'][candidates], links['lon'][candidates])
+		chosen = None
+		for i in np.argsort(-dists, kind = 'mergesort'):
+			idx = candidates[i]
+			if visited is None or visited.claim(coords[idx], panos[idx]):
+				chosen = idx
+				break
+		if chosen is None: break # Every way on is already covered by another walk...
+
+		seen_coords.add(coords[chosen])
+		seen_panos.add(panos[chosen])
+		path[length] = coords[chosen][0], coords[chosen][1], links['heading'][chosen]
+		path_panos.append(panos[chosen])
+		length += 1
+
+	# Plain floats, and the dummy initial heading of 0, keep the image filenames unchanged.
+	path = [tuple(step) + (pano,) for step, pano in zip(path[:length].tolist(), path_panos)]
+	path[0] = (start_lat, start_lon, 0, None)
+
 	# Uncomment to check out path...
 	#for i in range(len(path)): print str(i) + ',' + str(path[i][0]) + ',' + str(path[i][1]) + ',' + str(path[i][2])
 	return path
 
-def process_data(stream_output):
-	""" process_data
-	Processes the streamed output of the adjacent_points function which calls the get_next_panorama.js function.
-	Reformatting the output of that script will require updating the data handling here...
-	Currently, the output stream is ordered as:
-	key:#
-	heading:#
-	pano:char(array)
-	...
-	latlon:###,###
-	latlon:###,###
-
-	The key and latlon pair orderings are conserved.
-
-	TODO :: Rewrite the output to JSON and simply parse it here...
-	"""
-	# TODO :: Intelligently utilize and track the pano ids and key ids
-	# Naively just grabbing the latlon pairs here and their corresponding headings...
-	as_list = stream_output.split('\n')
-	keys     = []
-	headings = []
-	panos    = []
-	coords   = []
-	for elem in as_list: # There is a non-zero probability these terms end up in the pano id...~
-		if   'key'     in elem: keys.append(int(elem.split(':')[1]))
-		elif 'heading' in elem: headings.append(float(elem.split(':')[1]))
-		elif 'pano'    in elem: panos.append(elem.split(':')[1])
-		elif 'latlon'  in elem: coords.append((float(elem.split(':')[1].split(',')[0]), float(elem.split(':')[1].split(',')[1])))
-		# Otherwise simply skip over
-
-	# Our arrays are now populated and the indecies match one another!
-	return keys, headings, panos, coords
-
 def adjacent_points(cur_lat, cur_lon):
 	""" adjacent_points
 	Get the adjacent panoramas, choose the one maximimizing distance from prior
 	In the first point case, the priors will also be the current so first point is chosen
 	Uses: StreetViewPanoramaLocation.getLocation()
-
-	Currently requires a 3 second window for the aquisition of each set of adjacent points due to the JSDOM.
-	The get_next_panorama.js can likely be improved - 3 seconds is acceptable for the present purposes.
+	Output: The LINK_DTYPE (pano, heading, lat, lon) records of the adjacent panoramas; None if the lookup failed.
 	"""
-	args = ['node', './javascript_panoramas/get_next_panorama.js', str(cur_lat), str(cur_lon)]
-        process = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-        output = process.communicate()[0]
-	return output
+	return adjacent_points_many([(cur_lat, cur_lon)])[0]
+
+@instrumented('panorama_links', items = len)
+def adjacent_points_many(latlon_list):
+	""" adjacent_points_many
+	Gets the adjacent panoramas of many locations with a single message: one get_next_panorama.js run,
+	or, when PANORAMA_WORKERS is set, one request per already running panorama_worker.js.
+	Spawning get_next_panorama.js requires a 3 second window for the JSDOM, whatever the number of locations.
+	Output: The LINK_DTYPE records of each location, in order; None where the lookup failed.
+	"""
+	links = [MISSING] * len(latlon_list)
+	if CACHE is not None:
+		for i, (lat, lon) in enumerate(latlon_list):
+			cached = CACHE.get('panorama_links', lat, lon)
+			if cached is not MISSING: links[i] = np.array([tuple(link) for link in cached], dtype = LINK_DTYPE)
+
+	misses = [i for i in range(len(links)) if links[i] is MISSING]
+	if not misses: return links
+	locations = [latlon_list[i] for i in misses]
+	found = PANORAMA_WORKERS.lookup_many(locations) if PANORAMA_WORKERS is not None else get_next_panorama(locations)
+	for i, records in zip(misses, found):
+		links[i] = records
+		# A failed lookup (e.g. JSDOM timed out, UNKNOWN_ERROR, OVER_QUERY_LIMIT) is left to be retried next time:
+		# only OK and ZERO_RESULTS answers are cached...
+		if CACHE is not None and records is not None: CACHE.put('panorama_links', latlon_list[i][0], latlon_list[i][1], records.tolist())
+	return links
+
+def get_next_panorama(latlon_list):
+	""" get_next_panorama
+	Runs get_next_panorama.js once for all the locations and decodes its JSON reply.
+	Output: The LINK_DTYPE records of each location; all None if the script gave no reply.
+	"""
+	args = ['node', './javascript_panoramas/get_next_panorama.js', API_KEY]
+	for lat, lon in latlon_list: args += [repr(lat), repr(lon)]
+	process = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+	output = process.communicate()[0]
+	try:
+		results = decode_reply(output)[1]
+	except ValueError: # No reply: the script was killed before all the lookups completed...
+		results = []
+	return results if len(results) == len(latlon_list) else [None] * len(latlon_list)
 
 def google_check_image_existence(width, height, lat, lon, heading, pitch):
 	"""check_image_existence
 	Submits a Google API query to verify whether an image exists at the
 	specified parameters. Useful when getting the starter coordinates
 	for the curated dataset. 
+	The metadata only depends on the location: width, height, heading and pitch are not needed.
 	RETURN: True if image is present, False if not.
 	"""
-	query = 'https://maps.googleapis.com/maps/api/streetview/metadata?size=' + \
-		 str(width) + 'x' + str(height) + \
-		 '&location=' + str(lat) + ',' + str(lon) + \
-		 '&heading='  + str(heading) + '&pitch=' + str(pitch) + \
-		 '&key=' + API_KEY
-	response = json.loads(requests.get(query).text)
+	response = streetview_metadata(lat, lon)
+	if response is None: return False
 	print 'JSON Status Field: ' + response['status']
-
-def request_and_save(width, height, lat, lon, heading, pitch, key, filename):
-	query = 'https://maps.googleapis.com/maps/api/streetview?size=' + \
+	return response['status'] == 'OK'
+
+def streetview_metadata(lat, lon, lookup = None):
+	""" streetview_metadata
+	Looks up the Street View metadata of a location (free of charge, unlike the images).
+	lookup(lat, lon), when given, answers in place of the Metadata API (eg: NodeEngine.metadata, raising QuotaExhausted on its limit).
+	Definitive answers (a panorama, or none) are kept in the CACHE.
+	Output: {'status', 'pano_id'}, the pano_id being None without a panorama; None if the lookup failed.
+	"""
+	if CACHE is not None:
+		cached = CACHE.get('metadata', lat, lon)
+		if cached is not MISSING: return cached
+
+	if lookup is None:
+		result = google_streetview_metadata(lat, lon)
+	else:
+		try:
+			result = lookup(lat, lon)
+		except QuotaExhausted:
+			raise APILimitError(METADATA, lat, lon)
+	if result is None: return None
+
+	if CACHE is not None and result['status'] in ('OK', 'ZERO_RESULTS', 'NOT_FOUND'): CACHE.put('metadata', lat, lon, result)
+	return result
+
+def google_streetview_metadata(lat, lon):
+	""" google_streetview_metadata
+	Calls the Street View Metadata API for a location.
+	Output: {'status', 'pano_id'}; None if the lookup failed.
+	"""
+	query = METADATA_URL + '?location=' + str(lat) + ',' + str(lon) + '&key=' + API_KEY
+	try:
+		response = google_get(METADATA, query, lat, lon)
+		metadata = json.loads(response.text) if response.status_code == 200 else {}
+	except (requests.RequestException, ValueError):
+		return None
+	if 'status' not in metadata: return None
+	return {'status': metadata['status'], 'pano_id': metadata.get('pano_id')}
+
+def streetview_query(width, height, lat, lon, heading, pitch, key):
+	return STREETVIEW_URL + '?size=' + \
 		str(width) + 'x' + str(height) + \
 	        '&location=' + str(lat) + ',' + str(lon) + \
 	        '&heading=' + str(heading) + '&pitch=' + str(pitch) + \
 	        '&key=' + str(key)
-	urllib.urlretrieve(query, filename)
+
+@instrumented('download', size = lambda size: size)
+def request_and_save(width, height, lat, lon, heading, pitch, key, filename):
+	response = google_get(STREETVIEW, streetview_query(width, height, lat, lon, heading, pitch, key), lat, lon)
+	response.raise_for_status()
+	with open(filename, 'wb') as f: f.write(response.content)
+	return len(response.content)
 
 def email_notification():
 	""" email_notification
 	Useful for alerting when an API_LIMIT is hit.
 	Set up with your own SMTP server!
 	"""
-	import smtplib, base64
+	import smtplib
 	server = smtplib.SMTP('', 587)
 	server.login("")
 	msg = "API LIMIT HIT!" 
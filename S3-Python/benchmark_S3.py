@@ -0,0 +1,228 @@
+#!/usr/bin/python
+####################################
+#         benchmark_S3.py          #
+#                                  #
+#  Times the compute-bound parts   #
+#  of the sampler against their    #
+#  original implementations, and   #
+#  whole runs against a local fake #
+#  of the Google APIs...           #
+####################################
+import S3
+import os, sys
+import json
+import time
+import shlex
+import shutil
+import tempfile
+import subprocess
+import argparse
+from fake_google import FakeGoogle, FakeGoogleServer, MAPS_JS_PATH
+from coverage_index import CoverageIndex
+import numpy as np
+from shapely.geometry import Point
+from shapely.geometry import box
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-c', '--coords', help = 'The coordinates bounding the search region (defaults to the --bounds box).', default = None)
+parser.add_argument('-b', '--bounds', help = 'The S,W,N,E bounding box to benchmark over.', default = '44.0,-76.5,44.5,-75.5')
+parser.add_argument('-d', '--epsilon', help = 'The distance between search points in meters.', type = float, default = 100.0)
+parser.add_argument('-n', '--num_exclusions', help = 'The number of synthetic city exclusions for the region filter benchmark.', type = int, default = 50)
+parser.add_argument('-s', '--seed', help = 'The random seed for the synthetic exclusions.', type = int, default = 0)
+parser.add_argument('-cp', '--coverage_points', help = 'The number of panorama locations indexed for the coverage index benchmark.', type = int, default = 1000000)
+parser.add_argument('-cq', '--coverage_queries', help = 'The number of radius queries for the coverage index benchmark.', type = int, default = 100000)
+parser.add_argument('-cr', '--coverage_radius', help = 'The coverage radius in meters.', type = float, default = 20.0)
+parser.add_argument('-e2e', '--end_to_end', help = 'Also run run_S3.py end to end over the synthetic regions, against a local fake of the Google APIs.', action = 'store_true')
+parser.add_argument('-el', '--fake_latency', help = 'Mean seconds the fake Google APIs take to answer.', type = float, default = 0.0)
+parser.add_argument('-ef', '--fake_failure_rate', help = 'Fraction of the fake Google API requests answered with a 503.', type = float, default = 0.0)
+parser.add_argument('-et', '--fake_throttle_rate', help = 'Fraction of the fake Google API requests answered with a 429.', type = float, default = 0.0)
+parser.add_argument('-ew', '--walk_steps', help = 'The walk steps of the end to end runs (above 0 needs node and jsdom for the panorama workers).', type = int, default = 0)
+parser.add_argument('-ea', '--run_args', help = 'More run_S3.py arguments for the end to end runs (eg: "-p 8,2,8,2 -lm 17").', default = '')
+parser.add_argument('-r', '--repeats', help = 'The number of timed repetitions (best is reported).', type = int, default = 3)
+args = parser.parse_args()
+
+# ---------------------------------
+def teleport_loop_grid(bounding_box, skip_distance):
+	""" teleport_loop_grid
+	The original search_area sweep: one scalar teleport per grid point.
+	"""
+	points = []
+	cur_lat = bounding_box[2]
+	while cur_lat > bounding_box[0]:
+		cur_lat, cur_lon = S3.teleport(cur_lat, bounding_box[1], S3.SOUTH, skip_distance)
+		while cur_lon < bounding_box[3]:
+			cur_lat, cur_lon = S3.teleport(cur_lat, cur_lon, S3.EAST, skip_distance)
+			points.append((cur_lat, cur_lon))
+	return np.array(points)
+
+def vectorized_grid(bounding_box, skip_distance):
+	""" vectorized_grid
+	The batched sweep from S3.grid_points, gathered into a single array.
+	"""
+	return np.concatenate([np.column_stack(chunk) for chunk in S3.grid_points(bounding_box, skip_distance)])
+
+def best_time(function, *function_args):
+	""" best_time
+	Returns the best wall time over args.repeats runs and the output of the last run.
+	"""
+	best, output = float('inf'), None
+	for _ in range(args.repeats):
+		start = time.time()
+		output = function(*function_args)
+		best = min(best, time.time() - start)
+	return best, output
+
+def benchmark_grid(bounding_box, skip_distance):
+	loop_time, loop_points = best_time(teleport_loop_grid, bounding_box, skip_distance)
+	grid_time, grid_points = best_time(vectorized_grid, bounding_box, skip_distance)
+
+	print 'Grid Points  : ' + str(len(loop_points)) + ' (loop) / ' + str(len(grid_points)) + ' (vectorized)'
+	print 'Loop Time    : ' + '%.4f' % loop_time + ' s'
+	print 'Vector Time  : ' + '%.4f' % grid_time + ' s'
+	print 'Speedup      : ' + '%.1f' % (loop_time / grid_time) + 'x'
+	if len(loop_points) == len(grid_points):
+		print 'Max Deviation: ' + str(np.abs(loop_points - grid_points).max()) + ' degrees'
+
+def synthetic_exclusions(bounding_box, count):
+	""" synthetic_exclusions
+	Scatters count round 'cities' with radii of 1-5% of the box height over the bounding box.
+	"""
+	random = np.random.RandomState(args.seed)
+	south, west, north, east = bounding_box
+	lats   = random.uniform(south, north, count)
+	lons   = random.uniform(west, east, count)
+	radii  = random.uniform(0.01, 0.05, count) * (north - south)
+	return [Point(lat, lon).buffer(radius) for lat, lon, radius in zip(lats, lons, radii)]
+
+def point_loop_mask(region, exclusions, grid):
+	""" point_loop_mask
+	The original per-point test: a shapely Point and a within() scan over every exclusion.
+	"""
+	return np.array([S3.regional_validity(Point(lat, lon), region, exclusions) for lat, lon in grid])
+
+def filter_mask(region_filter, grid_chunks):
+	""" filter_mask
+	The bulk RegionFilter test, one mask per grid chunk.
+	"""
+	return np.concatenate([region_filter.mask(lats, lons) for lats, lons in grid_chunks])
+
+def benchmark_region_filter(region, bounding_box, skip_distance, num_exclusions):
+	exclusions = synthetic_exclusions(bounding_box, num_exclusions)
+	grid_chunks = list(S3.grid_points(bounding_box, skip_distance))
+	grid = np.concatenate([np.column_stack(chunk) for chunk in grid_chunks])
+
+	build_time, region_filter = best_time(S3.RegionFilter, region, exclusions)
+	loop_time, loop_mask = best_time(point_loop_mask, region, exclusions, grid)
+	mask_time, bulk_mask = best_time(filter_mask, region_filter, grid_chunks)
+
+	print 'Exclusions   : ' + str(num_exclusions)
+	print 'Valid Points : ' + str(loop_mask.sum()) + ' / ' + str(len(grid))
+	print 'Loop Time    : ' + '%.4f' % loop_time + ' s'
+	print 'Filter Time  : ' + '%.4f' % mask_time + ' s (+' + '%.4f' % build_time + ' s to build)'
+	print 'Speedup      : ' + '%.1f' % (loop_time / mask_time) + 'x'
+	print 'Masks Match  : ' + str(bool((loop_mask == bulk_mask).all()))
+
+def benchmark_coverage(bounding_box, num_points, num_queries, radius):
+	random = np.random.RandomState(args.seed)
+	south, west, north, east = bounding_box
+	points  = np.column_stack((random.uniform(south, north, num_points), random.uniform(west, east, num_points)))
+	queries = np.column_stack((random.uniform(south, north, num_queries), random.uniform(west, east, num_queries)))
+
+	index = CoverageIndex(radius)
+	start = time.time()
+	index.add(points.tolist())
+	insert_time = time.time() - start
+	start = time.time()
+	covered = np.array([index.covered(lat, lon) for lat, lon in queries.tolist()])
+	query_time = time.time() - start
+
+	# Brute force distances for a sample of the queries...
+	sample = queries[:200]
+	brute = []
+	for lat, lon in sample:
+		x = np.radians(points[:, 1] - lon) * np.cos(np.radians(lat))
+		y = np.radians(points[:, 0] - lat)
+		brute.append(np.sqrt(x ** 2 + y ** 2).min() * S3.EARTH_RADIUS * 1000 <= radius)
+	brute = np.array(brute)
+
+	print 'Indexed      : ' + str(num_points) + ' points in ' + '%.4f' % insert_time + ' s'
+	print 'Queries      : ' + str(num_queries) + ' in ' + '%.4f' % query_time + ' s (' + '%.1f' % (1e6 * query_time / num_queries) + ' us each), ' + str(covered.sum()) + ' covered'
+	print 'Brute Match  : ' + str(bool((brute == covered[:len(sample)]).all())) + ' (' + str(len(sample)) + ' queries)'
+
+# The fixed synthetic regions of the end to end benchmark: (region, exclusions) as lat,lon rings...
+SYNTHETIC_REGIONS = {
+	'square': ([(45.30, -75.80), (45.30, -75.77), (45.32, -75.77), (45.32, -75.80)],
+	           [[(45.305, -75.79), (45.305, -75.78), (45.315, -75.78), (45.315, -75.79)]]),
+	'cities': ([(45.40, -75.70), (45.40, -75.66), (45.43, -75.64), (45.44, -75.69)],
+	           [[(45.405, -75.69), (45.405, -75.68), (45.415, -75.68), (45.415, -75.69)],
+	            [(45.42, -75.67), (45.42, -75.655), (45.43, -75.66)]]),
+}
+
+def write_ring(filename, ring):
+	# The coordinate files of run_S3.py hold lon,lat lines...
+	with open(filename, 'w') as f:
+		for lat, lon in ring + ring[:1]: f.write(repr(lon) + ',' + repr(lat) + '\n')
+
+def benchmark_end_to_end(name, skip_distance):
+	""" benchmark_end_to_end
+	Runs run_S3.py over a synthetic region against a FakeGoogleServer, then reports from the run report
+	and the requests the server answered: grid points/s, API calls per saved image and the time of every stage.
+	"""
+	region, exclusions = SYNTHETIC_REGIONS[name]
+	work_dir = tempfile.mkdtemp(prefix = 'S3_benchmark_')
+	write_ring(os.path.join(work_dir, 'region.txt'), region)
+	for i, exclusion in enumerate(exclusions): write_ring(os.path.join(work_dir, 'exclusion_' + str(i) + '.txt'), exclusion)
+
+	google = FakeGoogle(args.fake_latency, args.fake_failure_rate, args.fake_throttle_rate, seed = args.seed)
+	server = FakeGoogleServer(google).start()
+	command = [sys.executable, 'run_S3.py', '-a', 'BENCHMARK', '-c', os.path.join(work_dir, 'region.txt'),
+	           '-e'] + [os.path.join(work_dir, 'exclusion_' + str(i) + '.txt') for i in range(len(exclusions))] + \
+	          ['-d', repr(skip_distance), '-w', str(args.walk_steps), '-o', os.path.join(work_dir, 'images', ''),
+	           '-gu', server.url, '-rf', os.path.join(work_dir, 'report.json')]
+	if args.walk_steps > 0: command += ['-pw', '2', '-ms', server.url + MAPS_JS_PATH]
+	command += shlex.split(args.run_args)
+	os.makedirs(os.path.join(work_dir, 'images'))
+	try:
+		start = time.time()
+		with open(os.path.join(work_dir, 'run.log'), 'w') as log:
+			status = subprocess.call(command, cwd = os.path.dirname(os.path.abspath(__file__)), stdout = log, stderr = subprocess.STDOUT)
+		wall_time = time.time() - start
+		if status != 0 or not os.path.exists(os.path.join(work_dir, 'report.json')):
+			print 'Region ' + name + ': run_S3.py failed, see ' + os.path.join(work_dir, 'run.log')
+			return
+		with open(os.path.join(work_dir, 'report.json')) as f: report = json.load(f)
+	finally:
+		server.stop()
+
+	stages  = report['stages']
+	points  = stages.get('region_mask', {}).get('items', 0)
+	images  = report['counters'].get('images_saved', 0)
+	calls   = dict((path, count) for path, count in google.stats().items() if path != MAPS_JS_PATH)
+	print 'Region ' + name + ': ' + str(points) + ' grid points, ' + str(report['counters'].get('valid_points', 0)) + ' valid, ' + \
+	      str(images) + ' images saved in ' + '%.2f' % wall_time + ' s'
+	print 'Points/s     : ' + '%.1f' % (points / report['elapsed_seconds'])
+	print 'Calls/Image  : ' + ('%.2f' % (float(sum(calls.values())) / images) if images else 'n/a') + ' (' + \
+	      ', '.join(path.split('/')[-1] + ' ' + str(count) for path, count in sorted(calls.items())) + ')'
+	for stage, metrics in sorted(stages.items(), key = lambda item: -item[1]['seconds']):
+		print '  %-18s %6d calls %7d items %9.3f s  p50 %.4f s  p99 %.4f s  %d errors' % \
+		      (stage, metrics['calls'], metrics['items'], metrics['seconds'], metrics['p50_seconds'], metrics['p99_seconds'], metrics['errors'])
+	shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+	if args.coords: region = S3.get_regional_polygon(args.coords, [])[0]
+	else:           region = box(*[float(x) for x in args.bounds.split(',')])
+	bounding_box = region.bounds
+
+	print '--- Grid Generation ---'
+	benchmark_grid(bounding_box, args.epsilon)
+	# Short rows, where the per-row overhead of the vectorized sweep weighs most...
+	south, west, north, east = bounding_box
+	print '--- Grid Generation (0.05 x 0.07 degree corner) ---'
+	benchmark_grid((max(south, north - 0.05), west, north, min(east, west + 0.07)), args.epsilon)
+	print '--- Region Filter ---'
+	benchmark_region_filter(region, bounding_box, args.epsilon, args.num_exclusions)
+	print '--- Coverage Index ---'
+	benchmark_coverage(bounding_box, args.coverage_points, args.coverage_queries, args.coverage_radius)
+	if args.end_to_end:
+		print '--- End to End (fake Google APIs) ---'
+		for name in sorted(SYNTHETIC_REGIONS): benchmark_end_to_end(name, args.epsilon)
@@ -0,0 +1,128 @@
+####################################
+#        coverage_index.py         #
+#                                  #
+#  Grid hash of the panorama loca- #
+#  tions already collected, for    #
+#  radius queries before walking   #
+#  and for coverage density...     #
+####################################
+import os
+import math
+import array
+import threading
+import numpy as np
+
+METERS_PER_DEGREE = 6371001.0 * math.pi / 180 # Along a meridian (EARTH_RADIUS of S3.py)...
+MIN_CELL          = 100.0 # Meters; smaller cells would cost more in overhead than they save in distance checks...
+FLUSH_POINTS      = 1000  # Points added between two appends to the index file...
+
+
+class CoverageIndex(object):
+	""" CoverageIndex
+	Indexes lat,lon points in a hash of cells at least max(radius, MIN_CELL) meters wide: rows of equal
+	latitude height, each divided in cells wide enough at the row's edge nearest the pole. A radius query
+	only looks at the cells of the rows around the point that the radius can reach, with a vectorized
+	distance check over the points of each.
+	Every point is also kept in one flat array (for density and persistence) and, if path is given,
+	appended to that file (loaded back on creation) as float64 lat, lon pairs.
+	Safe to share between threads.
+	"""
+	def __init__(self, radius, path = None):
+		self.radius   = float(radius)
+		self.cell_lat = max(self.radius, MIN_CELL) / METERS_PER_DEGREE
+		self.cells    = {} # (row, col) --> array('d') of lat, lon pairs...
+		self.points   = array.array('d')
+		self.pending  = array.array('d') # Points not yet appended to the file...
+		self.path     = path
+		self.skipped  = 0 # Claims refused for falling within the radius of coverage...
+		self.lock     = threading.Lock()
+		if path is not None and os.path.exists(path):
+			for lat, lon in np.fromfile(path, dtype = np.float64).reshape(-1, 2).tolist(): self.insert(lat, lon)
+
+	def __len__(self):
+		return len(self.points) / 2
+
+	def cell_lon(self, row):
+		# Longitude width of the cells of a row: at least a cell_lat wide on the ground across the row...
+		edge = min(max(abs(row * self.cell_lat), abs((row + 1) * self.cell_lat)), 89.9)
+		return self.cell_lat / math.cos(math.radians(edge))
+
+	def cell(self, lat, lon):
+		row = int(math.floor(lat / self.cell_lat))
+		return row, int(math.floor(lon / self.cell_lon(row)))
+
+	def insert(self, lat, lon):
+		self.cells.setdefault(self.cell(lat, lon), array.array('d')).extend((lat, lon))
+		self.points.extend((lat, lon))
+
+	def within(self, lat, lon, radius):
+		""" within
+		Returns whether an indexed point lies within radius meters of lat,lon (radius <= the cell size).
+		"""
+		half_lat = radius / METERS_PER_DEGREE
+		half_lon = half_lat / math.cos(math.radians(min(abs(lat) + half_lat, 89.9)))
+		row = int(math.floor(lat / self.cell_lat))
+		for r in (row - 1, row, row + 1):
+			width = self.cell_lon(r)
+			for c in range(int(math.floor((lon - half_lon) / width)), int(math.floor((lon + half_lon) / width)) + 1):
+				cell = self.cells.get((r, c))
+				if cell is None: continue
+				points = np.frombuffer(cell, dtype = np.float64).reshape(-1, 2)
+				# Equirectangular distance, accurate at these ranges...
+				x = np.radians(points[:, 1] - lon) * math.cos(math.radians(lat))
+				y = np.radians(points[:, 0] - lat)
+				if (x * x + y * y).min() * (METERS_PER_DEGREE * 180 / math.pi) ** 2 <= radius * radius: return True
+		return False
+
+	def covered(self, lat, lon):
+		with self.lock:
+			return self.within(lat, lon, self.radius)
+
+	def claim(self, lat, lon):
+		""" claim
+		Adds lat,lon unless it is within the radius of a point already indexed, atomically.
+		Output: True if it was added, False if the location is already covered.
+		"""
+		with self.lock:
+			if self.within(lat, lon, self.radius):
+				self.skipped += 1
+				return False
+			self.add_point(lat, lon)
+			return True
+
+	def add(self, points):
+		""" add
+		Indexes a list of lat,lon points unconditionally (eg: the panoramas of a walk).
+		"""
+		with self.lock:
+			for lat, lon in points: self.add_point(float(lat), float(lon))
+
+	def add_point(self, lat, lon):
+		self.insert(lat, lon)
+		self.pending.extend((lat, lon))
+		if len(self.pending) >= 2 * FLUSH_POINTS: self.write_pending()
+
+	def write_pending(self):
+		if self.path is not None and self.pending:
+			with open(self.path, 'ab') as f: self.pending.tofile(f)
+		self.pending = array.array('d')
+
+	def density(self, bounds, cell_size):
+		""" density
+		Counts the indexed points per cell of a regular grid over bounds (S, W, N, E).
+		Input: The bounds and the cell size in meters (along the meridian; cells span the same longitude everywhere).
+		Output: The (rows, cols) array of counts, rows from S to N and cols from W to E, and the lat, lon cell edges.
+		"""
+		south, west, north, east = bounds
+		step_lat = cell_size / METERS_PER_DEGREE
+		step_lon = step_lat / math.cos(math.radians((south + north) / 2.0))
+		lat_edges = np.arange(south, north + step_lat, step_lat)
+		lon_edges = np.arange(west, east + step_lon, step_lon)
+		with self.lock:
+			points = np.frombuffer(self.points, dtype = np.float64).reshape(-1, 2).copy()
+		counts = np.histogram2d(points[:, 0], points[:, 1], bins = (lat_edges, lon_edges))[0].astype(np.int64)
+		return counts, lat_edges, lon_edges
+
+	def close(self):
+		with self.lock:
+			self.write_pending()
@@ -0,0 +1,92 @@
+####################################
+#           estimate.py            #
+#                                  #
+#  Dry run of a survey: the exact  #
+#  grid points in the region, the  #
+#  API calls they lead to and the  #
+#  time they should take, without  #
+#  a single network call...        #
+####################################
+import math
+import json
+import numpy as np
+from land_mask import world_pixels, TILE_SIZE
+
+# Seconds per call when no earlier run report gives measured ones: rough figures for the Google APIs,
+# and the 3 second JSDOM window of a get_next_panorama.js spawn (about 0.5s with panorama workers)...
+DEFAULT_LATENCIES = {'static_maps': 0.15, 'roads': 0.3, 'panorama_links': 3.0, 'metadata': 0.1, 'streetview': 0.25}
+WORKER_LINKS_LATENCY = 0.5
+
+# Share of the points and roads surviving each step when no earlier run report gives measured ones...
+DEFAULT_FRACTIONS = {'land': 1.0, 'walked': 1.0, 'images_per_walk': None} # None: every walk is full length...
+
+
+def count_points(region_filter, skip_distance, grid_chunks, start_lat = None, land_mask_zoom = None):
+	""" count_points
+	Sweeps the search grid exactly as search_area does (only the tile of a shard), counting the points the region filter keeps.
+	Input: The RegionFilter, the spacing in m, the grid chunk generator (S3.grid_chunks), the restart latitude
+	       and, for a tiled land mask, its zoom.
+	Output: (grid points, points in the region, distinct land mask tiles holding them or None).
+	"""
+	total, inside, tiles = 0, 0, set()
+	for row, col, lats, lons in grid_chunks(region_filter.region.bounds, skip_distance, start_lat = start_lat, window = region_filter.grid_window()):
+		mask = region_filter.mask(lats, lons)
+		total  += len(lats)
+		inside += int(np.count_nonzero(mask))
+		if land_mask_zoom is not None and mask.any():
+			x, y = world_pixels(lats[mask], lons[mask], land_mask_zoom)
+			keys = (np.floor(x).astype(np.int64) // TILE_SIZE) * (1 << 32) + np.floor(y).astype(np.int64) // TILE_SIZE
+			tiles.update(np.unique(keys).tolist())
+	return total, inside, (len(tiles) if land_mask_zoom is not None else None)
+
+def measured(report_file):
+	""" measured
+	Reads the per-call latencies and the survival fractions observed by an earlier run from its report.json.
+	Output: (latencies, fractions), holding only what the report measured.
+	"""
+	with open(report_file) as f: report = json.load(f)
+	stages, counters = report.get('stages', {}), report.get('counters', {})
+	latencies = {}
+	for api, stage in (('static_maps', 'api.static_maps'), ('roads', 'api.roads'), ('metadata', 'api.metadata'), ('streetview', 'download')):
+		if stages.get(stage, {}).get('calls'): latencies[api] = stages[stage]['mean_seconds']
+	# A panorama_links call may look up the first step of a whole batch of walks: the estimate counts single lookups...
+	links = stages.get('panorama_links', {})
+	if links.get('items'): latencies['panorama_links'] = float(links['seconds']) / links['items']
+
+	fractions = {}
+	checked = stages.get('land_mask', {}).get('items', 0)
+	if checked: fractions['land'] = float(counters.get('valid_points', 0)) / checked
+	walks = stages.get('walk', {}).get('calls', 0)
+	if counters.get('valid_points'): fractions['walked'] = min(1.0, float(walks) / counters['valid_points'])
+	if walks: fractions['images_per_walk'] = float(counters.get('images_saved', 0)) / walks
+	return latencies, fractions
+
+def estimate_calls(points, tiles, walk_steps, batch_limit, fractions, metadata_checks = True):
+	""" estimate_calls
+	The API calls of a survey of points in-region grid points (tiles: land mask tiles, or None for one
+	1x1 Static Maps call per point). Every walk is taken as walk_steps long with both headings imaged at
+	each of its walk_steps + 1 panoramas, unless fractions gives the images per walk measured.
+	Output: {api: calls}, with the valid points and walks behind them.
+	"""
+	valid  = points * fractions['land']
+	walks  = valid * fractions['walked']
+	images = walks * (fractions['images_per_walk'] if fractions['images_per_walk'] is not None else 2 * (walk_steps + 1))
+	return {'valid_points'  : valid,
+	        'walks'         : walks,
+	        'static_maps'   : tiles if tiles is not None else points,
+	        'roads'         : int(math.ceil(valid / batch_limit)),
+	        'panorama_links': walks * walk_steps,
+	        'metadata'      : walks * (walk_steps + 1) if metadata_checks else 0,
+	        'streetview'    : images}
+
+def estimate_time(calls, latencies, concurrency, rates):
+	""" estimate_time
+	The seconds each API should take: its calls at the latency per call, spread over its concurrent
+	workers (concurrency, 1 by default), and never faster than its rate limit (rates, requests/second).
+	Output: {api: seconds}
+	"""
+	seconds = {}
+	for api in ('static_maps', 'roads', 'panorama_links', 'metadata', 'streetview'):
+		seconds[api] = calls[api] * latencies[api] / concurrency.get(api, 1)
+		if rates.get(api): seconds[api] = max(seconds[api], calls[api] / rates[api])
+	return seconds
@@ -0,0 +1,212 @@
+#!/usr/bin/python
+####################################
+#          fake_google.py          #
+#                                  #
+#  Local stand-in for the Google   #
+#  APIs called by S3.py, with set  #
+#  latency and failure rates, for  #
+#  offline runs and benchmarks...  #
+####################################
+import os
+import json
+import time
+import zlib
+import struct
+import random
+import hashlib
+import argparse
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+# The synthetic world, that of javascript_panoramas/stub_maps.js: an E-W street along every
+# LAT_STEP of latitude with a panorama every LON_STEP of longitude...
+LAT_STEP    = 0.001
+LON_STEP    = 0.0005
+LAND_COLOR  = (242, 239, 233)
+WATER_COLOR = (163, 203, 255) # GOOGLE_BLUE of S3.py...
+STUB_MAPS   = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'javascript_panoramas', 'stub_maps.js')
+
+# Endpoint paths, below the base URL of the server (see S3.set_google_url)...
+STATICMAP_PATH  = '/maps/api/staticmap'
+ROADS_PATH      = '/v1/nearestRoads'
+METADATA_PATH   = '/maps/api/streetview/metadata'
+STREETVIEW_PATH = '/maps/api/streetview'
+MAPS_JS_PATH    = '/maps/api/js'
+
+
+def fraction(*values):
+	""" fraction
+	A deterministic pseudo-random number in [0, 1) for the given values, so the world is the same every run.
+	"""
+	return int(hashlib.md5(repr(values)).hexdigest()[:8], 16) / 2.0 ** 32
+
+def solid_png(width, height, color):
+	""" solid_png
+	Encodes a width x height PNG of a single RGB color.
+	"""
+	def chunk(kind, data):
+		return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+	rows = ('\x00' + struct.pack('BBB', *color) * width) * height
+	return '\x89PNG\r\n\x1a\n' + chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+	       chunk('IDAT', zlib.compress(rows)) + chunk('IEND', '')
+
+
+class FakeGoogle(object):
+	""" FakeGoogle
+	The answers of the fake APIs over the synthetic world, and how they misbehave:
+	  - latency: mean seconds before each answer (uniformly spread over 0.5x to 1.5x);
+	  - failure_rate: fraction of the requests answered with a 503;
+	  - throttle_rate: fraction of the requests answered with a 429;
+	  - water: fraction of the map cells (of a street and panorama spacing) that are water;
+	  - no_imagery: fraction of the panoramas without imagery (ZERO_RESULTS metadata);
+	  - image_bytes: size of the Street View images.
+	Per endpoint, latency and failure_rate may also be given as {path: value} dicts.
+	The requests answered are counted per endpoint path.
+	"""
+	def __init__(self, latency = 0.0, failure_rate = 0.0, throttle_rate = 0.0, water = 0.1, no_imagery = 0.1, \
+	             image_bytes = 20000, seed = 0):
+		self.latency       = latency
+		self.failure_rate  = failure_rate
+		self.throttle_rate = throttle_rate
+		self.water         = water
+		self.no_imagery    = no_imagery
+		self.image_bytes   = image_bytes
+		self.random        = random.Random(seed)
+		self.counts        = {}
+		self.pngs          = {}
+		self.lock          = threading.Lock()
+
+	def setting(self, value, path):
+		return value.get(path, 0.0) if isinstance(value, dict) else value
+
+	def count(self, path):
+		with self.lock:
+			self.counts[path] = self.counts.get(path, 0) + 1
+
+	def stats(self):
+		with self.lock:
+			return dict(self.counts)
+
+	def answer(self, path, query):
+		""" answer
+		Output: The (status, content type, body) answering a GET of path with the parsed query.
+		"""
+		self.count(path)
+		if path == MAPS_JS_PATH: return self.maps_script() # It misbehaves in the lookups themselves...
+		latency = self.setting(self.latency, path)
+		with self.lock:
+			draw   = self.random.random()
+			spread = self.random.uniform(0.5, 1.5)
+		if latency: time.sleep(latency * spread)
+		failure_rate = self.setting(self.failure_rate, path)
+		if draw < failure_rate:                      return 503, 'text/plain', 'Service Unavailable'
+		if draw < failure_rate + self.throttle_rate: return 429, 'text/plain', 'Too Many Requests'
+
+		if path == STATICMAP_PATH:   return self.staticmap(query)
+		if path == ROADS_PATH:       return self.nearest_roads(query)
+		if path == METADATA_PATH:    return self.metadata(query)
+		if path == STREETVIEW_PATH:  return self.streetview(query)
+		return 404, 'text/plain', 'Not Found'
+
+	def is_water(self, lat, lon):
+		return fraction('water', int(round(lat / LAT_STEP)), int(round(lon / LON_STEP))) < self.water
+
+	def staticmap(self, query):
+		# A map of the single color of its center: one land mask tile is all land or all water...
+		lat, lon = [float(x) for x in query['center'][0].split(',')]
+		width, height = [int(x) for x in query.get('size', ['1x1'])[0].split('x')]
+		key = (width, height, self.is_water(lat, lon))
+		with self.lock:
+			if key not in self.pngs: self.pngs[key] = solid_png(width, height, WATER_COLOR if key[2] else LAND_COLOR)
+			return 200, 'image/png', self.pngs[key]
+
+	def nearest_roads(self, query):
+		# Every point snaps to the street of its row (none over water)...
+		snapped = []
+		for i, point in enumerate(query['points'][0].split('|')):
+			lat, lon = [float(x) for x in point.split(',')]
+			if self.is_water(lat, lon): continue
+			snapped.append({'originalIndex': i, 'placeId': 'road_' + str(int(round(lat / LAT_STEP))),
+			                'location': {'latitude': round(lat / LAT_STEP) * LAT_STEP, 'longitude': lon}})
+		return 200, 'application/json', json.dumps({'snappedPoints': snapped} if snapped else {})
+
+	def metadata(self, query):
+		lat, lon = [float(x) for x in query['location'][0].split(',')]
+		row, col = int(round(lat / LAT_STEP)), int(round(lon / LON_STEP))
+		if self.is_water(lat, lon) or fraction('imagery', row, col) < self.no_imagery:
+			return 200, 'application/json', json.dumps({'status': 'ZERO_RESULTS'})
+		return 200, 'application/json', json.dumps({'status': 'OK', 'pano_id': 'stub_' + str(row) + '_' + str(col),
+		                                            'location': {'lat': row * LAT_STEP, 'lng': col * LON_STEP}})
+
+	def streetview(self, query):
+		return 200, 'image/jpeg', '\xff\xd8' + '\x00' * max(0, self.image_bytes - 4) + '\xff\xd9'
+
+	def maps_script(self):
+		# The stub Javascript API of the panorama workers, with the panorama link lookups misbehaving alike...
+		with open(STUB_MAPS) as f: script = f.read()
+		settings = 'window.STUB_LATENCY_MS = ' + repr(1000.0 * self.setting(self.latency, MAPS_JS_PATH)) + ';\n' + \
+		           'window.STUB_FAILURE_RATE = ' + repr(self.setting(self.failure_rate, MAPS_JS_PATH)) + ';\n'
+		return 200, 'text/javascript', settings + script
+
+
+class FakeGoogleHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1' # Keep-alive, as the image download sessions expect...
+
+	def do_GET(self):
+		url = urlparse.urlparse(self.path)
+		status, content_type, body = self.server.google.answer(url.path, urlparse.parse_qs(url.query))
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		if status == 429: self.send_header('Retry-After', '0')
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass # Benchmarks send thousands of requests...
+
+
+class FakeGoogleServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	""" FakeGoogleServer
+	Serves a FakeGoogle over HTTP on host:port (port 0 picks a free one), a thread per connection.
+	start() serves from a background thread; url is the base URL to give S3.set_google_url.
+	"""
+	daemon_threads      = True
+	allow_reuse_address = True
+
+	def __init__(self, google, host = '127.0.0.1', port = 0):
+		BaseHTTPServer.HTTPServer.__init__(self, (host, port), FakeGoogleHandler)
+		self.google = google
+		self.url    = 'http://' + host + ':' + str(self.server_address[1])
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target = self.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-p', '--port', help = 'The port to serve on.', type = int, default = 8000)
+	parser.add_argument('-l', '--latency', help = 'Mean seconds before each answer.', type = float, default = 0.0)
+	parser.add_argument('-f', '--failure_rate', help = 'Fraction of the requests answered with a 503.', type = float, default = 0.0)
+	parser.add_argument('-t', '--throttle_rate', help = 'Fraction of the requests answered with a 429.', type = float, default = 0.0)
+	parser.add_argument('-w', '--water', help = 'Fraction of the map that is water.', type = float, default = 0.1)
+	parser.add_argument('-n', '--no_imagery', help = 'Fraction of the panoramas without imagery.', type = float, default = 0.1)
+	parser.add_argument('-b', '--image_bytes', help = 'Size of the Street View images.', type = int, default = 20000)
+	args = parser.parse_args()
+
+	server = FakeGoogleServer(FakeGoogle(args.latency, args.failure_rate, args.throttle_rate, args.water, args.no_imagery, args.image_bytes), port = args.port)
+	print 'Fake Google APIs on ' + server.url + ' (run_S3.py --google_url ' + server.url + ' --maps_script ' + server.url + MAPS_JS_PATH + ')'
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -7,7 +7,6 @@
 # city bound coordinates  #
 # as a .CSV file...       #
 ###########################
-import os, sys
 import json, urllib
 import argparse
 
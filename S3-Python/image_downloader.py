@@ -0,0 +1,141 @@
+####################################
+#       image_downloader.py        #
+#                                  #
+#  Bounded-concurrency Street View #
+#  image downloads over keep-alive #
+#  sessions, streamed to disk and  #
+#  paced by a requests/second cap. #
+####################################
+import os
+import time
+import threading
+import Queue
+import requests
+from quota_scheduler import STREETVIEW
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RateLimiter(object):
+	""" RateLimiter
+	Spaces calls at least 1/rate seconds apart across all threads; a rate of None disables it.
+	"""
+	def __init__(self, rate = None):
+		self.interval  = 1.0 / rate if rate else 0.0
+		self.next_slot = 0.0
+		self.lock      = threading.Lock()
+
+	def wait(self):
+		if not self.interval: return
+		with self.lock:
+			now = time.time()
+			slot = max(now, self.next_slot)
+			self.next_slot = slot + self.interval
+		if slot > now: time.sleep(slot - now)
+
+
+class DownloadBatch(object):
+	""" DownloadBatch
+	Collects the results of one download() call as the workers complete its jobs.
+	"""
+	def __init__(self, size):
+		self.results   = [None] * size
+		self.remaining = size
+		self.lock      = threading.Lock()
+		self.finished  = threading.Event()
+		if size == 0: self.finished.set()
+
+	def complete(self, index, result):
+		self.results[index] = result
+		with self.lock:
+			self.remaining -= 1
+			if self.remaining == 0: self.finished.set()
+
+
+class ImageDownloader(object):
+	""" ImageDownloader
+	Downloads batches of (url, filename) jobs with num_workers long-lived threads. Each thread keeps
+	its own requests.Session, so connections are reused between images and batches, and bodies are
+	streamed to a .part file renamed into place once complete (a partial image is never left under filename).
+	With a QuotaScheduler, requests are paced and retried within its Street View budget instead of by rate.
+	With a Metrics, every image is timed as the 'download' stage, with the bytes written.
+	"""
+	def __init__(self, num_workers = 8, rate = None, timeout = 30.0, session_factory = requests.Session, scheduler = None, metrics = None):
+		self.num_workers     = num_workers
+		self.limiter         = RateLimiter(rate)
+		self.scheduler       = scheduler
+		self.metrics         = metrics
+		self.timeout         = timeout
+		self.session_factory = session_factory
+		self.jobs            = Queue.Queue()
+		self.threads         = []
+		self.lock            = threading.Lock() # Guards the start of the threads...
+
+	def fetch(self, session, url, filename):
+		""" fetch
+		Streams one image to disk.
+		Output: The number of bytes written.
+		"""
+		if self.scheduler is not None:
+			response = self.scheduler.get(STREETVIEW, url, session = session, stream = True, timeout = self.timeout)
+		else:
+			self.limiter.wait()
+			response = session.get(url, stream = True, timeout = self.timeout)
+		try:
+			response.raise_for_status()
+			size = 0
+			try:
+				with open(filename + '.part', 'wb') as f:
+					for chunk in response.iter_content(CHUNK_SIZE):
+						f.write(chunk)
+						size += len(chunk)
+				os.rename(filename + '.part', filename)
+			except BaseException:
+				# The stream failed partway: no partial image is left behind...
+				if os.path.exists(filename + '.part'): os.remove(filename + '.part')
+				raise
+			return size
+		finally:
+			response.close()
+
+	def work(self):
+		session = self.session_factory()
+		while True:
+			job = self.jobs.get()
+			if job is None: return # Shutting down...
+			batch, index, url, filename = job
+			start = time.time()
+			result = (filename, None, RuntimeError('The download of ' + filename + ' was interrupted'))
+			try:
+				result = (filename, self.fetch(session, url, filename), None)
+			except Exception as err: # Any failure is the job's error: the worker must live on...
+				result = (filename, None, err)
+			finally:
+				# The batch completes whatever happened, or download() would wait on it forever.
+				try:
+					if self.metrics is not None: self.metrics.record('download', time.time() - start, size = result[1] or 0, error = result[2] is not None)
+				finally:
+					batch.complete(index, result)
+
+	def download(self, jobs):
+		""" download
+		Input: A list of (url, filename) jobs.
+		Output: A list of (filename, bytes written, error) in job order; bytes is None on error.
+		"""
+		with self.lock: # Concurrent callers (eg: pipeline download workers) start a single set of threads...
+			if not self.threads:
+				self.threads = [threading.Thread(target = self.work) for _ in range(self.num_workers)]
+				for thread in self.threads:
+					thread.daemon = True
+					thread.start()
+
+		batch = DownloadBatch(len(jobs))
+		for index, (url, filename) in enumerate(jobs): self.jobs.put((batch, index, url, filename))
+		while not batch.finished.wait(1.0): pass # A timeout keeps the wait interruptible...
+		return batch.results
+
+	def close(self):
+		with self.lock:
+			threads, self.threads = self.threads, []
+		for thread in threads: self.jobs.put(None)
+		for thread in threads: thread.join()
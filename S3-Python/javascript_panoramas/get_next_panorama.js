@@ -12,68 +12,45 @@
 // script or visualized...    //
 ////////////////////////////////
 
-// Usage: $ node get_next_panorama.js <LATITUDE> <LONGITUDE> <API_KEY>
+// Usage: $ node get_next_panorama.js <API_KEY> <LATITUDE> <LONGITUDE> [<LATITUDE> <LONGITUDE> ...]
 // Calling StreetView API Using NodeJS
 // Emulation of the HTML Enviroment achieved using JSDOM Environment
 // References: 
 //	https://stackoverflow.com/questions/41958271/load-google-maps-api-in-jsdom
 //	https://stackoverflow.com/questions/47084618/next-panorama-id-in-street-view
+//
+// Every location given is looked up with the same JSDOM and the links of all of them are printed
+// to STDOUT as a single JSON reply line (format in panorama_links.js), e.g.
+// {"id": null, "results": [{"status": "OK", "links": [["<pano id>", 243.1, 45.42, -75.69], ...]}]}
 
+const fs = require('fs');
+const path = require('path');
+const { Console } = require('console');
+const { JSDOM, VirtualConsole } = require('jsdom');
 
-var LATITUDE  = process.argv[2];
-var LONGITUDE = process.argv[3];
+var API_KEY   = process.argv[2] || '';
+var LOCATIONS = [];
+for (var i = 3; i + 1 < process.argv.length; i += 2) LOCATIONS.push([parseFloat(process.argv[i]), parseFloat(process.argv[i + 1])]);
 var SEARCH_RADIUS = 50; 
-var KILL_TIMEOUT = 3000; // TODO :: Used to kill the JSDOM...
+var KILL_TIMEOUT = 3000 + 100 * LOCATIONS.length; // Exits without a reply if the lookups take longer...
+var LINKS_SCRIPT = fs.readFileSync(path.join(__dirname, 'panorama_links.js'), 'utf8');
 
+// STDOUT only carries the reply: anything logged by the page is sent to STDERR.
+var virtualConsole = new VirtualConsole();
+virtualConsole.sendTo(new Console(process.stderr, process.stderr));
 
-function get_next_panoramae(lat, lon, api_key) {
-    const jsdom = require("jsdom");
-    const { JSDOM } = jsdom;
-
+function get_next_panoramae(locations, api_key) {
     const dom = new JSDOM(`
     <!DOCTYPE html>
     <html>
         <body>
             <div id="map"></div>
+            <script>${LINKS_SCRIPT}</script>
             <script>
-		var api_key = ''; // YOUR API KEY HERE!
-
                 function initMap() {
-		    	// Search to get the nearest Panorama around the lat,lon coordinates within 50 meters distance radius...
-		    	var service  = new google.maps.StreetViewService();
-		    	var panorama = service.getPanorama({location: {lat: ${lat}, lng: ${lon}}, radius: 50}, process_streetview_data);	
+                	lookup_batch({id: null, radius: SEARCH_RADIUS, locations: LOCATIONS}, done);
                 }
 
-		function process_streetview_data(data, status) {
-			if (status == 'OK') {
-				for (var key in data.links) { 
-					// The link heading value corresponds to the original point (i.e. rear-facing)
-					// To be forward-facing in our step, we add 180. Google manages 360+ cases by casting back to [0,360] range.
-					var heading = data.links[key].heading + 180;
-					var pano_id = data.links[key].pano;
-					console.log('key:' + key)
-					console.log('heading:' + heading);
-					console.log('pano:'    + pano_id);
-			
-					// Get Location Data for this Panorama based on its Pano_Id
-					var link_service  = new google.maps.StreetViewService();
-					var link_panorama = link_service.getPanorama({pano: pano_id}, print_lat_lon);		
-		    		}
-				return;
-		  	};
-		}
-
-		function print_lat_lon(data, status) {
-			if (status == 'OK') {
-				// TODO :: Figure out why the lat,lon values keep coming back as 'undefined'...
-				// This is a temporary patch fix for now...
-				var lat = JSON.stringify(data.location.latLng).split(',')[0].split(':')[1].replace('}', '');
-				var lon = JSON.stringify(data.location.latLng).split(',')[1].split(':')[1].replace('}', '');
-				console.log('latlon:' + lat + ',' + lon);
-				return;
-			};
-		}
-
                 function loadScript(url, callback) {
                 	var head = document.getElementsByTagName('head')[0];
                    	var script = document.createElement('script');
@@ -89,18 +66,25 @@ function get_next_panoramae(lat, lon, api_key) {
                     	script.onload = callback;
                 }
 
-                loadScript("https://maps.googleapis.com/maps/api/js?key=" + api_key, initMap);
+                loadScript("https://maps.googleapis.com/maps/api/js?key=" + API_KEY, initMap);
             </script>
         </body>
     </html>
     `, {
         runScripts: "dangerously",
-        resources: "usable"
+        resources: "usable",
+        virtualConsole: virtualConsole,
+        beforeParse(window) {
+            window.API_KEY = api_key;
+            window.LOCATIONS = locations;
+            window.SEARCH_RADIUS = SEARCH_RADIUS;
+            // The JSDOM keeps the process alive, so exit as soon as the reply is out.
+            window.done = function(reply) {
+                process.stdout.write(JSON.stringify(reply) + '\n', function() { process.exit(0); });
+            };
+        },
     });
 }
 
-get_next_panoramae(LATITUDE, LONGITUDE, API_KEY);
-// Kill the process after 3 seconds...
-// TODO :: Figure out why the JSDOM Hangs... Killing the process following the timeout is inelegant.
-// Must find a better way to terminate the JSDOM in a timely manner after retrieving lat,lon pairs!
-setTimeout(function(){ process.exit(); }, KILL_TIMEOUT);
+get_next_panoramae(LOCATIONS, API_KEY);
+setTimeout(function(){ process.exit(1); }, KILL_TIMEOUT);
@@ -0,0 +1,58 @@
+////////////////////////////////
+//     panorama_links.js      //
+//                            //
+// Page-side lookup of the    //
+// adjacent panoramas, shared //
+// by get_next_panorama.js    //
+// and panorama_worker.js and //
+// run in their JSDOM once    //
+// the Google Javascript API  //
+// is loaded.                 //
+////////////////////////////////
+
+// A request asks for the links around any number of locations, and is answered by a single reply:
+// Request: {"id": 7, "radius": 50, "locations": [[45.42, -75.69], ...]}
+// Reply:   {"id": 7, "results": [{"status": "OK", "links": [["<pano id>", 243.1, 45.42, -75.69], ...]}, ...]}
+// There is one result per location, in request order. Each link is a [pano, heading, lat, lon] record;
+// lat and lon are null when the location of the linked panorama could not be resolved.
+
+function lookup_links(service, lat, lon, radius, done) {
+	// Search to get the nearest Panorama around the lat,lon coordinates within the radius...
+	service.getPanorama({location: {lat: lat, lng: lon}, radius: radius}, function(data, status) {
+		if (status != 'OK') return done({status: String(status), links: []});
+
+		// The link heading value corresponds to the original point (i.e. rear-facing)
+		// To be forward-facing in our step, we add 180. Google manages 360+ cases by casting back to [0,360] range.
+		var links = data.links.map(function(link) { return [link.pano, link.heading + 180, null, null]; });
+		var pending = links.length;
+		if (pending == 0) return done({status: 'OK', links: links});
+
+		links.forEach(function(link) {
+			// Get Location Data for this Panorama based on its Pano_Id
+			service.getPanorama({pano: link[0]}, function(link_data, link_status) {
+				if (link_status == 'OK') {
+					link[2] = link_data.location.latLng.lat();
+					link[3] = link_data.location.latLng.lng();
+				}
+				pending -= 1;
+				if (pending == 0) done({status: 'OK', links: links});
+			});
+		});
+	});
+}
+
+function lookup_batch(request, reply) {
+	var service = new google.maps.StreetViewService();
+	var results = new Array(request.locations.length);
+	var pending = results.length;
+	if (pending == 0) return reply({id: request.id, results: results});
+
+	// Every location is looked up at once; the reply is sent when the last one completes.
+	request.locations.forEach(function(location, index) {
+		lookup_links(service, location[0], location[1], request.radius, function(result) {
+			results[index] = result;
+			pending -= 1;
+			if (pending == 0) reply({id: request.id, results: results});
+		});
+	});
+}
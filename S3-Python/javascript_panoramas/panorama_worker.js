@@ -0,0 +1,132 @@
+////////////////////////////////
+//    panorama_worker.js      //
+//                            //
+// Long-lived variant of      //
+// get_next_panorama.js: sets //
+// up the JSDOM env. and the  //
+// Google Javascript API once //
+// and answers any number of  //
+// adjacent panorama lookups  //
+// read from STDIN, one JSON  //
+// object per line, replying  //
+// on STDOUT the same way...  //
+////////////////////////////////
+
+// Usage: $ node panorama_worker.js <API_KEY> [MAPS_SCRIPT_URL]
+// The optional MAPS_SCRIPT_URL replaces the Google Javascript API (e.g. a file:// stub for offline runs).
+// Once the API is loaded, the worker writes {"ready": true} on STDOUT; requests are held until then.
+// If the API fails to load, or is not loaded within MAPS_LOAD_TIMEOUT_MS (environment, 60000 by default),
+// every request held is answered with null results and the worker exits with status 1, to be restarted.
+//
+// Request (STDIN):  {"id": 7, "radius": 50, "locations": [[45.42, -75.69], ...]}
+// Reply   (STDOUT): {"id": 7, "results": [{"status": "OK", "links": [["<pano id>", 243.1, 45.42, -75.69], ...]}, ...]}
+// (the message format is described in panorama_links.js)
+// Requests are served concurrently; replies may come back in any order and are matched on "id".
+
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+const { Console } = require('console');
+const { JSDOM, VirtualConsole } = require('jsdom');
+
+var API_KEY = process.argv[2] || '';
+var MAPS_SCRIPT_URL = process.argv[3] || 'https://maps.googleapis.com/maps/api/js?key=' + API_KEY;
+var SEARCH_RADIUS = 50;
+var MAPS_LOAD_TIMEOUT_MS = Number(process.env.MAPS_LOAD_TIMEOUT_MS) || 60000;
+var LINKS_SCRIPT = fs.readFileSync(path.join(__dirname, 'panorama_links.js'), 'utf8');
+
+// STDOUT only carries replies: anything logged by the page is sent to STDERR.
+var virtualConsole = new VirtualConsole();
+virtualConsole.sendTo(new Console(process.stderr, process.stderr));
+
+function reply(message) {
+	process.stdout.write(JSON.stringify(message) + '\n');
+}
+
+var ready = false;
+var failed = false;
+var queued = [];
+
+// A failed lookup: null for every location of the request.
+function fail(request) {
+	reply({id: request.id, results: request.locations.map(function() { return null; })});
+}
+
+function mapsFailed(reason) {
+	if (ready || failed) return;
+	failed = true;
+	clearTimeout(loadTimer);
+	process.stderr.write('panorama_worker.js: ' + reason + '\n');
+	queued.forEach(fail);
+	queued = [];
+	// Exit once the replies are written out...
+	process.stdout.write('', function() { process.exit(1); });
+}
+
+var loadTimer = setTimeout(function() {
+	mapsFailed('The Google Javascript API was not loaded within ' + MAPS_LOAD_TIMEOUT_MS + 'ms');
+}, MAPS_LOAD_TIMEOUT_MS);
+
+const dom = new JSDOM(`
+<!DOCTYPE html>
+<html>
+	<body>
+		<script>${LINKS_SCRIPT}</script>
+		<script>
+		function loadScript(url, callback) {
+			var head = document.getElementsByTagName('head')[0];
+			var script = document.createElement('script');
+			script.type = 'text/javascript';
+			script.src = url;
+
+			// Fire the loading
+			head.appendChild(script);
+
+			// Then bind the event to the callback function.
+			// There are several events for cross browser compatibility.
+			script.onreadystatechange = callback;
+			script.onload = callback;
+			script.onerror = function() { mapsFailed('Could not load ' + url); };
+		}
+
+		loadScript(MAPS_SCRIPT_URL, mapsReady);
+		</script>
+	</body>
+</html>
+`, {
+	runScripts: 'dangerously',
+	resources: 'usable',
+	virtualConsole: virtualConsole,
+	beforeParse(window) {
+		window.MAPS_SCRIPT_URL = MAPS_SCRIPT_URL;
+		window.mapsFailed = mapsFailed;
+		window.mapsReady = function() {
+			if (ready || failed) return;
+			ready = true;
+			clearTimeout(loadTimer);
+			reply({ready: true});
+			queued.forEach(function(request) { window.lookup_batch(request, reply); });
+			queued = [];
+		};
+	},
+});
+
+function handle(line) {
+	if (!line.trim()) return;
+	var request;
+	try {
+		request = JSON.parse(line);
+	} catch (err) {
+		return reply({id: null, results: []});
+	}
+	if (request.radius === undefined) request.radius = SEARCH_RADIUS;
+	if (request.locations === undefined) request.locations = [];
+
+	// Requests arriving while the Google Javascript API loads are held until it is ready.
+	if (ready) dom.window.lookup_batch(request, reply);
+	else if (failed) fail(request);
+	else queued.push(request);
+}
+
+// The worker lives as long as its STDIN: the calling process closes it to shut the worker down.
+readline.createInterface({ input: process.stdin }).on('line', handle).on('close', function() { process.exit(0); });
@@ -0,0 +1,64 @@
+////////////////////////////////
+//        stub_maps.js        //
+//                            //
+// Offline stand-in for the   //
+// Google Javascript API, to  //
+// load in place of it with   //
+// panorama_worker.js. Models //
+// an E-W street along every  //
+// 0.001 deg of latitude with //
+// a panorama every 0.0005deg //
+// of longitude, each linked  //
+// to its E and W neighbours. //
+////////////////////////////////
+
+// Usage: $ node panorama_worker.js <API_KEY> file:///path/to/stub_maps.js
+// fake_google.py also serves it (at /maps/api/js), setting window.STUB_LATENCY_MS and
+// window.STUB_FAILURE_RATE to delay the lookups and fail a share of them.
+
+(function() {
+	var LAT_STEP = 0.001;
+	var LON_STEP = 0.0005;
+	var LATENCY_MS = window.STUB_LATENCY_MS || 0;
+	var FAILURE_RATE = window.STUB_FAILURE_RATE || 0;
+
+	function LatLng(lat, lng) {
+		this.lat = function() { return lat; };
+		this.lng = function() { return lng; };
+	}
+
+	function pano_id(row, col) {
+		return 'stub_' + row + '_' + col;
+	}
+
+	function panorama(row, col) {
+		return {
+			location: {pano: pano_id(row, col), latLng: new LatLng(row * LAT_STEP, col * LON_STEP)},
+			// Link headings point back at this panorama, as they do with the Google API.
+			links: [{heading: 270, pano: pano_id(row, col + 1)}, {heading: 90, pano: pano_id(row, col - 1)}],
+		};
+	}
+
+	function StreetViewService() {}
+
+	StreetViewService.prototype.getPanorama = function(request, callback) {
+		var row, col;
+		if (request.pano) {
+			var parts = request.pano.split('_');
+			row = parseInt(parts[1]);
+			col = parseInt(parts[2]);
+		} else {
+			row = Math.round(request.location.lat / LAT_STEP);
+			col = Math.round(request.location.lng / LON_STEP);
+		}
+		var result = isNaN(row) || isNaN(col) ? null : panorama(row, col);
+		var status = result ? 'OK' : 'ZERO_RESULTS';
+		if (Math.random() < FAILURE_RATE) {
+			result = null;
+			status = 'UNKNOWN_ERROR';
+		}
+		setTimeout(function() { callback(result, status); }, LATENCY_MS * (0.5 + Math.random()));
+	};
+
+	window.google = {maps: {StreetViewService: StreetViewService}};
+})();
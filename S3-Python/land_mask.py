@@ -0,0 +1,128 @@
+####################################
+#           land_mask.py           #
+#                                  #
+#  Land/water classification from  #
+#  one Static Maps tile per block  #
+#  of grid points instead of one   #
+#  1x1 request per point...        #
+####################################
+import os
+import math
+import threading
+import collections
+import numpy as np
+
+TILE_SIZE  = 512 # Pixels of a tile used for classification...
+FETCH_SIZE = 640 # Pixels requested: the margin keeps the Google logo and attribution out of the tile.
+
+
+def world_pixels(lats, lons, zoom):
+	""" world_pixels
+	Projects lat,lon pairs to Web Mercator pixel coordinates at the given zoom (the Static Maps projection).
+	Output: Two numpy arrays with the x, y pixel coordinates.
+	"""
+	size = 256.0 * 2 ** zoom
+	lats = np.radians(np.clip(np.asarray(lats, dtype = np.float64), -85.05112878, 85.05112878))
+	x = (np.asarray(lons, dtype = np.float64) + 180.0) / 360.0 * size
+	y = (1.0 - np.log(np.tan(lats) + 1.0 / np.cos(lats)) / math.pi) / 2.0 * size
+	return x, y
+
+def pixel_latlon(x, y, zoom):
+	""" pixel_latlon
+	Inverse of world_pixels for a single pixel coordinate.
+	"""
+	size = 256.0 * 2 ** zoom
+	lon = x / size * 360.0 - 180.0
+	lat = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * y / size))))
+	return lat, lon
+
+
+class TiledLandMask(object):
+	""" TiledLandMask
+	Splits the map at a zoom level into TILE_SIZE pixel tiles. The first time a point falls in a tile,
+	a single FETCH_SIZE map centered on the tile is fetched, decoded once and reduced to a boolean
+	water raster (pixels equal to water_rgb); every later point in the tile is a pixel lookup.
+	Rasters are kept in memory (up to max_tiles, least recently used dropped) and, if mask_dir is
+	given, saved there to be reused by later runs.
+	fetch_tile(lat, lon, zoom, size) must return the size x size x 3 RGB array of the map centered at lat,lon.
+	"""
+	def __init__(self, fetch_tile, water_rgb, zoom = 17, mask_dir = None, max_tiles = 256):
+		self.fetch_tile = fetch_tile
+		self.water_rgb  = np.array(water_rgb, dtype = np.uint8)
+		self.zoom       = zoom
+		self.mask_dir   = mask_dir
+		self.max_tiles  = max_tiles
+		self.tiles      = collections.OrderedDict()
+		self.loading    = {} # Tile --> Event set once the thread loading it is done...
+		self.fetched    = 0 # Number of map requests made...
+		self.lock       = threading.Lock()
+		if mask_dir is not None and not os.path.isdir(self.tile_dir()): os.makedirs(self.tile_dir())
+
+	def tile_dir(self):
+		return os.path.join(self.mask_dir, 'z' + str(self.zoom))
+
+	def tile_path(self, tile):
+		return os.path.join(self.tile_dir(), str(tile[0]) + '_' + str(tile[1]) + '.npy')
+
+	def load_tile(self, tile):
+		""" load_tile
+		Returns the TILE_SIZE x TILE_SIZE boolean water raster of a tile: from memory, disk or a fetch.
+		Tiles are read and fetched outside the lock, so threads wait only on those loading the same tile.
+		"""
+		while True:
+			with self.lock:
+				if tile in self.tiles:
+					self.tiles[tile] = self.tiles.pop(tile) # Most recently used...
+					return self.tiles[tile]
+				loading = self.loading.get(tile)
+				if loading is None:
+					self.loading[tile] = threading.Event()
+					break
+			loading.wait() # Another thread is loading it: use its raster, or load it if that failed...
+
+		try:
+			water = self.read_tile(tile)
+			with self.lock:
+				self.tiles[tile] = water
+				if len(self.tiles) > self.max_tiles: self.tiles.popitem(last = False)
+		finally:
+			with self.lock: self.loading.pop(tile).set()
+		return water
+
+	def read_tile(self, tile):
+		""" read_tile
+		Reads the water raster of a tile from mask_dir, or fetches and classifies its map (saving it to mask_dir).
+		"""
+		if self.mask_dir is not None and os.path.exists(self.tile_path(tile)):
+			return np.unpackbits(np.load(self.tile_path(tile)))[:TILE_SIZE * TILE_SIZE].reshape(TILE_SIZE, TILE_SIZE).astype(bool)
+
+		center_lat, center_lon = pixel_latlon((tile[0] + 0.5) * TILE_SIZE, (tile[1] + 0.5) * TILE_SIZE, self.zoom)
+		image = np.asarray(self.fetch_tile(center_lat, center_lon, self.zoom, FETCH_SIZE))[:, :, :3]
+		with self.lock: self.fetched += 1
+		margin = (FETCH_SIZE - TILE_SIZE) / 2
+		water = (image[margin:margin + TILE_SIZE, margin:margin + TILE_SIZE] == self.water_rgb).all(axis = 2)
+		if self.mask_dir is not None:
+			# Written aside then renamed, so that no other run reads a partial tile...
+			with open(self.tile_path(tile) + '.part', 'wb') as part: np.save(part, np.packbits(water))
+			os.rename(self.tile_path(tile) + '.part', self.tile_path(tile))
+		return water
+
+	def water_mask(self, lats, lons):
+		""" water_mask
+		Input: Arrays of lats, lons.
+		Output: A boolean array, True where the point is over water.
+		"""
+		x, y = world_pixels(lats, lons, self.zoom)
+		x, y = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+		tiles_x, tiles_y = x // TILE_SIZE, y // TILE_SIZE
+		water = np.zeros(len(x), dtype = bool)
+
+		# One raster per distinct tile, then a vectorized pixel lookup for all the points in it.
+		for tile in set(zip(tiles_x.tolist(), tiles_y.tolist())):
+			in_tile = (tiles_x == tile[0]) & (tiles_y == tile[1])
+			raster = self.load_tile(tile)
+			water[in_tile] = raster[y[in_tile] - tile[1] * TILE_SIZE, x[in_tile] - tile[0] * TILE_SIZE]
+		return water
+
+	def land_mask(self, lats, lons):
+		return ~self.water_mask(lats, lons)
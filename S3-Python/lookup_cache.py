@@ -0,0 +1,104 @@
+####################################
+#          lookup_cache.py         #
+#                                  #
+#  Persistent SQLite cache for the #
+#  billable lookups (water, roads, #
+#  panorama links) so that reruns  #
+#  and overlapping surveys reuse   #
+#  earlier answers...              #
+####################################
+import json
+import hashlib
+import sqlite3
+import threading
+
+MISSING = object() # Distinguishes a cache miss from a cached None...
+ACCESS_BATCH = 1000 # Hits whose access times are written (and committed) together...
+
+
+class LookupCache(object):
+	""" LookupCache
+	Content-addressed key/value store: the key is a hash of the lookup namespace, the lat,lon quantized
+	to `precision` decimals and any query parameters; the value is stored as JSON.
+	Holds at most max_entries rows, evicting the least recently used ones past that cap. The access times
+	of hits are written in batches of ACCESS_BATCH, and before any eviction or close().
+	Safe to share between threads.
+	"""
+	def __init__(self, path, max_entries = 1000000, precision = 6):
+		self.path        = path
+		self.max_entries = max_entries
+		self.precision   = precision
+		self.hits        = {}
+		self.misses      = {}
+		self.accessed    = {} # key --> access time not yet written...
+		self.lock        = threading.Lock()
+
+		self.db = sqlite3.connect(path, check_same_thread = False)
+		self.db.execute('CREATE TABLE IF NOT EXISTS lookups (key TEXT PRIMARY KEY, value TEXT, accessed INTEGER)')
+		self.db.execute('CREATE INDEX IF NOT EXISTS lookups_accessed ON lookups (accessed)')
+		self.db.commit()
+		self.clock   = self.db.execute('SELECT COALESCE(MAX(accessed), 0) FROM lookups').fetchone()[0]
+		self.entries = self.db.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+
+	def key(self, namespace, lat, lon, params = ()):
+		""" key
+		Returns the hex digest addressing a lookup of namespace at lat,lon with params.
+		"""
+		quantized = '%.*f,%.*f' % (self.precision, float(lat), self.precision, float(lon))
+		content = '|'.join([namespace, quantized] + [str(p) for p in params])
+		return hashlib.sha1(content).hexdigest()
+
+	def get(self, namespace, lat, lon, params = ()):
+		""" get
+		Returns the cached value, or MISSING if the lookup has not been seen before.
+		"""
+		key = self.key(namespace, lat, lon, params)
+		with self.lock:
+			row = self.db.execute('SELECT value FROM lookups WHERE key = ?', (key,)).fetchone()
+			if row is None:
+				self.misses[namespace] = self.misses.get(namespace, 0) + 1
+				return MISSING
+			self.hits[namespace] = self.hits.get(namespace, 0) + 1
+			self.clock += 1
+			self.accessed[key] = self.clock
+			if len(self.accessed) >= ACCESS_BATCH:
+				self.write_accessed()
+				self.db.commit()
+		return json.loads(row[0])
+
+	def write_accessed(self):
+		# Called with the lock held; committed by the caller...
+		self.db.executemany('UPDATE lookups SET accessed = ? WHERE key = ?', [(clock, key) for key, clock in self.accessed.items()])
+		self.accessed = {}
+
+	def put(self, namespace, lat, lon, value, params = ()):
+		""" put
+		Stores a JSON-serializable value for the lookup, evicting the LRU entries past max_entries.
+		"""
+		key = self.key(namespace, lat, lon, params)
+		with self.lock:
+			self.clock += 1
+			self.accessed.pop(key, None)
+			if self.db.execute('SELECT 1 FROM lookups WHERE key = ?', (key,)).fetchone() is None: self.entries += 1
+			self.db.execute('INSERT OR REPLACE INTO lookups (key, value, accessed) VALUES (?, ?, ?)', \
+			                (key, json.dumps(value), self.clock))
+			if self.entries > self.max_entries:
+				self.write_accessed() # The LRU order must account for every hit...
+				# Evict down to 90% of the cap so the scan is not repeated on every insert...
+				excess = self.entries - int(self.max_entries * 0.9)
+				self.db.execute('DELETE FROM lookups WHERE key IN (SELECT key FROM lookups ORDER BY accessed LIMIT ?)', (excess,))
+				self.entries -= excess
+			self.db.commit()
+
+	def stats(self):
+		""" stats
+		Returns {namespace: (hits, misses)}; every hit is one API call (or node spawn) saved.
+		"""
+		namespaces = set(self.hits) | set(self.misses)
+		return dict((ns, (self.hits.get(ns, 0), self.misses.get(ns, 0))) for ns in namespaces)
+
+	def close(self):
+		with self.lock:
+			self.write_accessed()
+			self.db.commit()
+			self.db.close()
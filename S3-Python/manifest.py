@@ -0,0 +1,166 @@
+####################################
+#           manifest.py            #
+#                                  #
+#  Buffered, append-only manifest  #
+#  of the saved images, written in #
+#  batches to Parquet (or CSV) so  #
+#  a dataset loads in one read...  #
+####################################
+import os
+import csv
+import errno
+import glob
+import threading
+import numpy as np
+
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+except ImportError:
+	pa = None # Parquet manifests need pyarrow; CSV is always available.
+
+# One row per saved image. Text columns are objects, as a fixed width would silently cut a long path or pano id...
+MANIFEST_DTYPE = np.dtype([('ref', np.int64), ('step', np.int64), ('lat', np.float64), ('lon', np.float64),
+                           ('heading', np.float64), ('pano', object), ('grid_lat', np.float64), ('grid_lon', np.float64),
+                           ('timestamp', np.float64), ('bytes', np.int64), ('filename', object)])
+COLUMNS = MANIFEST_DTYPE.names
+
+
+def manifest_path(directory, format):
+	""" manifest_path
+	A CSV manifest is a single file; a Parquet manifest is a directory of part files, one per writer.
+	"""
+	return os.path.join(directory, 'manifest.csv' if format == 'csv' else 'manifest')
+
+def default_format():
+	return 'parquet' if pa is not None else 'csv'
+
+
+def arrow_table(records):
+	# Text columns are stored as strings rather than raw bytes...
+	return pa.Table.from_arrays([pa.array(records[name].tolist(), type = pa.string()) if records.dtype[name].kind == 'O' \
+	                             else pa.array(records[name]) for name in COLUMNS], COLUMNS)
+
+
+class ManifestWriter(object):
+	""" ManifestWriter
+	Collects manifest rows in per-column buffers and appends them to the manifest every buffer_rows rows
+	(and on flush/close): as a row group of this writer's Parquet part file, or as lines of the CSV file.
+	Rows still buffered are lost if the process dies, and a Parquet part is only readable once closed:
+	a resumed run restores them from its journal (see repair_manifest).
+	Safe to share between threads.
+	"""
+	def __init__(self, path, format = None, buffer_rows = 10000):
+		self.format = format or default_format()
+		if self.format == 'parquet' and pa is None: raise ImportError('A Parquet manifest requires pyarrow')
+		self.path        = path
+		self.buffer_rows = buffer_rows
+		self.columns     = dict((name, []) for name in COLUMNS)
+		self.buffered    = 0
+		self.written     = 0
+		self.writer      = None # The ParquetWriter of this writer's part file...
+		self.lock        = threading.Lock()
+
+	def append(self, row):
+		""" append
+		Input: A row of values in COLUMNS order.
+		"""
+		with self.lock:
+			for name, value in zip(COLUMNS, row): self.columns[name].append(value)
+			self.buffered += 1
+			if self.buffered >= self.buffer_rows: self.write_buffer()
+
+	def extend(self, rows):
+		for row in rows: self.append(row)
+
+	def flush(self):
+		with self.lock:
+			self.write_buffer()
+
+	def write_buffer(self):
+		if self.buffered == 0: return
+		records = np.array(zip(*[self.columns[name] for name in COLUMNS]), dtype = MANIFEST_DTYPE)
+		if self.format == 'parquet':
+			if self.writer is None:
+				self.writer = pq.ParquetWriter(new_part(self.path), arrow_table(records).schema)
+			self.writer.write_table(arrow_table(records))
+		else:
+			new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+			with open(self.path, 'ab') as f:
+				writer = csv.writer(f)
+				if new: writer.writerow(COLUMNS)
+				writer.writerows(records.tolist())
+		self.written += self.buffered
+		self.columns  = dict((name, []) for name in COLUMNS)
+		self.buffered = 0
+
+	def close(self):
+		with self.lock:
+			self.write_buffer()
+			if self.writer is not None: self.writer.close()
+			self.writer = None
+
+
+def new_part(path):
+	""" new_part
+	Claims the path of a new Parquet part file in the manifest directory, numbered after every part already there
+	(including those set aside by repair_manifest). The file is created exclusively, so writers sharing the
+	directory never pick the same part.
+	"""
+	if not os.path.isdir(path):
+		try:
+			os.makedirs(path)
+		except OSError:
+			if not os.path.isdir(path): raise # Not made by another writer meanwhile...
+	while True:
+		names   = [os.path.basename(part)[len('part-'):].split('.')[0] for part in glob.glob(os.path.join(path, 'part-*.parquet*'))]
+		indices = [int(name) for name in names if name.isdigit()]
+		part    = os.path.join(path, 'part-%05d.parquet' % (max(indices) + 1 if indices else 0))
+		try:
+			os.close(os.open(part, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+			return part
+		except OSError as err:
+			if err.errno != errno.EEXIST: raise # Otherwise claimed by another writer: take the next...
+
+def repair_manifest(path):
+	""" repair_manifest
+	Makes the manifest of a run that stopped without closing it readable again: a Parquet part left without
+	its footer is set aside (renamed .corrupt), a partial last CSV line is cut off.
+	Output: The number of Parquet parts set aside.
+	"""
+	if os.path.isdir(path):
+		corrupt = 0
+		for part in sorted(glob.glob(os.path.join(path, 'part-*.parquet'))):
+			try:
+				pq.ParquetFile(part)
+			except Exception:
+				os.rename(part, part + '.corrupt')
+				corrupt += 1
+		return corrupt
+	if os.path.exists(path) and os.path.getsize(path) > 0:
+		with open(path, 'rb+') as f:
+			f.seek(-1, os.SEEK_END)
+			if f.read(1) != '\n':
+				f.seek(0)
+				f.truncate(f.read().rfind('\n') + 1)
+	return 0
+
+def read_manifest(path):
+	""" read_manifest
+	Loads a whole manifest (a Parquet directory or a CSV file) in one read.
+	Output: A MANIFEST_DTYPE array with a row per image; empty if there is no manifest.
+	"""
+	if os.path.isdir(path):
+		parts = sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+		if not parts: return np.empty(0, dtype = MANIFEST_DTYPE)
+		table = pq.ParquetDataset(parts).read()
+		records = np.empty(table.num_rows, dtype = MANIFEST_DTYPE)
+		for name in COLUMNS:
+			chunks = table.column(name).chunks
+			if chunks: records[name] = np.concatenate([chunk.to_numpy(zero_copy_only = False) for chunk in chunks])
+		return records
+	if not os.path.exists(path): return np.empty(0, dtype = MANIFEST_DTYPE)
+	with open(path, 'rb') as f: rows = list(csv.reader(f))[1:] # The csv module, as a filename may hold a quoted comma...
+	records = np.empty(len(rows), dtype = MANIFEST_DTYPE)
+	for name, values in zip(COLUMNS, zip(*rows)): records[name] = values
+	return records
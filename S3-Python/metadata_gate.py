@@ -0,0 +1,87 @@
+####################################
+#         metadata_gate.py         #
+#                                  #
+#  Checks the Street View metadata #
+#  of download jobs beforehand, to #
+#  skip the "no imagery" images    #
+#  and panoramas already taken...  #
+####################################
+import threading
+from multiprocessing.pool import ThreadPool
+
+NO_IMAGERY = ('ZERO_RESULTS', 'NOT_FOUND') # Metadata statuses of a location without a panorama...
+
+
+class MetadataGate(object):
+	""" MetadataGate
+	Filters batches of (lat, lon, heading, filename, ...) download jobs on the Street View metadata of their
+	locations, looked up by num_workers threads with lookup(lat, lon) --> {'status', 'pano_id'} (None on failure):
+	  - a job whose location has no panorama is dropped (it would download the grey placeholder);
+	  - a job whose panorama and heading were already passed on, from any location, is dropped;
+	  - a job whose metadata could not be checked is kept.
+	The pano id found is filled in the jobs' pano field (position 6) when they have one.
+	Safe to share between threads.
+	"""
+	def __init__(self, lookup, num_workers = 8):
+		self.lookup      = lookup
+		self.pool        = ThreadPool(num_workers)
+		self.taken       = {} # (pano id, heading) --> filename of the jobs passed on...
+		self.checked     = 0
+		self.no_imagery  = 0
+		self.duplicates  = 0
+		self.unchecked   = 0
+		self.lock        = threading.Lock()
+
+	def filter(self, jobs):
+		""" filter
+		Output: The jobs worth downloading, in order.
+		"""
+		locations = list(set((job[0], job[1]) for job in jobs))
+		metadata  = dict(zip(locations, self.pool.map(lambda location: self.lookup(*location), locations)))
+
+		kept = []
+		with self.lock:
+			for job in jobs:
+				self.checked += 1
+				found = metadata[(job[0], job[1])]
+				if found is None or found.get('status') != 'OK' or not found.get('pano_id'):
+					if found is not None and found.get('status') in NO_IMAGERY:
+						self.no_imagery += 1
+						continue
+					self.unchecked += 1
+					kept.append(job)
+					continue
+
+				# The same image as a job already passed on (unless it is that job again, being retried)...
+				taken = (found['pano_id'], round(float(job[2]) % 360, 1))
+				if self.taken.setdefault(taken, job[3]) != job[3]:
+					self.duplicates += 1
+					continue
+				kept.append(job[:6] + (found['pano_id'],) + job[7:] if len(job) > 6 else job)
+		return kept
+
+	def mark_taken(self, jobs):
+		""" mark_taken
+		Marks the images of (lat, lon, heading, filename, ...) jobs as taken already (eg: those downloaded by the run
+		resumed), so that jobs repeating them are dropped. The pano id of a job lacking one (position 6) is looked up.
+		"""
+		jobs      = list(jobs)
+		locations = list(set((job[0], job[1]) for job in jobs if len(job) <= 6 or not job[6]))
+		metadata  = dict(zip(locations, self.pool.map(lambda location: self.lookup(*location), locations)))
+		with self.lock:
+			for job in jobs:
+				found = metadata.get((job[0], job[1])) or {}
+				pano  = job[6] if len(job) > 6 and job[6] else found.get('pano_id')
+				if pano: self.taken.setdefault((pano, round(float(job[2]) % 360, 1)), job[3])
+
+	def stats(self):
+		""" stats
+		Output: {checked, no_imagery, duplicates, unchecked, avoided}; avoided counts the downloads skipped.
+		"""
+		with self.lock:
+			return {'checked': self.checked, 'no_imagery': self.no_imagery, 'duplicates': self.duplicates,
+			        'unchecked': self.unchecked, 'avoided': self.no_imagery + self.duplicates}
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
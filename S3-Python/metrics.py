@@ -0,0 +1,189 @@
+####################################
+#            metrics.py            #
+#                                  #
+#  Per-stage call counts, latency  #
+#  histograms, bytes and errors of #
+#  a run, for a JSON run report    #
+#  and periodic progress lines...  #
+####################################
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+
+# Upper bounds (seconds) of the latency histogram buckets: 0.1ms doubling up to ~105s, then an overflow bucket...
+LATENCY_BUCKETS = [0.0001 * 2 ** i for i in range(21)]
+
+
+class StageMetrics(object):
+	""" StageMetrics
+	The calls of one instrumented stage: how many, the items they processed (eg: points of a chunk),
+	the bytes they moved, how many failed, and the histogram of their latencies.
+	"""
+	def __init__(self):
+		self.calls   = 0
+		self.items   = 0
+		self.bytes   = 0
+		self.errors  = 0
+		self.seconds = 0.0
+		self.max     = 0.0
+		self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+	def record(self, seconds, items, size, error):
+		self.calls   += 1
+		self.items   += items
+		self.bytes   += size
+		self.errors  += 1 if error else 0
+		self.seconds += seconds
+		self.max      = max(self.max, seconds)
+		self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+	def percentile(self, q):
+		""" percentile
+		Output: The upper bound of the histogram bucket holding the q quantile (0 < q <= 1); the max for the overflow bucket.
+		"""
+		rank = q * self.calls
+		seen = 0
+		for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+			seen += count
+			if count and seen >= rank: return min(bound, self.max)
+		return self.max
+
+	def report(self):
+		return {'calls'       : self.calls,
+		        'items'       : self.items,
+		        'bytes'       : self.bytes,
+		        'errors'      : self.errors,
+		        'seconds'     : self.seconds,
+		        'mean_seconds': self.seconds / self.calls if self.calls else 0.0,
+		        'p50_seconds' : self.percentile(0.5),
+		        'p90_seconds' : self.percentile(0.9),
+		        'p99_seconds' : self.percentile(0.99),
+		        'max_seconds' : self.max,
+		        'histogram'   : dict((repr(bound), count) for bound, count in zip(LATENCY_BUCKETS + [float('inf')], self.buckets) if count)}
+
+	def add_report(self, report):
+		""" add_report
+		Adds the calls of a report() (eg: of an earlier run, read back from its JSON report) to these.
+		"""
+		self.calls   += report.get('calls', 0)
+		self.items   += report.get('items', 0)
+		self.bytes   += report.get('bytes', 0)
+		self.errors  += report.get('errors', 0)
+		self.seconds += report.get('seconds', 0.0)
+		self.max      = max(self.max, report.get('max_seconds', 0.0))
+		buckets = dict((repr(bound), i) for i, bound in enumerate(LATENCY_BUCKETS + [float('inf')]))
+		for bound, count in report.get('histogram', {}).items():
+			if bound in buckets: self.buckets[buckets[bound]] += count
+
+
+class Timer(object):
+	""" Timer
+	Context manager recording the time of its block in a stage; an exception leaving the block counts as an error.
+	items and bytes may be set on the timer inside the block.
+	"""
+	def __init__(self, metrics, name, items = 1):
+		self.metrics = metrics
+		self.name    = name
+		self.items   = items
+		self.bytes   = 0
+
+	def __enter__(self):
+		self.start = time.time()
+		return self
+
+	def __exit__(self, kind, value, traceback):
+		self.metrics.record(self.name, time.time() - self.start, self.items, self.bytes, kind is not None)
+		return False
+
+
+class Metrics(object):
+	""" Metrics
+	The StageMetrics of every stage of a run, by name, and plain counters (eg: points found valid).
+	Safe to share between threads.
+	"""
+	def __init__(self, clock = time.time):
+		self.clock    = clock
+		self.started  = clock()
+		self.stages   = {}
+		self.counters = {}
+		self.earlier  = 0.0 # Seconds of the earlier runs resumed...
+		self.lock     = threading.Lock()
+
+	def record(self, name, seconds, items = 1, size = 0, error = False):
+		with self.lock:
+			if name not in self.stages: self.stages[name] = StageMetrics()
+			self.stages[name].record(seconds, items, size, error)
+
+	def resume(self, report):
+		""" resume
+		Carries on from the report() of an earlier run: its stages, counters and elapsed time are added to these.
+		"""
+		with self.lock:
+			for name, stage in report.get('stages', {}).items():
+				if name not in self.stages: self.stages[name] = StageMetrics()
+				self.stages[name].add_report(stage)
+			for name, count in report.get('counters', {}).items(): self.counters[name] = self.counters.get(name, 0) + count
+			self.earlier += report.get('elapsed_seconds', 0.0)
+
+	def time(self, name, items = 1):
+		return Timer(self, name, items)
+
+	def count(self, name, n = 1):
+		with self.lock:
+			self.counters[name] = self.counters.get(name, 0) + n
+
+	def report(self):
+		""" report
+		Output: {elapsed_seconds, stages: {name: {calls, items, bytes, errors, seconds, *_seconds, histogram}}, counters},
+		        including those of any earlier run resumed.
+		"""
+		with self.lock:
+			return {'elapsed_seconds': self.earlier + self.clock() - self.started,
+			        'stages'         : dict((name, stage.report()) for name, stage in self.stages.items()),
+			        'counters'       : dict(self.counters)}
+
+	def progress(self):
+		""" progress
+		Output: A one line summary of the run so far: calls (items) of every stage, and the counters.
+		"""
+		with self.lock:
+			stages   = [name + ' ' + str(stage.calls) + (' (' + str(stage.items) + ')' if stage.items != stage.calls else '') + \
+			            (' ' + str(stage.errors) + ' errors' if stage.errors else '') for name, stage in sorted(self.stages.items())]
+			counters = [name + ' ' + str(count) for name, count in sorted(self.counters.items())]
+			return 'Progress [' + str(int(self.clock() - self.started)) + 's]: ' + ', '.join(stages + counters)
+
+	def write_report(self, path, extra = None):
+		""" write_report
+		Writes the report, with any extra sections (eg: the API usage), as JSON to path.
+		"""
+		report = self.report()
+		report.update(extra or {})
+		with open(path + '.tmp', 'w') as f: json.dump(report, f, indent = 1, sort_keys = True)
+		os.rename(path + '.tmp', path)
+		return report
+
+
+class ProgressReporter(object):
+	""" ProgressReporter
+	Prints the progress line of a Metrics every interval seconds from a background thread, until stopped.
+	"""
+	def __init__(self, metrics, interval, out = sys.stdout):
+		self.metrics  = metrics
+		self.interval = interval
+		self.out      = out
+		self.stopped  = threading.Event()
+		self.thread   = threading.Thread(target = self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			self.out.write(self.metrics.progress() + '\n')
+			self.out.flush()
+
+	def stop(self):
+		self.stopped.set()
+		self.thread.join()
@@ -0,0 +1,221 @@
+####################################
+#          node_engine.py          #
+#                                  #
+#  Client of the S3-Node engine    #
+#  (rpc_s3.js) over a Unix socket: #
+#  panorama links, metadata and    #
+#  downloads from one persistent,  #
+#  concurrent node process...      #
+####################################
+import os
+import json
+import time
+import socket
+import itertools
+import threading
+import subprocess
+from panorama_workers import link_records
+from quota_scheduler import QuotaExhausted, STREETVIEW, METADATA
+
+ENGINE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'S3-Node', 'rpc_s3.js')
+
+
+class EngineError(Exception):
+	""" EngineError
+	A request the engine answered with an error, or could not answer (code 'DISCONNECTED' or 'TIMEOUT').
+	"""
+	def __init__(self, code, message):
+		Exception.__init__(self, code + ': ' + message)
+		self.code = code
+
+
+class NodeEngine(object):
+	""" NodeEngine
+	Client of an rpc_s3.js engine listening on a Unix socket (the message format is described in
+	S3-Node/src/rpc_server.js). Requests are written as JSON lines over one connection and a reader thread
+	routes each reply back to the waiting caller by id, so the requests of any number of threads are in
+	flight at once and the engine serves them concurrently. The connection is reopened on the next request
+	once lost.
+	It stands in for the PANORAMA_WORKERS (lookup, lookup_many), the Metadata API lookup of S3.streetview_metadata (metadata) and
+	the DOWNLOADER (download) of S3.py. With a Metrics, every request is timed as the 'engine.<method>' stage.
+	With a QuotaScheduler, each location checked and image downloaded first takes its request of the Metadata or
+	Street View budget, so the engine's calls are paced and counted like those sent from Python.
+	"""
+	def __init__(self, socket_path, timeout = 30.0, metrics = None, process = None, scheduler = None):
+		self.socket_path = socket_path
+		self.timeout     = timeout
+		self.metrics     = metrics
+		self.scheduler   = scheduler
+		self.process     = process # The engine process, when launched by this client...
+		self.ids         = itertools.count()
+		self.pending     = {} # id --> [threading.Event, reply]
+		self.lock        = threading.Lock()
+		self.connection  = None
+		self.connect()
+
+	@classmethod
+	def launch(cls, socket_path, api_key, google_url = None, maps_script_url = None, script = ENGINE_SCRIPT, wait = 60.0, **kwargs):
+		""" launch
+		Connects to the engine listening on socket_path, starting one (node script) if none is.
+		The engine only listens once the Google Javascript API is loaded; it is stopped by close(), or once the
+		calling process exits.
+		"""
+		try:
+			return cls(socket_path, **kwargs)
+		except socket.error:
+			pass
+		args = ['node', script, '--socket', socket_path, '--api-key', api_key, '--lifeline']
+		if google_url:      args += ['--google-url', google_url]
+		if maps_script_url: args += ['--maps-script', maps_script_url]
+		process  = subprocess.Popen(args, stdin = subprocess.PIPE) # The engine stops once this process exits...
+		deadline = time.time() + wait
+		while True:
+			try:
+				return cls(socket_path, process = process, **kwargs)
+			except socket.error:
+				if process.poll() is not None: raise EngineError('DISCONNECTED', 'The engine exited with status ' + str(process.returncode))
+				if time.time() > deadline:
+					process.terminate()
+					raise EngineError('TIMEOUT', 'The engine did not listen on ' + socket_path + ' within ' + str(wait) + 's')
+				time.sleep(0.1)
+
+	def connect(self):
+		connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		connection.connect(self.socket_path)
+		self.connection = connection
+		reader = threading.Thread(target = self.read_replies, args = (connection,))
+		reader.daemon = True
+		reader.start()
+
+	def read_replies(self, connection):
+		try:
+			for line in connection.makefile('r'):
+				try:
+					reply = json.loads(line)
+				except ValueError:
+					continue # Not a reply...
+				with self.lock:
+					waiter = self.pending.pop(reply.get('id'), None)
+				if waiter is not None:
+					waiter[1] = reply
+					waiter[0].set()
+		except socket.error:
+			pass # Closed under the reader...
+
+		# The connection is lost: release everyone still waiting on it (their reply stays None).
+		with self.lock:
+			if self.connection is connection: self.connection = None
+			waiters, self.pending = self.pending.values(), {}
+		for waiter in waiters: waiter[0].set()
+
+	def submit(self, method, params):
+		""" submit
+		Sends a request without waiting; returns the waiter to pass to result().
+		"""
+		request_id = next(self.ids)
+		waiter = [threading.Event(), None]
+		with self.lock:
+			try:
+				if self.connection is None: self.connect()
+				self.pending[request_id] = waiter
+				self.connection.sendall(json.dumps({'id': request_id, 'method': method, 'params': params}) + '\n')
+			except socket.error:
+				self.pending.pop(request_id, None)
+				waiter[0].set()
+		return waiter
+
+	def result(self, waiter, timeout = None):
+		""" result
+		Waits for a submitted request (timeout seconds at most, unless None).
+		Output: The results of the reply. Raises EngineError if it is an error, lost or late.
+		"""
+		deadline = None if timeout is None else time.time() + timeout
+		while not waiter[0].wait(1.0): # A timeout keeps the wait interruptible...
+			if deadline is not None and time.time() > deadline: raise EngineError('TIMEOUT', 'No reply within ' + str(timeout) + 's')
+		reply = waiter[1]
+		if reply is None: raise EngineError('DISCONNECTED', 'The connection to the engine was lost')
+		if 'error' in reply: raise EngineError(reply['error'].get('code', 'ERROR'), reply['error'].get('message', ''))
+		return reply['results']
+
+	def call(self, method, params, items, timeout = None):
+		start = time.time()
+		try:
+			results = self.result(self.submit(method, params), timeout)
+		except EngineError:
+			if self.metrics is not None: self.metrics.record('engine.' + method, time.time() - start, items, error = True)
+			raise
+		if self.metrics is not None: self.metrics.record('engine.' + method, time.time() - start, items)
+		return results
+
+	def lookup(self, lat, lon, radius = 50):
+		return self.lookup_many([(lat, lon)], radius)[0]
+
+	def lookup_many(self, latlon_list, radius = 50):
+		""" lookup_many
+		Looks up the panoramas adjacent to every location with one request.
+		Output: The link_records of each location, in order; None where the lookup failed.
+		"""
+		try:
+			results = self.call('adjacency', {'radius': radius, 'locations': [list(latlon) for latlon in latlon_list]}, len(latlon_list), self.timeout)
+		except EngineError:
+			return [None] * len(latlon_list)
+		return [link_records(result) for result in results]
+
+	def metadata(self, lat, lon):
+		return self.metadata_many([(lat, lon)])[0]
+
+	def metadata_many(self, latlon_list):
+		""" metadata_many
+		Output: The {'status', 'pano_id'} Street View metadata of each location, in order; None where the lookup failed.
+		        Raises QuotaExhausted if the Metadata API refused the lookups, or their budget is used up.
+		"""
+		if self.scheduler is not None:
+			for latlon in latlon_list: self.scheduler.acquire(METADATA)
+		try:
+			return self.call('metadata', {'locations': [list(latlon) for latlon in latlon_list]}, len(latlon_list), self.timeout)
+		except EngineError as err:
+			if err.code == 'API_LIMIT': raise QuotaExhausted(METADATA)
+			return [None] * len(latlon_list)
+
+	def download(self, jobs):
+		""" download
+		Input: A list of (url, filename) jobs.
+		Output: A list of (filename, bytes written, error) in job order; bytes is None on error, and
+		        error a QuotaExhausted where the Street View API refused the image, or its budget is used up.
+		"""
+		sent, over_budget = jobs, [] # The jobs within the Street View budget, and the errors of the others...
+		if self.scheduler is not None:
+			for index in range(len(jobs)):
+				try:
+					self.scheduler.acquire(STREETVIEW)
+				except QuotaExhausted as err:
+					sent, over_budget = jobs[:index], [(filename, None, err) for url, filename in jobs[index:]]
+					break
+		if not sent: return over_budget
+		try:
+			results = self.call('download', {'jobs': [list(job) for job in sent]}, len(sent))
+		except EngineError as err:
+			return [(filename, None, err) for url, filename in sent] + over_budget
+		downloaded = []
+		for (url, filename), result in zip(sent, results):
+			error = result.get('error')
+			if error is None:                     downloaded.append((filename, result['bytes'], None))
+			elif error.get('code') == 'API_LIMIT': downloaded.append((filename, None, QuotaExhausted(STREETVIEW)))
+			else:                                 downloaded.append((filename, None, EngineError(error.get('code', 'ERROR'), error.get('message', ''))))
+		return downloaded + over_budget
+
+	def close(self):
+		""" close
+		Closes the connection, and stops the engine if this client launched it. Closing again does nothing.
+		"""
+		with self.lock:
+			connection, self.connection = self.connection, None
+		if connection is not None:
+			try:
+				connection.shutdown(socket.SHUT_RDWR)
+			except socket.error:
+				pass
+			connection.close()
+		if self.process is not None and self.process.poll() is None:
+			self.process.terminate()
+			self.process.wait()
@@ -0,0 +1,177 @@
+####################################
+#       panorama_workers.py        #
+#                                  #
+#  Pool of long-lived node panora- #
+#  ma_worker.js processes: the     #
+#  JSDOM + Maps environment boots  #
+#  once per worker instead of once #
+#  per walk step...                #
+####################################
+import json
+import time
+import itertools
+import threading
+import subprocess
+import numpy as np
+
+WORKER_SCRIPT = './javascript_panoramas/panorama_worker.js'
+
+# A link of a reply is a [pano, heading, lat, lon] record (see javascript_panoramas/panorama_links.js).
+# Pano ids are kept as objects: Google does not bound their length, and a fixed width would cut them silently...
+LINK_DTYPE = np.dtype([('pano', object), ('heading', np.float64), ('lat', np.float64), ('lon', np.float64)])
+
+# Statuses answering a lookup for good; any other (e.g. UNKNOWN_ERROR, OVER_QUERY_LIMIT) is a failed lookup...
+DEFINITIVE_STATUSES = ('OK', 'ZERO_RESULTS')
+
+
+def link_records(result):
+	""" link_records
+	Decodes the result of one location of a reply into compact records.
+	Input: A {"status", "links"} result; None if the lookup failed.
+	Output: A LINK_DTYPE array of the links whose location was resolved (empty if there is no panorama),
+	        or None if the lookup failed or its status is not one of DEFINITIVE_STATUSES.
+	"""
+	if result is None or result.get('status') not in DEFINITIVE_STATUSES: return None
+	return np.array([tuple(link) for link in result['links'] if link[2] is not None], dtype = LINK_DTYPE)
+
+def decode_reply(line):
+	""" decode_reply
+	Decodes a reply line of get_next_panorama.js or panorama_worker.js.
+	Output: The reply id and the list of link_records, one per location of the request.
+	"""
+	reply = json.loads(line)
+	return reply.get('id'), [link_records(result) for result in reply.get('results') or []]
+
+
+class PanoramaWorker(object):
+	""" PanoramaWorker
+	One node worker process. Requests are written to its STDIN as JSON lines and a reader
+	thread routes each JSON reply on its STDOUT back to the waiting caller by id.
+	ready is set once the worker has loaded the Maps script (or exited).
+	"""
+	def __init__(self, args):
+		self.process = subprocess.Popen(args, stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+		self.pending = {} # id --> [threading.Event, reply]
+		self.ready   = threading.Event()
+		self.lock    = threading.Lock()
+		self.reader  = threading.Thread(target = self.read_replies)
+		self.reader.daemon = True
+		self.reader.start()
+
+	def alive(self):
+		return self.process.poll() is None
+
+	def read_replies(self):
+		for line in iter(self.process.stdout.readline, ''):
+			try:
+				reply = json.loads(line)
+			except ValueError:
+				continue # Not a reply...
+			if reply.get('ready'):
+				self.ready.set()
+				continue
+			with self.lock:
+				waiter = self.pending.pop(reply.get('id'), None)
+			if waiter is not None:
+				waiter[1] = reply
+				waiter[0].set()
+
+		# The worker exited: release everyone still waiting on it (their reply stays None).
+		self.ready.set()
+		with self.lock:
+			waiters, self.pending = self.pending.values(), {}
+		for waiter in waiters: waiter[0].set()
+
+	def submit(self, request):
+		""" submit
+		Sends a request without waiting; returns the waiter to pass to result().
+		"""
+		waiter = [threading.Event(), None]
+		with self.lock:
+			self.pending[request['id']] = waiter
+			try:
+				self.process.stdin.write(json.dumps(request) + '\n')
+				self.process.stdin.flush()
+			except (IOError, ValueError): # Broken pipe: the worker is gone...
+				self.pending.pop(request['id'], None)
+				waiter[0].set()
+		return waiter
+
+	def abandon(self, request_id):
+		""" abandon
+		Forgets a request no longer waited for, so that a late reply is dropped instead of kept pending.
+		"""
+		with self.lock:
+			self.pending.pop(request_id, None)
+
+	def close(self):
+		try:
+			self.process.stdin.close()
+		except IOError:
+			pass
+		self.process.wait()
+
+
+class PanoramaWorkerPool(object):
+	""" PanoramaWorkerPool
+	Spreads adjacent panorama lookups round-robin over num_workers node processes.
+	A request carries any number of locations and each worker serves many requests concurrently;
+	the pool may be shared between threads.
+	Dead workers are restarted on their next use.
+	A request has timeout seconds to be answered from the time its worker is ready: a worker loading the Maps
+	script holds its requests, for up to load_timeout seconds (beyond the worker's own MAPS_LOAD_TIMEOUT_MS).
+	"""
+	def __init__(self, api_key, num_workers = 2, maps_script_url = None, script = WORKER_SCRIPT, timeout = 30.0, load_timeout = 90.0):
+		self.args    = ['node', script, api_key] + ([maps_script_url] if maps_script_url else [])
+		self.timeout = timeout
+		self.load_timeout = load_timeout
+		self.ids     = itertools.count()
+		self.lock    = threading.Lock()
+		self.workers = [PanoramaWorker(self.args) for _ in range(num_workers)]
+
+	def next_worker(self, request_id):
+		with self.lock:
+			index = request_id % len(self.workers)
+			if not self.workers[index].alive(): self.workers[index] = PanoramaWorker(self.args)
+			return self.workers[index]
+
+	def submit(self, locations, radius = 50):
+		""" submit
+		Sends a request without waiting; returns the (worker, request id, waiter) to pass to result().
+		"""
+		request_id = next(self.ids)
+		worker = self.next_worker(request_id)
+		return worker, request_id, worker.submit({'id': request_id, 'radius': radius, 'locations': locations})
+
+	def result(self, request, count):
+		""" result
+		Waits for a submitted request of count locations; a request timing out is abandoned.
+		Output: The link_records of each location; None for every location if the worker failed or timed out.
+		"""
+		worker, request_id, waiter = request
+		deadline = time.time() + self.load_timeout
+		while not worker.ready.wait(1.0): # A timeout keeps the wait interruptible...
+			if time.time() > deadline: break
+		if not waiter[0].wait(self.timeout if worker.ready.is_set() else 0):
+			worker.abandon(request_id)
+			return [None] * count
+		if waiter[1] is None: return [None] * count
+		results = waiter[1].get('results') or []
+		if len(results) != count: return [None] * count
+		return [link_records(result) for result in results]
+
+	def lookup(self, lat, lon, radius = 50):
+		return self.lookup_many([(lat, lon)], radius)[0]
+
+	def lookup_many(self, latlon_list, radius = 50):
+		""" lookup_many
+		Splits the locations in one request per worker and sends them all before waiting on any.
+		Output: The link_records of each location, in order.
+		"""
+		size = max(1, -(-len(latlon_list) // len(self.workers)))
+		batches = [[list(latlon) for latlon in latlon_list[i:i + size]] for i in range(0, len(latlon_list), size)]
+		requests = [self.submit(locations, radius) for locations in batches]
+		return [records for request, locations in zip(requests, batches) for records in self.result(request, len(locations))]
+
+	def close(self):
+		for worker in self.workers: worker.close()
@@ -0,0 +1,116 @@
+####################################
+#           pipeline.py            #
+#                                  #
+#  Staged producer/consumer runner #
+#  with bounded queues between the #
+#  stages, so the network-bound    #
+#  stages of a search overlap...   #
+####################################
+import sys
+import threading
+import Queue
+
+DONE = object() # End of input marker passed down the stages...
+
+
+class Stage(object):
+	""" Stage
+	One step of a Pipeline: workers threads each take items from the stage's input queue and
+	pass them to process(item), which returns an iterable of items for the next stage.
+	flush(), if given, is called once after the last item and returns any remaining items
+	(e.g. a partially filled batch); it only makes sense for single worker stages.
+	"""
+	def __init__(self, name, process, workers = 1, flush = None):
+		self.name    = name
+		self.process = process
+		self.workers = workers
+		self.flush   = flush
+
+
+class Pipeline(object):
+	""" Pipeline
+	Feeds the items of a source iterable through a list of Stages, each running its own workers,
+	with at most queue_size items waiting between two stages. Total wall time then approaches the
+	slowest stage rather than the sum of all of them.
+	If any worker raises, the pipeline stops and run() re-raises the first error.
+	"""
+	def __init__(self, source, stages, queue_size = 16):
+		self.source  = source
+		self.stages  = stages
+		self.queues  = [Queue.Queue(queue_size) for _ in stages]
+		self.running = [stage.workers for stage in stages] # Live workers per stage...
+		self.counts  = [0] * len(stages)                   # Items processed per stage...
+		self.lock    = threading.Lock()
+		self.error   = None
+
+	def put(self, queue, item):
+		# Bounded put that gives up once the pipeline is aborted, so no thread blocks forever.
+		while self.error is None:
+			try:
+				queue.put(item, timeout = 0.5)
+				return True
+			except Queue.Full:
+				continue
+		return False
+
+	def get(self, queue):
+		while self.error is None:
+			try:
+				return queue.get(timeout = 0.5)
+			except Queue.Empty:
+				continue
+		return DONE
+
+	def abort(self):
+		with self.lock:
+			if self.error is None: self.error = sys.exc_info()
+
+	def emit(self, index, items):
+		""" emit
+		Passes the outputs of stage index on to the next stage (outputs of the last stage are dropped).
+		"""
+		if index + 1 == len(self.stages): return
+		for item in items:
+			if not self.put(self.queues[index + 1], item): return
+
+	def feed(self):
+		try:
+			for item in self.source:
+				if not self.put(self.queues[0], item): return
+		except Exception:
+			self.abort()
+		finally:
+			for _ in range(self.stages[0].workers): self.put(self.queues[0], DONE)
+
+	def work(self, index):
+		stage = self.stages[index]
+		try:
+			while True:
+				item = self.get(self.queues[index])
+				if item is DONE: break
+				self.emit(index, stage.process(item) or [])
+				with self.lock: self.counts[index] += 1
+
+			with self.lock:
+				self.running[index] -= 1
+				last = self.running[index] == 0
+			# The last worker out flushes the stage and tells every worker of the next stage to stop.
+			if last and stage.flush is not None: self.emit(index, stage.flush() or [])
+		except Exception:
+			self.abort()
+			last = True
+		if last and index + 1 < len(self.stages):
+			for _ in range(self.stages[index + 1].workers): self.put(self.queues[index + 1], DONE)
+
+	def run(self):
+		threads = [threading.Thread(target = self.feed)]
+		for index, stage in enumerate(self.stages):
+			threads += [threading.Thread(target = self.work, args = (index,), name = stage.name) for _ in range(stage.workers)]
+		for thread in threads:
+			thread.daemon = True
+			thread.start()
+		for thread in threads:
+			while thread.is_alive(): thread.join(1.0) # A timeout keeps the join interruptible...
+
+		if self.error is not None: raise self.error[0], self.error[1], self.error[2]
+		return dict((stage.name, count) for stage, count in zip(self.stages, self.counts))
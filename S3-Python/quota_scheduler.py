@@ -0,0 +1,314 @@
+####################################
+#        quota_scheduler.py        #
+#                                  #
+#  Central pacing of every Google  #
+#  API request: a token bucket and #
+#  a daily budget per API, backing #
+#  off and retrying on 429 / 5xx.  #
+####################################
+import os
+import json
+import time
+import fcntl
+import random
+import hashlib
+import threading
+import collections
+import requests
+
+# The APIs called by S3.py, each with its own budget...
+STATIC_MAPS = 'static_maps'
+ROADS       = 'roads'
+STREETVIEW  = 'streetview'
+METADATA    = 'metadata'
+APIS        = (STATIC_MAPS, ROADS, STREETVIEW, METADATA)
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+RESET_OFFSET = -8 * 3600 # Google daily quotas reset at midnight Pacific Time (taken as UTC-8)...
+WINDOW       = 60.0      # Seconds of history behind the throughput figures...
+MIN_RATE     = 0.1       # Requests/second an API is never slowed down past...
+LEASE        = 100       # Requests of the daily budget taken from the shared state file at a time...
+
+
+class QuotaExhausted(Exception):
+	""" QuotaExhausted
+	Raised when the daily budget of an API is used up and the scheduler is not waiting for the reset.
+	"""
+	def __init__(self, api):
+		Exception.__init__(self, 'Daily budget of the ' + api + ' API used up')
+		self.api = api
+
+
+class TokenBucket(object):
+	""" TokenBucket
+	Lets through rate calls per second on average and bursts of up to burst calls; a rate of None disables it.
+	Callers reserve a token and sleep outside of the lock until it is due, so waiting threads queue fairly.
+	"""
+	def __init__(self, rate = None, burst = 1, clock = time.time, sleep = time.sleep):
+		self.rate   = rate
+		self.burst  = burst
+		self.tokens = float(burst)
+		self.clock  = clock
+		self.sleep  = sleep
+		self.stamp  = clock()
+		self.lock   = threading.Lock()
+
+	def refill(self):
+		now = self.clock()
+		if self.rate: self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+		self.stamp = now
+
+	def set_rate(self, rate):
+		with self.lock:
+			self.refill()
+			self.rate = rate
+
+	def acquire(self):
+		""" acquire
+		Waits for a token.
+		Output: The seconds waited.
+		"""
+		with self.lock:
+			if not self.rate: return 0.0
+			self.refill()
+			self.tokens -= 1
+			wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+		if wait > 0: self.sleep(wait)
+		return wait
+
+
+class ApiBudget(object):
+	""" ApiBudget
+	The pacing and accounting of one API: a token bucket at rate requests/second (None for unlimited),
+	an optional daily_limit, and the counters behind the scheduler's stats.
+	The bucket rate adapts: halved on every 429, then raised back towards rate a step per success.
+	"""
+	def __init__(self, rate = None, burst = 1, daily_limit = None, clock = time.time, sleep = time.sleep):
+		self.rate        = rate
+		self.daily_limit = daily_limit
+		self.bucket      = TokenBucket(rate, burst, clock, sleep)
+		self.used        = 0 # Requests sent today, by every process sharing the state file (counting their leases)...
+		self.leased      = 0 # Requests of the budget leased by this process and not sent yet...
+		self.requests    = 0 # Requests sent by this process...
+		self.retries     = 0
+		self.throttled   = 0 # 429 responses...
+		self.errors      = 0 # Connection errors and timeouts...
+		self.sent        = collections.deque() # Send times within the last WINDOW seconds...
+		self.lock        = threading.Lock()
+
+	def record(self, now):
+		with self.lock:
+			self.requests += 1
+			self.sent.append(now)
+			while self.sent and self.sent[0] < now - WINDOW: self.sent.popleft()
+
+	def throughput(self, now):
+		with self.lock:
+			while self.sent and self.sent[0] < now - WINDOW: self.sent.popleft()
+			if len(self.sent) < 2: return float(len(self.sent)) / WINDOW
+			return len(self.sent) / max(now - self.sent[0], 1.0)
+
+	def slow_down(self, now):
+		""" slow_down
+		Halves the bucket rate after a 429 (an unlimited API starts from half its current throughput).
+		"""
+		with self.lock: self.throttled += 1
+		current = self.bucket.rate or max(self.throughput(now), 2 * MIN_RATE)
+		self.bucket.set_rate(max(MIN_RATE, current / 2.0))
+
+	def speed_up(self):
+		""" speed_up
+		Raises a slowed down bucket rate back towards the configured one (additive increase).
+		"""
+		current = self.bucket.rate
+		if current is None or current == self.rate: return
+		step = (self.rate or 10.0) / 20.0
+		self.bucket.set_rate(current + step if self.rate is None else min(self.rate, current + step))
+
+
+class QuotaScheduler(object):
+	""" QuotaScheduler
+	Sends the GET requests of every API through its ApiBudget. A request waits for its token, counts against
+	the daily budget, and is retried with exponential backoff (or the Retry-After delay) on a 429 or 5xx
+	response or a connection error, up to max_retries times.
+	Once an API has used its daily budget, requests wait for the next reset when wait_for_reset is set,
+	otherwise they raise QuotaExhausted.
+	The daily usage of the api_key is kept in state_file, if given, shared (under a file lock) by every run and
+	process using it: each takes the requests it sends from the file lease requests at a time, and gives back those
+	it did not send on close, so together they never go over the daily budgets.
+	Safe to share between threads.
+	"""
+	def __init__(self, budgets = None, state_file = None, max_retries = 5, backoff = 1.0, max_backoff = 60.0, \
+	             wait_for_reset = True, clock = time.time, sleep = time.sleep, api_key = '', lease = LEASE):
+		self.budgets        = dict(budgets or {})
+		self.state_file     = state_file
+		self.key            = hashlib.sha1(api_key).hexdigest()[:16] # The state of a key, without the key itself...
+		self.lease          = lease
+		self.max_retries    = max_retries
+		self.backoff        = backoff
+		self.max_backoff    = max_backoff
+		self.wait_for_reset = wait_for_reset
+		self.clock          = clock
+		self.sleep          = sleep
+		self.lock           = threading.Lock()
+		self.day            = self.today()
+
+	def today(self):
+		return time.strftime('%Y-%m-%d', time.gmtime(self.clock() + RESET_OFFSET))
+
+	def seconds_to_reset(self):
+		return 86400 - (self.clock() + RESET_OFFSET) % 86400
+
+	def budget(self, api):
+		with self.lock:
+			if api not in self.budgets: self.budgets[api] = ApiBudget(clock = self.clock, sleep = self.sleep)
+			return self.budgets[api]
+
+	def reserve(self, api):
+		""" reserve
+		Takes one request of the daily budget of api, then waits for its token.
+		"""
+		budget = self.budget(api)
+		while True:
+			with self.lock:
+				if self.today() != self.day: # A new quota day...
+					self.day = self.today()
+					for other in self.budgets.values(): other.used, other.leased = 0, 0
+				if budget.leased == 0: self.take_lease(api, budget)
+				if budget.leased > 0:
+					budget.leased -= 1
+					break
+				if not self.wait_for_reset: raise QuotaExhausted(api)
+				wait = self.seconds_to_reset() + 1
+			print 'Daily budget of the ' + api + ' API used up: waiting ' + str(int(wait)) + 's for the reset...'
+			self.sleep(wait)
+		budget.bucket.acquire()
+
+	def acquire(self, api):
+		""" acquire
+		Takes one request of api for a call sent by other means (eg: by the S3-Node engine, which retries on its own):
+		waits for its token and counts it against the daily budget, raising QuotaExhausted as get() would.
+		"""
+		self.reserve(api)
+		self.budget(api).record(self.clock())
+
+	def take_lease(self, api, budget):
+		""" take_lease
+		Leases up to lease requests of the daily budget of api (what is left of it, if less), counting them as used
+		in the state file. Called with the lock held.
+		"""
+		def lease(used):
+			remaining = self.lease if budget.daily_limit is None else max(0, budget.daily_limit - used.get(api, 0))
+			budget.leased = min(self.lease, remaining)
+			used[api] = used.get(api, 0) + budget.leased
+			budget.used = used[api]
+		self.update_state(lease)
+
+	def backoff_delay(self, attempt, retry_after = None):
+		""" backoff_delay
+		The Retry-After delay if the server gave one, otherwise a jittered exponential backoff.
+		"""
+		try:
+			if retry_after is not None: return min(self.max_backoff, float(retry_after))
+		except ValueError:
+			pass # An HTTP date rather than seconds...
+		return random.uniform(0.5, 1.0) * min(self.max_backoff, self.backoff * 2 ** attempt)
+
+	def get(self, api, url, session = None, **kwargs):
+		""" get
+		Sends a GET request to url (with the session if given, otherwise requests) within the budget of api.
+		Output: The response; after max_retries it is the last 429/5xx response, or the last connection error is raised.
+		"""
+		budget = self.budget(api)
+		for attempt in range(self.max_retries + 1):
+			self.reserve(api)
+			budget.record(self.clock())
+			try:
+				response = (session or requests).get(url, **kwargs)
+			except (requests.ConnectionError, requests.Timeout):
+				with budget.lock: budget.errors += 1
+				if attempt == self.max_retries: raise
+				delay = self.backoff_delay(attempt)
+			else:
+				if response.status_code not in RETRY_STATUS:
+					budget.speed_up()
+					return response
+				if response.status_code == 429: budget.slow_down(self.clock())
+				if attempt == self.max_retries: return response
+				delay = self.backoff_delay(attempt, response.headers.get('Retry-After'))
+				response.close()
+			with budget.lock: budget.retries += 1
+			self.sleep(delay)
+
+	def stats(self):
+		""" stats
+		Output: {api: {requests, used_today, remaining_today (None if unlimited), requests_per_second, rate, retries, throttled, errors}}
+		"""
+		now = self.clock()
+		with self.lock: budgets = self.budgets.items()
+		return dict((api, {'requests'            : budget.requests,
+		                   'used_today'          : budget.used - budget.leased,
+		                   'remaining_today'     : None if budget.daily_limit is None else max(0, budget.daily_limit - budget.used + budget.leased),
+		                   'requests_per_second' : budget.throughput(now),
+		                   'rate'                : budget.bucket.rate,
+		                   'retries'             : budget.retries,
+		                   'throttled'           : budget.throttled,
+		                   'errors'              : budget.errors}) for api, budget in budgets)
+
+	def update_state(self, update):
+		""" update_state
+		Calls update({api: requests used today}) on the usage of the key today, and saves it, under the lock of the
+		state file (without a state_file, on the usage of this process alone). Called with the lock held.
+		"""
+		if self.state_file is None:
+			used = dict((api, budget.used) for api, budget in self.budgets.items())
+			update(used)
+			return
+		with open(self.state_file + '.lock', 'a') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				state = {}
+				if os.path.exists(self.state_file):
+					with open(self.state_file) as f: state = json.load(f)
+				if state.get('day') != self.day: state = {'day': self.day, 'keys': {}} # A new quota day...
+				used = state['keys'].setdefault(self.key, {})
+				update(used)
+				with open(self.state_file + '.tmp', 'w') as f: json.dump(state, f)
+				os.rename(self.state_file + '.tmp', self.state_file)
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def close(self):
+		""" close
+		Gives the requests leased and not sent back to the state file.
+		"""
+		with self.lock:
+			if self.today() != self.day: return # The leases were of another day...
+			def give_back(used):
+				for api, budget in self.budgets.items():
+					if budget.leased == 0: continue
+					used[api] = max(0, used.get(api, 0) - budget.leased)
+					budget.used, budget.leased = used[api], 0
+			self.update_state(give_back)
+
+
+def parse_api_values(values, cast):
+	""" parse_api_values
+	Parses an 'api=value,api=value' string into {api: cast(value)}.
+	Raises ValueError for an API not in APIS (eg: a typo, whose value would otherwise never apply) or a malformed item.
+	"""
+	parsed = {}
+	for item in values.split(',') if values else []:
+		api, _, value = item.partition('=')
+		if api not in APIS: raise ValueError('unknown API ' + repr(api) + ' in ' + repr(values) + ' (the APIs are ' + ', '.join(APIS) + ')')
+		parsed[api] = cast(value)
+	return parsed
+
+def parse_budgets(rates = None, daily_limits = None, burst = 1):
+	""" parse_budgets
+	Builds the ApiBudgets of the 'api=value,api=value' strings given on the command line (eg: roads=50,streetview=20).
+	Raises ValueError for an unknown API or a malformed value.
+	"""
+	rates        = parse_api_values(rates, float)
+	daily_limits = parse_api_values(daily_limits, int)
+	return dict((api, ApiBudget(rates.get(api), burst, daily_limits.get(api))) for api in set(rates) | set(daily_limits))
@@ -0,0 +1,170 @@
+####################################
+#          road_snapper.py         #
+#                                  #
+#  Full Google Roads API requests  #
+#  of distinct, unsnapped points,  #
+#  and the distinct roads they     #
+#  snap to, once per run...        #
+####################################
+import threading
+from collections import OrderedDict
+from lookup_cache import MISSING
+
+CACHE_NAMESPACE = 'nearest_roads' # Every road snapped from a point...
+
+
+class RoadSnapper(object):
+	""" RoadSnapper
+	Snaps lat,lon points to their nearest roads with lookup(points) --> [[(lat, lon), ...] per point] requests
+	(S3.google_nearest_roads) of at most batch_limit points:
+	  - points are quantized to precision decimals and each distinct location is looked up once: the answers
+	    of the last max_entries locations are kept, and every answer is stored in cache (a LookupCache) if given;
+	  - a request left short of batch_limit by those answers is filled with lookahead(n), the next n points
+	    due to be snapped, whose answers are then ready when their turn comes;
+	  - every road returned for a point is kept, and each distinct road (to precision decimals) is only
+	    passed on once per run, from the first point snapping to it.
+	Safe to share between threads: a location being looked up by one thread is waited for by the others.
+	"""
+	def __init__(self, lookup, batch_limit = 100, precision = 5, cache = None, lookahead = 400, max_entries = 100000):
+		self.lookup      = lookup
+		self.batch_limit = batch_limit
+		self.precision   = precision
+		self.cache       = cache
+		self.lookahead   = lookahead
+		self.max_entries = max_entries
+		self.answers     = OrderedDict() # Quantized location --> roads, oldest first...
+		self.inflight    = {}            # Quantized location --> Event set once its lookup is over...
+		self.passed      = set()         # Quantized roads already passed on...
+		self.requests    = 0
+		self.requested   = 0
+		self.prefetched  = 0
+		self.cached      = 0
+		self.roads       = 0
+		self.duplicates  = 0
+		self.lock        = threading.Lock()
+
+	def key(self, lat, lon):
+		return (round(float(lat), self.precision), round(float(lon), self.precision))
+
+	def remember(self, key, roads):
+		self.answers[key] = roads
+		if len(self.answers) > self.max_entries: self.answers.popitem(last = False)
+
+	def known(self, key):
+		# Called with the lock held...
+		if key in self.answers: return True
+		if self.cache is None: return False
+		cached = self.cache.get(CACHE_NAMESPACE, key[0], key[1])
+		if cached is MISSING: return False
+		self.remember(key, [tuple(road) for road in cached])
+		self.cached += 1
+		return True
+
+	def claim(self, keys, limit = None):
+		""" claim
+		Marks the unknown locations among keys (up to limit of them) as being looked up by the calling thread.
+		Called with the lock held.
+		Output: (the locations claimed, the Events of those another thread is looking up).
+		"""
+		claimed, waiting, seen = [], [], set()
+		for key in keys:
+			if limit is not None and len(claimed) >= limit: break
+			if key in seen: continue
+			seen.add(key)
+			if key in self.inflight: waiting.append(self.inflight[key])
+			elif not self.known(key):
+				self.inflight[key] = threading.Event()
+				claimed.append(key)
+		return claimed, waiting
+
+	def fetch(self, keys):
+		""" fetch
+		Looks up the locations in requests of batch_limit, releasing those claimed whatever happens.
+		Output: {location: distinct roads}
+		"""
+		answers = {}
+		try:
+			for start in range(0, len(keys), self.batch_limit):
+				request = keys[start:start + self.batch_limit]
+				for key, roads in zip(request, self.lookup(request)):
+					answers[key] = self.distinct(roads)
+					if self.cache is not None: self.cache.put(CACHE_NAMESPACE, key[0], key[1], answers[key])
+				with self.lock:
+					self.requests  += 1
+					self.requested += len(request)
+					for key in request: self.remember(key, answers[key])
+		finally:
+			with self.lock:
+				for key in keys:
+					event = self.inflight.pop(key, None)
+					if event is not None: event.set()
+		return answers
+
+	def distinct(self, roads):
+		seen, kept = set(), []
+		for lat, lon in roads:
+			if self.key(lat, lon) in seen: continue
+			seen.add(self.key(lat, lon))
+			kept.append((lat, lon))
+		return kept
+
+	def snap(self, points, lookahead = None):
+		""" snap
+		Output: The list of the distinct roads (lat, lon) snapped from each of the lat,lon points, in order.
+		"""
+		keys = [self.key(lat, lon) for lat, lon in points]
+		with self.lock:
+			claimed, waiting = self.claim(keys)
+		short = len(claimed) % self.batch_limit
+		if lookahead is not None and short:
+			# Top the last request up with the points due next, rather than sending it short...
+			upcoming = [self.key(lat, lon) for lat, lon in lookahead(self.lookahead)]
+			with self.lock:
+				extra, _ = self.claim([key for key in upcoming if key not in claimed], self.batch_limit - short)
+				self.prefetched += len(extra)
+			claimed += extra
+		answers = self.fetch(claimed)
+
+		for event in waiting: event.wait()
+		with self.lock:
+			missing = []
+			for key in set(keys) - set(answers):
+				if key in self.answers: answers[key] = self.answers[key]
+				else:                   missing.append(key) # The lookup of another thread failed...
+		answers.update(self.fetch(missing))
+		return [answers[key] for key in keys]
+
+	def snap_batch(self, points, lookahead = None):
+		""" snap_batch
+		Snaps a batch of grid points to their roads.
+		Output: A (road lat, road lon, grid lat, grid lon) tuple for every road snapped that was not passed on before in the run.
+		"""
+		snapped = self.snap(points, lookahead)
+		roads = []
+		with self.lock:
+			for (lat, lon), found in zip(points, snapped):
+				for road_lat, road_lon in found:
+					if self.key(road_lat, road_lon) in self.passed:
+						self.duplicates += 1
+						continue
+					self.passed.add(self.key(road_lat, road_lon))
+					roads.append((road_lat, road_lon, lat, lon))
+			self.roads += len(roads)
+		return roads
+
+	def mark_passed(self, roads):
+		""" mark_passed
+		Marks roads (lat, lon) as passed on already (eg: those snapped by the run resumed), so they are not walked from again.
+		"""
+		with self.lock:
+			self.passed.update(self.key(lat, lon) for lat, lon in roads)
+
+	def stats(self):
+		""" stats
+		Output: {requests, points, fill, prefetched, cached, roads, duplicates}; fill is the mean share of
+		        batch_limit the requests carried, duplicates the roads dropped as already passed on.
+		"""
+		with self.lock:
+			return {'requests': self.requests, 'points': self.requested, 'prefetched': self.prefetched,
+			        'fill': float(self.requested) / (self.requests * self.batch_limit) if self.requests else 0.0,
+			        'cached': self.cached, 'roads': self.roads, 'duplicates': self.duplicates}
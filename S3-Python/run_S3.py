@@ -12,28 +12,85 @@
 #  various images...               #
 ####################################
 import S3
+from pipeline import Pipeline, Stage
+from run_journal import RunJournal, BatchTracker
+from estimate import count_points, measured, estimate_calls, estimate_time, DEFAULT_LATENCIES, DEFAULT_FRACTIONS, WORKER_LINKS_LATENCY
+from shards import shard_region, save_plan, load_plan, plan_exists, shard_complete, merge_manifests
+from lookup_cache import LookupCache
+from panorama_workers import PanoramaWorkerPool
+from node_engine import NodeEngine
+from image_downloader import ImageDownloader
+from land_mask import TiledLandMask
+from metadata_gate import MetadataGate
+from coverage_index import CoverageIndex
+from metrics import Metrics, ProgressReporter
+from manifest import ManifestWriter, manifest_path, default_format, read_manifest, repair_manifest
+from quota_scheduler import QuotaScheduler, ApiBudget, parse_budgets, STREETVIEW
 import os, sys
-from datetime import datetime as dt
-from shapely.geometry import Point
+import math
+import json
+import time
+import pipes
+import functools
+import subprocess
+import numpy as np
+from datetime import datetime as dt, timedelta
 import argparse
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-a', '--api_key', help = 'Your Google API key.', required = True)
-parser.add_argument('-c', '--coords', help = 'The coordinates bounding the search region.', required = True)
-parser.add_argument('-d', '--epsilon', help = 'The distance between search points in meters; epsilon in the paper (eg: 1000 for 1km.', type = float, required = True)
+parser.add_argument('-c', '--coords', help = 'The coordinates bounding the search region.')
+parser.add_argument('-d', '--epsilon', help = 'The distance between search points in meters; epsilon in the paper (eg: 1000 for 1km.', type = float)
 parser.add_argument('-lat', '--restart_lat', help = 'The latitude from where to restart sampling.', type = float, default = 999.0)
 parser.add_argument('-lon', '--restart_lon', help = 'The longitude from where to restart sampling.', type = float, default = 999.0)
 parser.add_argument('-x', '--width', help = 'The image width for the Google Street View images. Max: 640.', required = False, default = 640)
 parser.add_argument('-y', '--height', help = 'The image height for the Google Street View images. Max: 640', required = False, default = 360)
-parser.add_argument('-w', '--walk_steps', help = 'The number of steps to take in the walk algorithm.', required = False, default = 1)
+parser.add_argument('-w', '--walk_steps', help = 'The number of steps to take in the walk algorithm.', required = False, default = 1, type = int)
 parser.add_argument('-log', '--log_file', help = 'The log file.', default = dt.now().strftime("%Y-%m-%d_%H-%M-%S") + '.log')
 parser.add_argument('-v', '--verbose', help = 'Increase output verbosity.', action = 'store_true')
 parser.add_argument('-e', '--exclusions', nargs='*', help = 'Path to files containing excluding regions.', default = [])
-parser.add_argument('-o', '--output_dir', help = 'The destination directory to save all the images.', required = True)
+parser.add_argument('-o', '--output_dir', help = 'The destination directory to save all the images.')
+parser.add_argument('-rd', '--run_dir', help = 'The directory of the run journal (defaults to the output directory).', default = None)
+parser.add_argument('-r', '--resume', help = 'Resume the run journaled in this run directory, with its original survey arguments.', default = None)
+parser.add_argument('-cache', '--cache_file', help = 'SQLite file caching the water, roads and panorama lookups across runs.', default = None)
+parser.add_argument('-cs', '--cache_size', help = 'The maximum number of cached lookups (least recently used are evicted).', type = int, default = 1000000)
+parser.add_argument('-pw', '--panorama_workers', help = 'The number of long-lived panorama_worker.js processes (0 spawns a node process per walk step).', type = int, default = 0)
+parser.add_argument('-ms', '--maps_script', help = 'URL of the Maps Javascript API for the panorama workers (e.g. a file:// stub for offline runs).', default = None)
+parser.add_argument('-ne', '--node_engine', help = 'Unix socket of an S3-Node rpc_s3.js engine serving the panorama links, metadata checks and image downloads (started if none listens there).', default = None)
+parser.add_argument('-gu', '--google_url', help = 'Base URL replacing that of the Google APIs (e.g. a fake_google.py server for offline runs).', default = None)
+parser.add_argument('-dw', '--download_workers', help = 'The number of concurrent image downloads (0 downloads one image at a time).', type = int, default = 8)
+parser.add_argument('-dr', '--download_rate', help = 'The maximum number of image requests per second (unlimited by default; same as --api_rates streetview=N).', type = float, default = None)
+parser.add_argument('-ar', '--api_rates', help = 'Maximum requests per second of each API (eg: static_maps=50,roads=50,streetview=20,metadata=50).', default = None)
+parser.add_argument('-al', '--api_daily_limits', help = 'Daily request budget of each API (eg: roads=2500), shared by every run using the --quota_file.', default = None)
+parser.add_argument('-qf', '--quota_file', help = 'File of the daily API usage of each API key, shared under a file lock by the runs and shards using it (defaults to quota.json next to the --cache_file, or in the run directory).', default = None)
+parser.add_argument('-qx', '--quota_exit', help = 'Stop (resumable) when a daily budget is used up, rather than waiting for the quota reset.', action = 'store_true')
+parser.add_argument('-p', '--pipeline', help = 'Run the search as concurrent stages with the given validity,snap,walk,download worker counts (eg: 8,2,8,2).', default = None)
+parser.add_argument('-q', '--queue_size', help = 'The maximum number of items waiting between two pipeline stages.', type = int, default = 16)
+parser.add_argument('-lm', '--land_mask_zoom', help = 'Classify land/water from one Static Maps tile per block of grid points at this zoom (eg: 17) instead of one request per point.', type = int, default = None)
+parser.add_argument('-md', '--land_mask_dir', help = 'Directory keeping the land mask tiles for reuse by later runs.', default = None)
+parser.add_argument('-cr', '--coverage_radius', help = 'Skip the roads snapped within this many meters of panoramas already collected (0 walks from every road).', type = float, default = 0)
+parser.add_argument('-cf', '--coverage_file', help = 'File of the panorama locations collected, shared by the runs using it (defaults to the run directory).', default = None)
+parser.add_argument('-sp', '--snap_precision', help = 'Decimals to which points are rounded before snapping, and roads compared to walk from each once.', type = int, default = 5)
+parser.add_argument('-mc', '--metadata_workers', help = 'The number of concurrent Street View metadata checks skipping jobs without imagery or already taken before download (0 downloads every job).', type = int, default = 8)
+parser.add_argument('-mf', '--manifest_format', help = 'Format of the manifest of the saved images in the output directory (parquet needs pyarrow).', choices = ('parquet', 'csv'), default = default_format())
+parser.add_argument('-pi', '--progress_interval', help = 'Print a progress line with the calls of every stage this often, in seconds (0 for none).', type = float, default = 0)
+parser.add_argument('-rf', '--report_file', help = 'JSON report of the run: calls, latencies, bytes and errors per stage and API (defaults to report.json in the run directory).', default = None)
+parser.add_argument('-es', '--estimate', help = 'Only estimate the grid points, API calls and run time of the survey, without any network call.', action = 'store_true')
+parser.add_argument('-eb', '--estimate_baseline', help = 'report.json of an earlier run whose measured latencies and water/walk fractions the estimate uses.', default = None)
+parser.add_argument('-sh', '--shards', help = 'Split the survey into this many shards of balanced valid area, each searched by its own run_S3.py process, and merge their images into one manifest.', type = int, default = None)
+parser.add_argument('-sc', '--shard_commands', help = 'Print the command of each shard (eg: to run them on other machines sharing the output directory) instead of running them here.', action = 'store_true')
+parser.add_argument('-st', '--shard_tile', help = 'Only search the S,W,N,E tile of the region (set by --shards for its workers).', default = None)
 args = parser.parse_args()
 
+# The arguments defining a survey, saved in its journal for --resume...
+JOURNALED_ARGS = ('coords', 'epsilon', 'restart_lat', 'restart_lon', 'width', 'height', 'walk_steps', 'exclusions', 'output_dir', 'shard_tile',
+                  'manifest_format')
+
+# The arguments a sharded survey sets itself for each of its workers, rather than passing them on...
+SHARD_ARGS = ('shards', 'shard_commands', 'shard_tile', 'resume', 'output_dir', 'run_dir', 'log_file', 'report_file')
+
 # ---------------------------------
-def search_area(regional_polygon, city_exclusions, skip_distance):
+def search_area(region_filter, skip_distance, journal):
 	"""
 	Iterates over a regional polygon bounding box area by applying a consistently spaced grid of points.
 	Iterates from W-->E and N-->S starting at the NW coordinate and ending at the SE corner.
@@ -41,16 +98,16 @@ def search_area(regional_polygon, city_exclusions, skip_distance):
 	The skip_distance defines the spatial separation (in meters) between the grid points.
 	Calls the validation methods passing on each lat, lon pair.
 	Verifies that points do not co-occur in any of the city-exclusions.
-	:param: regional_polygons has the bounds as an ordered tuple with entries [S, W, N, E] of a regional bounding box.
-	:param: city_exclusions is a list of Polygons to check against for inclusion points.
+	Progress is recorded in the journal: grid chunks and batches it already holds are not processed again.
+	:param: region_filter is the RegionFilter of the regional polygon, whose bounds are an ordered tuple [S, W, N, E],
+	        and the list of city exclusion Polygons to check against for inclusion points.
 	:param: skip_distance is the spatial 'jump' distance between points in meters.
-	Ex: search_area([47.0, -72.0, 42.0, -75.0], 1000)
+	:param: journal is the RunJournal of this run.
+	Ex: search_area(S3.RegionFilter(Polygon(...), []), 1000, RunJournal())
 	"""
-	bounding_box = regional_polygon.bounds
+	bounding_box = region_filter.region.bounds
 	cur_lat = bounding_box[2] # N   Start -->|.......|
 	cur_lon = bounding_box[1] # W		 |.......|
-	end_lat = bounding_box[0] # S		 |.......|	
-	end_lon = bounding_box[3] # E		 |.......| <-- End
 	
 	# Pick up from the restart coords is necessary...
 	if args.restart_lat < 999.0: cur_lat = args.restart_lat
@@ -58,43 +115,371 @@ def search_area(regional_polygon, city_exclusions, skip_distance):
 
 	if args.verbose: print 'Resetting coordinates to (lat,lon): (' + str(cur_lat) + ',' + str(cur_lon) + ')'
 	
-	batch_list = [] # For snapping to roads with the optimized API calls...	
-	while cur_lat > end_lat:# Reset to Western Edge and teleport down
-		cur_lat, cur_lon = S3.teleport(cur_lat, bounding_box[1], S3.SOUTH, skip_distance)
-		
-		if args.verbose: '--- Shift Latitude Down ---\nCurrent Coords: (lat,lon) = (' + str(cur_lat) + ',' + str(cur_lon) + ')'
-		while cur_lon < end_lon:
-			
-			# Teleport to the next point
-			cur_lat, cur_lon = S3.teleport(cur_lat, cur_lon, S3.EAST, skip_distance)			
-			if args.verbose: print '(' + str(cur_lat) + ', ' + str(cur_lon) + ')'
-			
-			# Check if Point in the polygon and outside of cities. Also check if coords are over water or not.
-			regional_valid = S3.regional_validity(Point(cur_lat, cur_lon), regional_polygon, city_exclusions)
-			land_valid = S3.land_validity(cur_lat, cur_lon)
-
-			# TODO :: Save these validity data for regional summary statistics.
-			print 'Region Valid: ' + str(regional_valid)
-			print 'Land Valid: ' + str(land_valid)
-
-			# Add to the batch for downstream processing!
-			if regional_valid and land_valid:
-				batch_list.append((cur_lat, cur_lon))
-
-			# Keep filling the batch process until 100 coordinates...
-			if len(batch_list) != S3.BATCH_LIMIT: 
-				print 'Batch Size: ' + str(len(batch_list))
-				continue
-			
-			# For the 100 coords, get the nearest roads, perform walk algo, & save images...
-			S3.process_batch_coordinates(S3.google_snap_to_nearest_road_batch(batch_list))
-			batch_list = [] # Reset for the next round...
+	# First finish the batches an interrupted run left behind...
+	attempted = set()
+	process_pending_batches(journal, attempted)
+
+	for row, col, lats, lons in S3.grid_chunks(bounding_box, skip_distance, start_lat = cur_lat, **grid_sweep(journal, region_filter)):
+		if journal.chunk_done(row, col): continue
+
+		# Check the whole chunk against the polygon and the cities at once...
+		# Only spend Static Maps calls checking for water on the points in the region.
+		regional_mask = region_filter.mask(lats, lons)
+		land_mask = S3.land_validity_mask(lats, lons, regional_mask)
+		if args.verbose:
+			for cur_lat, cur_lon, regional_valid, land_valid in zip(lats.tolist(), lons.tolist(), regional_mask.tolist(), land_mask.tolist()):
+				print '(' + str(cur_lat) + ', ' + str(cur_lon) + ') Region Valid: ' + str(regional_valid) + ', Land Valid: ' + str(land_valid)
+
+		# Keep filling the batch process with the valid points (land_mask is only True in the region) until 100 coordinates...
+		S3.METRICS.count('valid_points', int(land_mask.sum()))
+		journal.record_chunk(row, col, np.column_stack((lats[land_mask], lons[land_mask])))
+		if journal.seal_batches(S3.BATCH_LIMIT) == 0: continue
+
+		# For the 100 coords, get the nearest roads, perform walk algo, & save images...
+		process_pending_batches(journal, attempted)
 
 	# End of the loops. If any remaining coords in the batch, process them:
-	if len(batch_list) != 0: S3.process_batch_coordinates(S3.google_snap_to_nearest_road_batch(batch_list))
-	
+	journal.seal_batches(S3.BATCH_LIMIT, final = True)
+	process_pending_batches(journal, attempted)
+
+	# Give the batches with failed downloads one more try...
+	process_pending_batches(journal, set())
+
+def process_pending_batches(journal, attempted):
+	"""
+	Snaps, walks and downloads the images of every pending batch of the journal, recording each step.
+	Steps already recorded for a batch (snapped roads, walks, saved images) are not repeated.
+	A batch with failed downloads stays pending, to be retried by a resumed run.
+	:param: attempted is the set of batch ids already tried during this run, which are skipped; updated in place.
+	"""
+	for batch_id, points, roads in journal.pending_batches():
+		if batch_id in attempted: continue
+		attempted.add(batch_id)
+		points = points.tolist()
+		print 'Batch Size: ' + str(len(points))
+		if roads is None:
+			roads = S3.snap_roads(points, lambda n: journal.upcoming_points(batch_id, n).tolist())
+			journal.record_snap(batch_id, roads)
+
+		walked = journal.walks(batch_id)
+		walk_batch(journal, batch_id, [(i, road, grid) for i, road, grid in batch_roads(roads) if i not in walked], walked)
+		jobs = [job for i, road, grid in batch_roads(roads) for job in walked[i]]
+
+		failed = False
+		for filename, size, error in S3.download_images([job for job in jobs if not journal.download_done(job[3])], journal.record_download):
+			if error is not None: failed = True
+		if not failed: journal.record_batch_done(batch_id)
+
+def walk_batch(journal, batch_id, roads, walked):
+	"""
+	Walks from the (index, road, grid) roads of a batch with a single S3.batch_walks call, so the first step of all the
+	walks is looked up at once, and journals the jobs of each walk.
+	:param: walked is the {road index: download jobs} of the batch, updated in place.
+	"""
+	if not roads: return
+	for (i, road, grid), jobs in zip(roads, S3.batch_walks([road for i, road, grid in roads], [grid for i, road, grid in roads])):
+		walked[i] = jobs
+		journal.record_walk(batch_id, i, jobs)
+
+def batch_roads(roads):
+	"""
+	The roads journaled for a batch, as (index, road lat,lon, grid lat,lon) of the roads to walk from.
+	"""
+	return [(i, tuple(road[:2]), tuple(road[2:])) for i, road in enumerate(roads)]
+
+def search_area_pipelined(region_filter, skip_distance, workers, journal):
+	"""
+	Streaming variant of search_area: the same grid is swept, but the validity checks, road snapping,
+	walks and image downloads run as concurrent Pipeline stages joined by bounded queues.
+	Progress is recorded in the journal exactly as search_area does.
+	:param: region_filter is the RegionFilter of the regional polygon and the city exclusions.
+	:param: skip_distance is the spatial 'jump' distance between points in meters.
+	:param: workers is the number of worker threads of the (validity, snap, walk, download) stages.
+	:param: journal is the RunJournal of this run.
+	"""
+	validity_workers, snap_workers, walk_workers, download_workers = workers
+	last_sent = [0] # Id of the last batch passed on...
+
+	def validity(chunk):
+		# Region mask for the whole chunk, then a Static Maps call for the points in the region only.
+		row, col, lats, lons = chunk
+		valid = S3.land_validity_mask(lats, lons, region_filter.mask(lats, lons))
+		S3.METRICS.count('valid_points', int(valid.sum()))
+		journal.record_chunk(row, col, np.column_stack((lats[valid], lons[valid])))
+		return [chunk]
+
+	def pending_batches():
+		# Pass on each pending batch once (this includes those left behind by an interrupted run).
+		batches = list(journal.pending_batches(after = last_sent[0]))
+		if batches: last_sent[0] = batches[-1][0]
+		return batches
+
+	def batch(chunk):
+		# Regroup the valid points into full Roads API batches...
+		journal.seal_batches(S3.BATCH_LIMIT)
+		return pending_batches()
+
+	def flush():
+		journal.seal_batches(S3.BATCH_LIMIT, final = True)
+		return pending_batches()
+
+	def snap(batch):
+		batch_id, points, roads = batch
+		points = points.tolist()
+		if roads is None:
+			roads = S3.snap_roads(points, lambda n: journal.upcoming_points(batch_id, n).tolist())
+			journal.record_snap(batch_id, roads)
+		return [(batch_id, batch_roads(roads))]
+
+	def walk(batch):
+		# Every road of the batch not walked yet is walked at once, then downloaded on its own...
+		batch_id, roads = batch
+		walked = journal.walks(batch_id)
+		walk_batch(journal, batch_id, [(i, road, grid) for i, road, grid in roads if i not in walked], walked)
+		tracker = BatchTracker(journal, batch_id, len(roads))
+		return [(walked[i], tracker) for i, road, grid in roads]
+
+	def download(item):
+		jobs, tracker = item
+		failed = False
+		for filename, size, error in S3.download_images([job for job in jobs if not journal.download_done(job[3])], journal.record_download):
+			if error is not None: failed = True
+		tracker.finish(not failed)
+
+	start_lat = args.restart_lat if args.restart_lat < 999.0 else None
+	grid = (chunk for chunk in S3.grid_chunks(region_filter.region.bounds, skip_distance, start_lat = start_lat, **grid_sweep(journal, region_filter)) \
+	        if not journal.chunk_done(chunk[0], chunk[1]))
+	counts = Pipeline(grid, [Stage('validity', validity, validity_workers), Stage('batch', batch, 1, flush),
+	                         Stage('snap', snap, snap_workers), Stage('walk', walk, walk_workers),
+	                         Stage('download', download, download_workers)], args.queue_size).run()
+	if args.verbose: print 'Pipeline Items: ' + str(counts)
+
+	# Give the batches with failed downloads one more try...
+	process_pending_batches(journal, set())
+
+def open_journal():
+	"""
+	Opens the RunJournal of the run directory (the output directory unless --run_dir is given).
+	With --resume, the survey arguments saved by the original run replace those given on the command line.
+	"""
+	if args.resume:
+		if not RunJournal.exists(args.resume): parser.error('No run journal found in ' + args.resume)
+		journal = RunJournal(args.resume)
+		for key, value in journal.load_config().items():
+			if key in JOURNALED_ARGS: setattr(args, key, value)
+		print 'Resuming the run journaled in ' + args.resume
+		return journal
+
+	missing = [name for name in ('coords', 'epsilon', 'output_dir') if getattr(args, name) is None]
+	if missing: parser.error('the following arguments are required: ' + ', '.join('--' + name for name in missing))
+
+	run_dir = args.run_dir or args.output_dir
+	if not os.path.isdir(run_dir): os.makedirs(run_dir)
+	if RunJournal.exists(run_dir): parser.error(run_dir + ' already holds a run journal: continue it with --resume ' + run_dir + ' or pick another --run_dir')
+	journal = RunJournal(run_dir)
+	journal.save_config(dict([(name, getattr(args, name)) for name in JOURNALED_ARGS] + [('grid_chunk', S3.GRID_CHUNK)]))
+	return journal
+
+def grid_sweep(journal, region_filter):
+	"""
+	The chunk_size and window of the grid_chunks of the run (only the tile of a shard is swept): the chunks the journal
+	marks processed must be swept the same way on --resume.
+	"""
+	return {'chunk_size': journal.load_config()['grid_chunk'], 'window': region_filter.grid_window()}
+
+def restore_manifest(journal):
+	"""
+	Appends to the MANIFEST the images the journal records as downloaded but the manifest does not list: those
+	of rows still buffered (or in a Parquet part left unclosed) when the resumed run stopped.
+	"""
+	set_aside = repair_manifest(S3.MANIFEST.path)
+	listed    = set(read_manifest(S3.MANIFEST.path)['filename'].tolist())
+	restored  = 0
+	for job, size in journal.downloaded_jobs():
+		if job[3] in listed: continue
+		S3.MANIFEST.append(S3.manifest_row(job, size))
+		restored += 1
+	if restored or set_aside: print 'Manifest: ' + str(restored) + ' rows restored from the journal (' + str(set_aside) + ' unreadable parts set aside)'
+
+def restore_dedupe(journal):
+	"""
+	Carries the run-wide dedupe state on from the run resumed: the panoramas its walks visited (VISITED), the roads it
+	snapped (SNAPPER) and the images it took (METADATA_GATE), so the resumed run does not walk or download them again.
+	"""
+	S3.VISITED.restore(journal.walked_jobs())
+	S3.SNAPPER.mark_passed(journal.snapped_roads())
+	if S3.METADATA_GATE is not None: S3.METADATA_GATE.mark_taken(job for job, size in journal.downloaded_jobs())
+
+def quota_file(run_dir):
+	"""
+	The file of the daily API usage: --quota_file, else quota.json next to the --cache_file, else in run_dir.
+	"""
+	if args.quota_file: return args.quota_file
+	return os.path.join(os.path.dirname(os.path.abspath(args.cache_file)) if args.cache_file else run_dir, 'quota.json')
+
+def shard_command(shard, num_shards):
+	"""
+	The run_S3.py command searching one shard: every argument given to this run is passed on, except the shard
+	arguments; request rates are divided between the shards, which all run at once and share the daily budgets
+	through the quota file of the survey.
+	A shard with a journal is resumed, otherwise it starts with the shard's tile and output subdirectory.
+	"""
+	if RunJournal.exists(shard['output_dir']): command = [sys.executable, os.path.abspath(__file__), '--resume', shard['output_dir']]
+	else: command = [sys.executable, os.path.abspath(__file__), '--output_dir', shard['output_dir'], \
+	                 '--shard_tile', ','.join(repr(bound) for bound in shard['bounds'])]
+
+	for action in parser._actions:
+		value = getattr(args, action.dest, None)
+		if not action.option_strings or action.dest in SHARD_ARGS or value is None or value == action.default: continue
+		if action.dest == 'download_rate': value = value / num_shards
+		if action.dest == 'api_rates':
+			value = ','.join(api + '=' + repr(float(rate) / num_shards) for api, rate in (item.split('=') for item in value.split(',')))
+
+		if action.nargs == 0:              command += [action.option_strings[-1]] # A flag...
+		elif isinstance(value, list):      command += [action.option_strings[-1]] + [str(v) for v in value]
+		else:                              command += [action.option_strings[-1], str(value)]
+	return command
+
+def run_sharded():
+	"""
+	Runs the survey as --shards independent searches: the region minus its exclusions is split into tiles of
+	balanced valid area, each searched by its own run_S3.py process with its own output subdirectory and journal.
+	Once they are done, the images saved by all the shards are merged into a single manifest.
+	With --resume, the shards that did not complete are continued (or started) and the manifest merged again.
+	"""
+	if args.resume:
+		output_dir = args.resume
+		plan = load_plan(output_dir)
+		for key, value in plan['config'].items(): setattr(args, key, value)
+		print 'Resuming the sharded survey in ' + output_dir
+	else:
+		missing = [name for name in ('coords', 'epsilon', 'output_dir') if getattr(args, name) is None]
+		if missing: parser.error('the following arguments are required: ' + ', '.join('--' + name for name in missing))
+		output_dir = args.output_dir
+		if not os.path.isdir(output_dir): os.makedirs(output_dir)
+		if plan_exists(output_dir): parser.error(output_dir + ' already holds a sharded survey: continue it with --resume ' + output_dir)
+		search_region, exclude, region_filter = S3.get_regional_polygon(args.coords, args.exclusions)
+		plan = save_plan(output_dir, shard_region(search_region, exclude, args.shards), \
+		                 dict((name, getattr(args, name)) for name in JOURNALED_ARGS if name not in SHARD_ARGS))
+		for shard in plan['shards']:
+			print 'Shard ' + str(shard['index']) + ': ' + str(shard['bounds']) + ' (weight ' + str(shard['weight']) + ')'
+
+	# The shards count their requests against the same daily budgets...
+	args.quota_file = quota_file(output_dir)
+	shards = [shard for shard in plan['shards'] if not shard_complete(shard)]
+	commands = [shard_command(shard, len(plan['shards'])) for shard in shards]
+	if args.shard_commands:
+		for command in commands: print ' '.join(pipes.quote(part) for part in command)
+		print 'Once they are done, merge the shards with: --resume ' + output_dir
+		return
+
+	# The shards share the engine, which lives as long as the survey...
+	engine = launch_engine() if args.node_engine else None
+	processes = []
+	for shard, command in zip(shards, commands):
+		if not os.path.isdir(shard['output_dir']): os.makedirs(shard['output_dir'])
+		with open(os.path.join(shard['output_dir'], 'shard.log'), 'a') as log:
+			processes.append(subprocess.Popen(command, stdout = log, stderr = subprocess.STDOUT))
+	for process in processes: process.wait()
+	if engine is not None: engine.close()
+
+	path, images = merge_manifests(output_dir, plan['shards'], args.manifest_format)
+	print 'Manifest: ' + str(images) + ' images from ' + str(len(plan['shards'])) + ' shards in ' + path
+	incomplete = [str(shard['index']) for shard in plan['shards'] if not shard_complete(shard)]
+	if incomplete: print 'Shards ' + ', '.join(incomplete) + ' did not complete: continue them with --resume ' + output_dir
+
+def launch_engine():
+	"""
+	Connects to the S3-Node engine on the --node_engine socket, starting it if none listens there.
+	Its metadata checks and image downloads are paced by the SCHEDULER (within the --api_rates and --api_daily_limits).
+	"""
+	return NodeEngine.launch(os.path.abspath(args.node_engine), args.api_key, args.google_url, args.maps_script, metrics = S3.METRICS, \
+	                            scheduler = S3.SCHEDULER)
+
+def write_report(path, earlier_runs = ()):
+	"""
+	Writes the JSON report of the run: the METRICS of every stage, with the API usage, cache hits,
+	metadata checks, road snapping and coverage of the run, and the arguments it was run with.
+	The report of a resumed run covers the whole survey: its METRICS carry on from the report of the run
+	resumed (see resume_report), and 'runs' lists the sections and elapsed time of each run in turn.
+	"""
+	extra = {'arguments': dict((name, value) for name, value in vars(args).items() if name != 'api_key'),
+	         'api'      : S3.SCHEDULER.stats()}
+	if S3.CACHE is not None:         extra['cache'] = dict((namespace, {'hits': hits, 'misses': misses}) for namespace, (hits, misses) in S3.CACHE.stats().items())
+	if S3.METADATA_GATE is not None: extra['metadata_gate'] = S3.METADATA_GATE.stats()
+	if S3.SNAPPER is not None:       extra['snapping'] = S3.SNAPPER.stats()
+	if S3.COVERAGE is not None:      extra['coverage'] = {'indexed': len(S3.COVERAGE), 'skipped': S3.COVERAGE.skipped}
+	extra['runs'] = list(earlier_runs) + [dict(extra, elapsed_seconds = S3.METRICS.clock() - S3.METRICS.started)]
+	S3.METRICS.write_report(path, extra)
+	print 'Run report: ' + path
+
+def resume_report(path):
+	"""
+	Carries the METRICS on from the report of the run resumed, if it wrote one.
+	Output: The 'runs' of that report, for write_report.
+	"""
+	if not os.path.exists(path): return []
+	with open(path) as f: report = json.load(f)
+	S3.METRICS.resume(report)
+	return report['runs']
+
+def api_budgets():
+	"""
+	The ApiBudgets of the --api_rates and --api_daily_limits, exiting with a usage error for an unknown API.
+	"""
+	try:
+		return parse_budgets(args.api_rates, args.api_daily_limits)
+	except ValueError as err:
+		parser.error('--api_rates / --api_daily_limits: ' + str(err))
+
+def run_estimate(budgets):
+	"""
+	Dry run of the survey: counts the grid points the region filter keeps exactly (no network call), then projects
+	the calls of every API and the time they take, from the latencies and fractions of --estimate_baseline if given.
+	The projection is an upper bound without a baseline: every point on land, snapped and walked to full length.
+	"""
+	missing = [name for name in ('coords', 'epsilon') if getattr(args, name) is None]
+	if missing: parser.error('the following arguments are required: ' + ', '.join('--' + name for name in missing))
+	region_filter = S3.get_regional_polygon(args.coords, args.exclusions)[2]
+	if args.shard_tile: region_filter.tile = tuple(float(bound) for bound in args.shard_tile.split(','))
+
+	latencies, fractions = dict(DEFAULT_LATENCIES), dict(DEFAULT_FRACTIONS)
+	if args.panorama_workers > 0: latencies['panorama_links'] = WORKER_LINKS_LATENCY
+	if args.estimate_baseline:
+		measured_latencies, measured_fractions = measured(args.estimate_baseline)
+		latencies.update(measured_latencies)
+		fractions.update(measured_fractions)
+
+	start = time.time()
+	start_lat = args.restart_lat if args.restart_lat < 999.0 else None
+	total, points, tiles = count_points(region_filter, args.epsilon, S3.grid_chunks, start_lat, args.land_mask_zoom)
+	calls = estimate_calls(points, tiles, args.walk_steps, S3.BATCH_LIMIT, fractions, args.metadata_workers > 0)
+
+	concurrency = {'streetview': max(1, args.download_workers), 'metadata': max(1, args.metadata_workers)}
+	if args.pipeline:
+		validity_workers, snap_workers, walk_workers, download_workers = [int(n) for n in args.pipeline.split(',')]
+		concurrency.update({'static_maps': validity_workers, 'roads': snap_workers, 'panorama_links': walk_workers})
+	rates = dict((api, budget.rate) for api, budget in budgets.items() if budget.rate)
+	if args.download_rate and STREETVIEW not in rates: rates[STREETVIEW] = args.download_rate
+	seconds = estimate_time(calls, latencies, concurrency, rates)
+	# The stages overlap in a pipelined run, which then takes about as long as its slowest stage...
+	total_seconds = max(seconds.values()) if args.pipeline else sum(seconds.values())
+
+	print 'Grid Points  : ' + str(total) + ' in the bounding box, ' + str(points) + ' in the region (counted in ' + '%.2f' % (time.time() - start) + ' s)'
+	print 'Valid Points : ~' + str(int(calls['valid_points'])) + ' (land fraction ' + '%.3f' % fractions['land'] + '), ~' + str(int(calls['walks'])) + ' walks'
+	limits = dict((api, budget.daily_limit) for api, budget in budgets.items() if budget.daily_limit)
+	for api in ('static_maps', 'roads', 'panorama_links', 'metadata', 'streetview'):
+		days = ', ' + str(int(math.ceil(float(calls[api]) / limits[api]))) + ' days of budget' if api in limits else ''
+		print 'API ' + api + ': ~' + str(int(math.ceil(calls[api]))) + ' calls, ~' + str(timedelta(seconds = int(seconds[api]))) + ' (' + \
+		      '%.3f' % latencies[api] + ' s/call' + days + ')'
+	print 'Projected Time: ~' + str(timedelta(seconds = int(total_seconds))) + (' (pipelined)' if args.pipeline else '')
 
 def main():
+	budgets = api_budgets() # Checked before a shard or engine is started...
+	if args.estimate: return run_estimate(budgets)
+	if args.shards or (args.resume and plan_exists(args.resume)): return run_sharded()
+	journal = open_journal()
+
 	# Set the API key for usage in the S# module...
 	S3.API_KEY = args.api_key
 	S3.IMG_DIR = args.output_dir
@@ -102,13 +487,96 @@ def main():
 	S3.IMAGE_WIDTH  = args.width
 	S3.IMAGE_HEIGHT = args.height
 	S3.NUM_STEPS = args.walk_steps
+	S3.VISITED   = S3.VisitedPanoramas()
+	S3.METRICS   = Metrics()
+	report_file  = args.report_file or os.path.join(os.path.dirname(journal.path), 'report.json')
+	earlier_runs = resume_report(report_file) if args.resume else []
+	if args.google_url: S3.set_google_url(args.google_url)
+	if args.cache_file: S3.CACHE = LookupCache(args.cache_file, max_entries = args.cache_size)
+	if args.download_rate and STREETVIEW not in budgets: budgets[STREETVIEW] = ApiBudget(args.download_rate)
+	S3.SCHEDULER = QuotaScheduler(budgets, quota_file(os.path.dirname(journal.path)), wait_for_reset = not args.quota_exit, api_key = args.api_key)
+	engine = launch_engine() if args.node_engine else None
+	if engine is not None:
+		S3.PANORAMA_WORKERS = engine
+	elif args.panorama_workers > 0:
+		S3.PANORAMA_WORKERS = PanoramaWorkerPool(args.api_key, args.panorama_workers, args.maps_script)
+	if engine is not None:
+		S3.DOWNLOADER = engine
+	elif args.download_workers > 0:
+		S3.DOWNLOADER = ImageDownloader(args.download_workers, scheduler = S3.SCHEDULER, metrics = S3.METRICS)
+	if args.coverage_radius > 0:
+		S3.COVERAGE = CoverageIndex(args.coverage_radius, args.coverage_file or os.path.join(os.path.dirname(journal.path), 'coverage.bin'))
+	S3.SNAPPER = S3.RoadSnapper(S3.google_nearest_roads, S3.BATCH_LIMIT, args.snap_precision, S3.CACHE)
+	if args.metadata_workers > 0:
+		lookup = S3.streetview_metadata if engine is None else functools.partial(S3.streetview_metadata, lookup = engine.metadata)
+		S3.METADATA_GATE = MetadataGate(lookup, args.metadata_workers)
+	S3.MANIFEST = ManifestWriter(manifest_path(args.output_dir, args.manifest_format), args.manifest_format)
+	if args.resume:
+		restore_manifest(journal)
+		restore_dedupe(journal)
+	if args.land_mask_zoom is not None:
+		S3.LAND_MASK = TiledLandMask(S3.google_static_map_tile, S3.GOOGLE_BLUE, args.land_mask_zoom, args.land_mask_dir)
 
 	# Get Regional Bounds, and pass the exclusion cities to get their polygons 
-	search_region, exclude = S3.get_regional_polygon(args.coords, args.exclusions)
+	search_region, exclude, region_filter = S3.get_regional_polygon(args.coords, args.exclusions)
+	if args.shard_tile: region_filter.tile = tuple(float(bound) for bound in args.shard_tile.split(','))
 
 	print search_region
+	progress = ProgressReporter(S3.METRICS, args.progress_interval) if args.progress_interval > 0 else None
 	# Begin the sampling procedure!
-	search_area(search_region, exclude, args.epsilon)
+	try:
+		if args.pipeline:
+			workers = [int(n) for n in args.pipeline.split(',')]
+			if len(workers) != 4: parser.error('--pipeline takes 4 worker counts: validity,snap,walk,download')
+			search_area_pipelined(region_filter, args.epsilon, workers, journal)
+		else:
+			search_area(region_filter, args.epsilon, journal)
+		journal.mark_complete()
+	except S3.APILimitError as err:
+		# Everything done so far is in the journal...
+		print str(err) + '\nContinue the search with: --resume ' + os.path.dirname(journal.path)
+		try:
+			S3.email_notification()
+		except Exception:
+			pass # The notification is best effort...
+		sys.exit(0)
+	finally:
+		if progress is not None: progress.stop()
+		journal.close()
+		S3.SCHEDULER.close()
+		S3.MANIFEST.close()
+		if S3.COVERAGE is not None: S3.COVERAGE.close()
+		write_report(report_file, earlier_runs)
+		# Also on a quota exit: the cache saves its pending access times, the node processes are stopped...
+		if S3.CACHE is not None: S3.CACHE.close()
+		if S3.PANORAMA_WORKERS is not None: S3.PANORAMA_WORKERS.close()
+		if S3.DOWNLOADER is not None: S3.DOWNLOADER.close()
+
+	# Report how many lookups were answered from the cache instead of the APIs...
+	if S3.CACHE is not None:
+		for namespace, (hits, misses) in sorted(S3.CACHE.stats().items()):
+			print 'Cache ' + namespace + ': ' + str(hits) + ' hits (calls saved), ' + str(misses) + ' misses'
+
+	stats = S3.SNAPPER.stats()
+	print 'Roads: ' + str(stats['requests']) + ' requests (%.0f%% full), ' % (100 * stats['fill']) + str(stats['prefetched']) + ' points snapped ahead, ' + \
+	      str(stats['cached']) + ' from the cache, ' + str(stats['roads']) + ' roads walked, ' + str(stats['duplicates']) + ' repeated roads skipped'
+
+	if S3.COVERAGE is not None:
+		print 'Coverage: ' + str(len(S3.COVERAGE)) + ' panorama locations indexed, ' + str(S3.COVERAGE.skipped) + ' roads skipped as already covered'
+
+	# Report the downloads the metadata checks made unnecessary...
+	if S3.METADATA_GATE is not None:
+		stats = S3.METADATA_GATE.stats()
+		print 'Metadata: ' + str(stats['checked']) + ' jobs checked, ' + str(stats['avoided']) + ' downloads avoided (' + \
+		      str(stats['no_imagery']) + ' without imagery, ' + str(stats['duplicates']) + ' panoramas already taken), ' + \
+		      str(stats['unchecked']) + ' unchecked'
+		S3.METADATA_GATE.close()
+
+	# Report the API usage against the budgets...
+	for api, stats in sorted(S3.SCHEDULER.stats().items()):
+		remaining = 'unlimited' if stats['remaining_today'] is None else str(stats['remaining_today'])
+		print 'API ' + api + ': ' + str(stats['requests']) + ' requests (%.2f/s), ' % stats['requests_per_second'] + \
+		      str(stats['retries']) + ' retries, ' + str(stats['throttled']) + ' throttled, ' + remaining + ' left today'
 
 if __name__ == "__main__":
 	main()
@@ -0,0 +1,225 @@
+####################################
+#          run_journal.py          #
+#                                  #
+#  Durable record of a search run: #
+#  processed grid chunks, pending  #
+#  Roads batches, walks and saved  #
+#  images, so a stopped run can be #
+#  resumed without repeating work. #
+####################################
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+
+JOURNAL_FILE = 'journal.db'
+
+
+class RunJournal(object):
+	""" RunJournal
+	SQLite journal kept in the run directory (in memory when run_dir is None).
+	Every record is committed as it is made, so the journal survives a crash or a quota exit.
+	The life of the grid points of a run:
+	  record_chunk  --> valid points of a grid chunk wait in the open batch
+	  seal_batches  --> every BATCH_LIMIT open points become a pending batch
+	  record_snap   --> the roads snapped from the batch, each with the grid point it was snapped from
+	  record_walk   --> the download jobs of the walk from each of those roads
+	  record_download / record_batch_done --> images saved, batch complete
+	Safe to share between threads.
+	"""
+	def __init__(self, run_dir = None):
+		self.path = os.path.join(run_dir, JOURNAL_FILE) if run_dir else ':memory:'
+		self.lock = threading.Lock()
+		self.db   = sqlite3.connect(self.path, check_same_thread = False)
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS config    (key TEXT PRIMARY KEY, value TEXT);
+			CREATE TABLE IF NOT EXISTS chunks    (row INTEGER, col INTEGER, PRIMARY KEY (row, col));
+			CREATE TABLE IF NOT EXISTS points    (seq INTEGER PRIMARY KEY AUTOINCREMENT, lat REAL, lon REAL);
+			CREATE TABLE IF NOT EXISTS batches   (id INTEGER PRIMARY KEY AUTOINCREMENT, points BLOB, roads TEXT, done INTEGER DEFAULT 0);
+			CREATE TABLE IF NOT EXISTS walks     (batch INTEGER, road INTEGER, jobs TEXT, PRIMARY KEY (batch, road));
+			CREATE TABLE IF NOT EXISTS downloads (filename TEXT PRIMARY KEY, bytes INTEGER);
+		''')
+		self.db.commit()
+
+	@staticmethod
+	def exists(run_dir):
+		return os.path.exists(os.path.join(run_dir, JOURNAL_FILE))
+
+	def write(self, statements):
+		""" write
+		Runs a list of (sql, parameters) statements as a single transaction.
+		"""
+		with self.lock:
+			with self.db:
+				for sql, parameters in statements: self.db.execute(sql, parameters)
+
+	def read(self, sql, parameters = ()):
+		with self.lock:
+			return self.db.execute(sql, parameters).fetchall()
+
+	def save_config(self, config):
+		self.write([('INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)', (key, json.dumps(value))) for key, value in config.items()])
+
+	def load_config(self):
+		return dict((key, json.loads(value)) for key, value in self.read('SELECT key, value FROM config'))
+
+	def chunk_done(self, row, col):
+		return len(self.read('SELECT 1 FROM chunks WHERE row = ? AND col = ?', (row, col))) != 0
+
+	def record_chunk(self, row, col, points):
+		""" record_chunk
+		Marks a grid chunk processed and adds its valid lat,lon points (pairs, or an (n, 2) array) to the open batch, atomically.
+		"""
+		points = np.asarray(points, dtype = np.float64).reshape(-1, 2).tolist()
+		self.write([('INSERT INTO points (lat, lon) VALUES (?, ?)', point) for point in points] + \
+		           [('INSERT INTO chunks (row, col) VALUES (?, ?)', (row, col))])
+
+	def open_points(self):
+		return self.read('SELECT COUNT(*) FROM points')[0][0]
+
+	def seal_batches(self, batch_limit, final = False):
+		""" seal_batches
+		Moves the open points into pending batches of batch_limit points; the remainder stays open unless final.
+		Output: The number of batches sealed.
+		"""
+		sealed = 0
+		with self.lock:
+			with self.db:
+				while True:
+					rows = self.db.execute('SELECT seq, lat, lon FROM points ORDER BY seq LIMIT ?', (batch_limit,)).fetchall()
+					if not rows or (len(rows) < batch_limit and not final): return sealed
+					points = np.array([(lat, lon) for _, lat, lon in rows], dtype = '<f8')
+					self.db.execute('INSERT INTO batches (points) VALUES (?)', (sqlite3.Binary(points.tobytes()),))
+					self.db.execute('DELETE FROM points WHERE seq <= ?', (rows[-1][0],))
+					sealed += 1
+
+	def pending_batches(self, after = 0):
+		""" pending_batches
+		Output: A generator of (batch id, points, roads) for every batch not yet complete with an id above after,
+		        oldest first, read one at a time. points is the (n, 2) array of their lat,lon pairs;
+		        roads is None until recorded.
+		"""
+		while True:
+			rows = self.read('SELECT id, points, roads FROM batches WHERE done = 0 AND id > ? ORDER BY id LIMIT 1', (after,))
+			if not rows: return
+			after, points, roads = rows[0]
+			yield after, batch_points(points), None if roads is None else [tuple(road) for road in json.loads(roads)]
+
+	def upcoming_points(self, after, limit):
+		""" upcoming_points
+		Output: The (n, 2) array of the next (up to) limit points due to be snapped after batch after:
+		        those of the later pending batches not yet snapped, then the open points.
+		"""
+		points, count = [], 0
+		with self.lock:
+			for (blob,) in self.db.execute('SELECT points FROM batches WHERE done = 0 AND roads IS NULL AND id > ? ORDER BY id', (after,)):
+				if count >= limit: break
+				points.append(batch_points(blob)[:limit - count])
+				count += len(points[-1])
+			if count < limit: points.append(np.array(self.db.execute('SELECT lat, lon FROM points ORDER BY seq LIMIT ?', (limit - count,)).fetchall(), dtype = np.float64).reshape(-1, 2))
+		return np.concatenate(points)
+
+	def record_snap(self, batch_id, roads):
+		self.write([('UPDATE batches SET roads = ? WHERE id = ?', (json.dumps(roads), batch_id))])
+
+	def record_walk(self, batch_id, road, jobs):
+		self.write([('INSERT OR REPLACE INTO walks (batch, road, jobs) VALUES (?, ?, ?)', (batch_id, road, json.dumps(jobs)))])
+
+	def walks(self, batch_id):
+		""" walks
+		Output: {road index: download jobs} for the roads of the batch already walked.
+		"""
+		return dict((road, [tuple(job) for job in json.loads(jobs)]) for road, jobs in self.read('SELECT road, jobs FROM walks WHERE batch = ?', (batch_id,)))
+
+	def walked_jobs(self, page = 1000):
+		""" walked_jobs
+		Output: A generator of the download jobs of every walk journaled, read page walks at a time.
+		"""
+		last = 0
+		while True:
+			walks = self.read('SELECT rowid, jobs FROM walks WHERE rowid > ? ORDER BY rowid LIMIT ?', (last, page))
+			if not walks: return
+			last = walks[-1][0]
+			for rowid, jobs in walks:
+				for job in json.loads(jobs): yield tuple(job)
+
+	def snapped_roads(self, page = 100):
+		""" snapped_roads
+		Output: A generator of the (lat, lon) of every road journaled as snapped, read page batches at a time.
+		"""
+		last = 0
+		while True:
+			batches = self.read('SELECT id, roads FROM batches WHERE id > ? AND roads IS NOT NULL ORDER BY id LIMIT ?', (last, page))
+			if not batches: return
+			last = batches[-1][0]
+			for batch_id, roads in batches:
+				for road in json.loads(roads): yield tuple(road[:2])
+
+	def record_batch_done(self, batch_id):
+		self.write([('UPDATE batches SET done = 1 WHERE id = ?', (batch_id,))])
+
+	def download_done(self, filename):
+		return len(self.read('SELECT 1 FROM downloads WHERE filename = ?', (filename,))) != 0
+
+	def record_download(self, filename, size):
+		self.write([('INSERT OR REPLACE INTO downloads (filename, bytes) VALUES (?, ?)', (filename, size))])
+
+	def downloaded_jobs(self, page = 1000):
+		""" downloaded_jobs
+		Output: A generator of the (download job, bytes written) of every image downloaded, once per filename.
+		"""
+		last, seen = 0, set()
+		while True:
+			walks = self.read('SELECT rowid, jobs FROM walks WHERE rowid > ? ORDER BY rowid LIMIT ?', (last, page))
+			if not walks: return
+			last  = walks[-1][0]
+			jobs  = [tuple(job) for rowid, walk in walks for job in json.loads(walk)]
+			names = list(set(job[3] for job in jobs) - seen)
+			sizes = {}
+			for start in range(0, len(names), 500):
+				chunk = names[start:start + 500]
+				sizes.update(self.read('SELECT filename, bytes FROM downloads WHERE filename IN (' + ','.join('?' * len(chunk)) + ')', chunk))
+			for job in jobs:
+				if job[3] not in sizes or job[3] in seen: continue
+				seen.add(job[3])
+				yield job, sizes[job[3]]
+
+	def mark_complete(self):
+		self.write([('INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)', ('complete', json.dumps(True)))])
+
+	def is_complete(self):
+		return self.load_config().get('complete', False)
+
+	def close(self):
+		with self.lock:
+			self.db.close()
+
+
+def batch_points(points):
+	""" batch_points
+	Decodes the points of a batch: packed little-endian float64 lat,lon pairs.
+	"""
+	return np.frombuffer(points, dtype = '<f8').reshape(-1, 2)
+
+
+class BatchTracker(object):
+	""" BatchTracker
+	Marks a batch complete in the journal once the images of each of its roads are saved,
+	for when the roads of a batch are handled separately (e.g. by pipeline stages).
+	A batch with any failed download is left pending so that a resumed run retries it.
+	"""
+	def __init__(self, journal, batch_id, roads):
+		self.journal   = journal
+		self.batch_id  = batch_id
+		self.remaining = roads
+		self.failed    = False
+		self.lock      = threading.Lock()
+		if roads == 0: journal.record_batch_done(batch_id)
+
+	def finish(self, succeeded = True):
+		with self.lock:
+			self.remaining -= 1
+			self.failed = self.failed or not succeeded
+			complete = self.remaining == 0 and not self.failed
+		if complete: self.journal.record_batch_done(self.batch_id)
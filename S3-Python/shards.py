@@ -0,0 +1,124 @@
+####################################
+#            shards.py             #
+#                                  #
+#  Splits a survey region into     #
+#  tiles of balanced valid area,   #
+#  one per worker run, and merges  #
+#  the images the workers saved    #
+#  into a single manifest...       #
+####################################
+import os
+import math
+import json
+import shutil
+from shapely.geometry import box
+from shapely.ops import transform, unary_union
+from run_journal import RunJournal
+from manifest import ManifestWriter, manifest_path, read_manifest
+
+PLAN_FILE     = 'shards.json'
+SPLIT_STEPS   = 40 # Bisection steps placing each cut...
+
+
+def equal_area(geometry):
+	""" equal_area
+	Sinusoidal projection of a (lat, lon) geometry, in which areas compare as they do on the ground.
+	"""
+	return transform(lambda lat, lon: (lat, lon * math.cos(math.radians(lat))), geometry)
+
+def valid_area(region, exclusions):
+	""" valid_area
+	The region minus its exclusions.
+	"""
+	return region.difference(unary_union(exclusions)) if exclusions else region
+
+def split_tiles(valid, bounds, num_tiles):
+	""" split_tiles
+	Recursively cuts bounds (S, W, N, E) across its longer side so that each side holds a share of the
+	valid area proportional to the number of tiles it is split into next.
+	Output: A list of num_tiles (bounds, weight) pairs; weight is the equal-area size of the valid area in the tile.
+	"""
+	piece  = valid.intersection(box(*bounds))
+	weight = equal_area(piece).area
+	if num_tiles == 1: return [(bounds, weight)]
+
+	south, west, north, east = bounds
+	mid_lat = math.radians((south + north) / 2.0)
+	cut_lat = (north - south) >= (east - west) * math.cos(mid_lat) # Cut the longer side (a N-S split)...
+	low, high = (south, north) if cut_lat else (west, east)
+	first = num_tiles / 2
+	share = float(first) / num_tiles
+
+	def lower_part(cut):
+		return (south, west, cut, east) if cut_lat else (south, west, north, cut)
+
+	def upper_part(cut):
+		return (cut, west, north, east) if cut_lat else (south, cut, north, east)
+
+	if weight == 0:
+		cut = low + (high - low) * share # Nothing valid: split evenly...
+	else:
+		# Bisection on the position of the cut for the share of the valid area below it.
+		lo, hi = low, high
+		for _ in range(SPLIT_STEPS):
+			cut = (lo + hi) / 2.0
+			if equal_area(piece.intersection(box(*lower_part(cut)))).area < share * weight: lo = cut
+			else:                                                                          hi = cut
+		cut = (lo + hi) / 2.0
+	return split_tiles(piece, lower_part(cut), first) + split_tiles(piece, upper_part(cut), num_tiles - first)
+
+def shard_region(region, exclusions, num_shards):
+	""" shard_region
+	Splits the bounds of a region into num_shards tiles balanced by the area left valid by the exclusions.
+	The tiles cover the bounds without overlap, taking each as [S, N) x [W, E) (see RegionFilter).
+	Output: A list of num_shards (bounds, weight) pairs.
+	"""
+	return split_tiles(valid_area(region, exclusions), region.bounds, num_shards)
+
+def shard_dir(output_dir, index):
+	return os.path.join(output_dir, 'shard_' + str(index), '') # IMG_DIR is used as a filename prefix...
+
+def save_plan(output_dir, tiles, config):
+	""" save_plan
+	Records the survey arguments (config) and the shards of a sharded survey in output_dir.
+	Output: The plan: {config, shards}, shards being a list of {index, bounds, weight, output_dir}.
+	"""
+	plan = {'config': config,
+	        'shards': [{'index': i, 'bounds': list(bounds), 'weight': weight, 'output_dir': shard_dir(output_dir, i)} \
+	                   for i, (bounds, weight) in enumerate(tiles)]}
+	with open(os.path.join(output_dir, PLAN_FILE), 'w') as f: json.dump(plan, f, indent = 1)
+	return plan
+
+def load_plan(output_dir):
+	with open(os.path.join(output_dir, PLAN_FILE)) as f: return json.load(f)
+
+def plan_exists(output_dir):
+	return os.path.exists(os.path.join(output_dir, PLAN_FILE))
+
+def shard_complete(shard):
+	if not RunJournal.exists(shard['output_dir']): return False
+	journal = RunJournal(shard['output_dir'])
+	complete = journal.is_complete()
+	journal.close()
+	return complete
+
+def merge_manifests(output_dir, shards, format):
+	""" merge_manifests
+	Writes the manifest of a sharded survey: the rows of the manifests of all its shards (their filenames
+	lead to the shard subdirectories), replacing any earlier merge.
+	Images taken by more than one shard (walks crossing a tile edge) are listed once.
+	Output: The path of the manifest and the number of images listed.
+	"""
+	path = manifest_path(output_dir, format)
+	if os.path.isdir(path):    shutil.rmtree(path)
+	elif os.path.exists(path): os.remove(path)
+
+	seen = set()
+	writer = ManifestWriter(path, format)
+	for shard in shards:
+		for row in read_manifest(manifest_path(shard['output_dir'], format)).tolist():
+			if row[2:5] in seen: continue # Same lat, lon, heading...
+			seen.add(row[2:5])
+			writer.append(row)
+	writer.close()
+	return path, len(seen)
@@ -0,0 +1,94 @@
+####################################
+#           test_grid.py           #
+#                                  #
+#  grid_chunks and grid_points vs. #
+#  the original teleport loop of   #
+#  search_area...                  #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python)
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import S3
+
+TOLERANCE = 1e-9 # Degrees: well under a millimeter...
+
+# (S, W, N, E) bounding boxes and spacings in m: a city block, and a sparser grid further north...
+CASES = [((45.30, -75.80, 45.32, -75.77), 100.0),
+         ((60.00, -10.00, 60.30, -9.40), 1000.0)]
+
+
+def teleport_loop(bounding_box, skip_distance, start_lat = None):
+	# The sweep of the original search_area: one scalar teleport per grid point, rows stopping at or past the eastern edge.
+	points = []
+	cur_lat = bounding_box[2] if start_lat is None else start_lat
+	while cur_lat > bounding_box[0]:
+		cur_lat, cur_lon = S3.teleport(cur_lat, bounding_box[1], S3.SOUTH, skip_distance)
+		while cur_lon < bounding_box[3]:
+			cur_lat, cur_lon = S3.teleport(cur_lat, cur_lon, S3.EAST, skip_distance)
+			points.append((cur_lat, cur_lon))
+	return np.array(points)
+
+def gathered(chunks):
+	return np.concatenate([np.column_stack((chunk[-2], chunk[-1])) for chunk in chunks])
+
+
+class GridTest(unittest.TestCase):
+
+	def assertSamePoints(self, points, expected):
+		self.assertEqual(points.shape, expected.shape)
+		self.assertLess(np.abs(points - expected).max(), TOLERANCE)
+
+	def test_grid_points(self):
+		for bounding_box, skip_distance in CASES:
+			expected = teleport_loop(bounding_box, skip_distance)
+			self.assertSamePoints(gathered(S3.grid_points(bounding_box, skip_distance)), expected)
+			# Rows many chunks long, or not...
+			for chunk_size in (7, 64, S3.GRID_CHUNK):
+				self.assertSamePoints(gathered(S3.grid_chunks(bounding_box, skip_distance, chunk_size = chunk_size)), expected)
+
+	def test_start_lat(self):
+		for bounding_box, skip_distance in CASES:
+			start_lat = (bounding_box[0] + bounding_box[2]) / 2
+			self.assertSamePoints(gathered(S3.grid_chunks(bounding_box, skip_distance, start_lat = start_lat, chunk_size = 16)),
+			                      teleport_loop(bounding_box, skip_distance, start_lat))
+
+	def test_window(self):
+		# A window yields the very points of the full grid within [S, N) x [W, E)...
+		for bounding_box, skip_distance in CASES:
+			south, west, north, east = bounding_box
+			window = (south + 0.31 * (north - south), west + 0.43 * (east - west), south + 0.77 * (north - south), east)
+			expected = teleport_loop(bounding_box, skip_distance)
+			inside = (expected[:, 0] >= window[0]) & (expected[:, 0] < window[2]) & (expected[:, 1] >= window[1]) & (expected[:, 1] < window[3])
+			self.assertTrue(0 < inside.sum() < len(expected))
+			self.assertSamePoints(gathered(S3.grid_chunks(bounding_box, skip_distance, chunk_size = 16, window = window)), expected[inside])
+
+	def test_chunk_boundaries(self):
+		for bounding_box, skip_distance in CASES:
+			chunks = list(S3.grid_chunks(bounding_box, skip_distance, chunk_size = 16))
+			rows   = {}
+			for row, col, lats, lons in chunks:
+				self.assertTrue(0 < len(lats) <= 16)
+				# The chunks of a row follow each other, columns counting its points...
+				self.assertEqual(col, sum(len(prior[2]) for prior in rows.get(row, [])))
+				rows.setdefault(row, []).append((row, col, lats, lons))
+			self.assertEqual(sorted(rows), range(len(rows)))
+			for row in rows.values():
+				lons = np.concatenate([chunk[3] for chunk in row])
+				# Each row stops at the first point at or past the eastern edge...
+				self.assertGreaterEqual(lons[-1], bounding_box[3])
+				self.assertTrue((lons[:-1] < bounding_box[3]).all())
+
+			# A chunk of a window keeps its position in the full grid...
+			window = (bounding_box[0], bounding_box[1] + 0.5 * (bounding_box[3] - bounding_box[1]), bounding_box[2], bounding_box[3])
+			for row, col, lats, lons in S3.grid_chunks(bounding_box, skip_distance, chunk_size = 16, window = window):
+				full_lats, full_lons = [np.concatenate(part) for part in zip(*[chunk[2:] for chunk in rows[row]])]
+				self.assertTrue((full_lons[col:col + len(lons)] == lons).all())
+				self.assertTrue((full_lats[col:col + len(lats)] == lats).all())
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,73 @@
+####################################
+#     test_image_downloader.py     #
+#                                  #
+#  ImageDownloader workers against #
+#  a fake_google.py server...      #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python)
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_downloader import ImageDownloader
+from fake_google import FakeGoogle, FakeGoogleServer, STREETVIEW_PATH
+
+IMAGE_BYTES = 5000
+
+
+class ImageDownloaderTest(unittest.TestCase):
+
+	def setUp(self):
+		self.google = FakeGoogle(latency = 0.005, image_bytes = IMAGE_BYTES)
+		self.server = FakeGoogleServer(self.google).start()
+		self.addCleanup(self.server.stop)
+		self.dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.dir)
+
+	def jobs(self, count, prefix = 'img'):
+		return [(self.server.url + STREETVIEW_PATH + '?location=0.002,' + str(0.0005 * i) + '&key=K',
+		         os.path.join(self.dir, prefix + '_' + str(i) + '.jpg')) for i in range(count)]
+
+	def downloader(self, num_workers):
+		downloader = ImageDownloader(num_workers)
+		self.addCleanup(downloader.close)
+		return downloader
+
+	def assertSaved(self, jobs, results):
+		self.assertEqual([filename for filename, size, error in results], [filename for url, filename in jobs])
+		self.assertEqual([(size, error) for filename, size, error in results], [(IMAGE_BYTES, None)] * len(jobs))
+		for url, filename in jobs: self.assertEqual(os.path.getsize(filename), IMAGE_BYTES)
+		self.assertEqual([name for name in os.listdir(self.dir) if name.endswith('.part')], [])
+
+	def test_every_image_saved(self):
+		jobs = self.jobs(40)
+		self.assertSaved(jobs, self.downloader(8).download(jobs))
+		self.assertEqual(self.google.stats()[STREETVIEW_PATH], 40)
+
+	def test_concurrent_batches(self):
+		# Several callers (eg: pipeline download workers) share one set of worker threads...
+		downloader = self.downloader(4)
+		batches = [self.jobs(15, 'batch' + str(b)) for b in range(4)]
+		results = [None] * len(batches)
+		def download(b): results[b] = downloader.download(batches[b])
+		threads = [threading.Thread(target = download, args = (b,)) for b in range(len(batches))]
+		for thread in threads: thread.start()
+		for thread in threads: thread.join()
+		for jobs, batch_results in zip(batches, results): self.assertSaved(jobs, batch_results)
+		self.assertEqual(len(downloader.threads), 4)
+
+	def test_failed_download(self):
+		# A failed image is reported, and leaves neither an image nor a .part file...
+		self.google.failure_rate = {STREETVIEW_PATH: 1.0}
+		jobs = self.jobs(5)
+		results = self.downloader(2).download(jobs)
+		self.assertTrue(all(size is None and error is not None for filename, size, error in results))
+		self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,121 @@
+####################################
+#        test_land_mask.py         #
+#                                  #
+#  TiledLandMask with a synthetic  #
+#  map in place of Static Maps...  #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python)
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from land_mask import TiledLandMask, world_pixels
+
+ZOOM  = 17
+WATER = (170, 218, 255)
+LAND  = (240, 240, 240)
+NEAR  = (170, 218, 254) # Not quite water: land...
+
+
+def world_water(x, y):
+	# The synthetic map: a checkerboard of 7 x 5 pixel cells in world pixels, water on the even ones.
+	return (x // 7 + y // 5) % 2 == 0
+
+def world_color(x, y):
+	return np.where(world_water(x, y)[:, :, None], np.array(WATER, dtype = np.uint8),
+	                np.where((x % 3 == 0)[:, :, None], np.array(NEAR, dtype = np.uint8), np.array(LAND, dtype = np.uint8)))
+
+
+class FakeTiles(object):
+	""" FakeTiles
+	A fetch_tile rendering the synthetic map around lat,lon, as Static Maps would, counting its calls.
+	"""
+	def __init__(self, delay = 0.0):
+		self.delay = delay
+		self.calls = []
+		self.lock  = threading.Lock()
+
+	def __call__(self, lat, lon, zoom, size):
+		with self.lock: self.calls.append((lat, lon))
+		time.sleep(self.delay)
+		cx, cy = world_pixels([lat], [lon], zoom)
+		left, top = int(round(cx[0])) - size // 2, int(round(cy[0])) - size // 2
+		y, x = np.mgrid[top:top + size, left:left + size]
+		return world_color(x, y)
+
+
+def no_fetch(lat, lon, zoom, size):
+	raise AssertionError('The tile should have been read from disk')
+
+
+class TiledLandMaskTest(unittest.TestCase):
+
+	def setUp(self):
+		random = np.random.RandomState(7)
+		self.lats = 45.42 + random.uniform(0, 0.02, 2000)
+		self.lons = -75.69 + random.uniform(0, 0.02, 2000)
+		x, y = world_pixels(self.lats, self.lons, ZOOM)
+		self.expected = world_water(np.floor(x).astype(np.int64), np.floor(y).astype(np.int64))
+		self.mask_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.mask_dir)
+
+	def test_classification(self):
+		# Margins and offsets line up: every point gets the class of its own world pixel.
+		fetch = FakeTiles()
+		mask = TiledLandMask(fetch, WATER, ZOOM)
+		np.testing.assert_array_equal(mask.water_mask(self.lats, self.lons), self.expected)
+		np.testing.assert_array_equal(mask.land_mask(self.lats, self.lons), ~self.expected)
+		self.assertTrue(0 < self.expected.sum() < len(self.expected))
+
+		# Every tile is fetched once, then looked up from memory.
+		tiles = len(fetch.calls)
+		self.assertEqual(mask.fetched, tiles)
+		mask.water_mask(self.lats, self.lons)
+		self.assertEqual(len(fetch.calls), tiles)
+
+	def test_saved_tiles(self):
+		fetch = FakeTiles()
+		TiledLandMask(fetch, WATER, ZOOM, self.mask_dir).water_mask(self.lats, self.lons)
+		saved = os.listdir(os.path.join(self.mask_dir, 'z' + str(ZOOM)))
+		self.assertEqual(len(saved), len(fetch.calls))
+		self.assertTrue(all(name.endswith('.npy') for name in saved))
+
+		# A later run reads the tiles back instead of fetching them.
+		mask = TiledLandMask(no_fetch, WATER, ZOOM, self.mask_dir)
+		np.testing.assert_array_equal(mask.water_mask(self.lats, self.lons), self.expected)
+		self.assertEqual(mask.fetched, 0)
+
+	def classify(self, mask, subsets):
+		results = [None] * len(subsets)
+		def classify(i):
+			results[i] = mask.water_mask(self.lats[subsets[i]], self.lons[subsets[i]])
+		threads = [threading.Thread(target = classify, args = (i,)) for i in range(len(subsets))]
+		for thread in threads: thread.start()
+		for thread in threads: thread.join()
+		for subset, result in zip(subsets, results): np.testing.assert_array_equal(result, self.expected[subset])
+
+	def test_shared_tiles(self):
+		# Threads classifying points of the same tiles fetch each tile once.
+		fetch = FakeTiles(delay = 0.05)
+		self.classify(TiledLandMask(fetch, WATER, ZOOM), [np.arange(i, len(self.lats), 8) for i in range(8)])
+		self.assertEqual(len(fetch.calls), len(set(fetch.calls)))
+
+	def test_concurrent_fetches(self):
+		# Threads classifying points of distinct tiles fetch them at once.
+		x, y = world_pixels(self.lats, self.lons, ZOOM)
+		tiles = (np.floor(x).astype(np.int64) // 512) * 1000 + np.floor(y).astype(np.int64) // 512
+		order = np.searchsorted(np.unique(tiles), tiles)
+		fetch = FakeTiles(delay = 0.2)
+		start = time.time()
+		self.classify(TiledLandMask(fetch, WATER, ZOOM), [np.nonzero(order % 8 == i)[0] for i in range(8)])
+		self.assertEqual(len(fetch.calls), len(np.unique(tiles)))
+		self.assertLess(time.time() - start, 0.2 * len(fetch.calls) / 2)
+
+if __name__ == '__main__':
+	unittest.main()
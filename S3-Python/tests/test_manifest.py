@@ -0,0 +1,54 @@
+####################################
+#         test_manifest.py         #
+#                                  #
+#  Manifest rows read back as they #
+#  were written, long text and all #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python)
+import os
+import sys
+import math
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import manifest
+from manifest import ManifestWriter, manifest_path, read_manifest
+
+# A path far longer than any fixed-width column, with a comma, and a long pano id...
+LONG_FILENAME = os.path.join('/images', 'a' * 2000, 'ref_1,step_2.jpg')
+LONG_PANO     = 'CAoSLEFGMVFpcE' * 10
+ROWS          = [(1, 2, 45.3, -75.8, 90.0, LONG_PANO, None, None, 1.5, 5000, LONG_FILENAME),
+                 (1, 3, 45.3, -75.7, 180.0, 'p', 45.31, -75.71, 2.5, 6000, 'short.jpg')]
+
+
+class ManifestTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.dir)
+
+	def round_trip(self, format):
+		path = manifest_path(self.dir, format)
+		self.assertEqual(len(read_manifest(path)), 0)
+		writer = ManifestWriter(path, format, buffer_rows = 1)
+		writer.extend(ROWS)
+		writer.close()
+		records = read_manifest(path)
+		self.assertEqual(records['filename'].tolist(), [LONG_FILENAME, 'short.jpg'])
+		self.assertEqual(records['pano'].tolist(), [LONG_PANO, 'p'])
+		self.assertEqual(records[['ref', 'step', 'bytes']].tolist(), [(1, 2, 5000), (1, 3, 6000)])
+		self.assertTrue(math.isnan(records['grid_lat'][0]))
+		self.assertEqual(records['grid_lon'][1], -75.71)
+
+	def test_csv(self):
+		self.round_trip('csv')
+
+	@unittest.skipIf(manifest.pa is None, 'pyarrow is required')
+	def test_parquet(self):
+		self.round_trip('parquet')
+
+
+if __name__ == '__main__':
+	unittest.main()
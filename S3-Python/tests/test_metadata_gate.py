@@ -0,0 +1,77 @@
+####################################
+#      test_metadata_gate.py       #
+#                                  #
+#  MetadataGate on the Street View #
+#  metadata of a fake_google.py    #
+#  server...                       #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python)
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import S3
+from metadata_gate import MetadataGate
+from fake_google import FakeGoogle, FakeGoogleServer, METADATA_PATH, LAT_STEP, LON_STEP
+
+
+def job(lat, lon, heading, filename, pano = None):
+	return (lat, lon, heading, filename, 0, 0, pano)
+
+
+class MetadataGateTest(unittest.TestCase):
+
+	def setUp(self):
+		self.google = FakeGoogle(water = 0.0, no_imagery = 0.5)
+		self.server = FakeGoogleServer(self.google).start()
+		self.addCleanup(self.server.stop)
+		S3.set_google_url(self.server.url)
+		self.gate = MetadataGate(S3.streetview_metadata, 4)
+		self.addCleanup(self.gate.close)
+
+	def location(self, imagery):
+		# The first panorama of the street at 45.3 with (or without) imagery...
+		for col in range(-151600, -151500):
+			lat, lon = 45.3, col * LON_STEP
+			if (S3.streetview_metadata(lat, lon)['status'] == 'OK') == imagery: return lat, lon
+		self.fail('No panorama ' + ('with' if imagery else 'without') + ' imagery')
+
+	def test_no_imagery_dropped(self):
+		lat, lon = self.location(imagery = True)
+		blank_lat, blank_lon = self.location(imagery = False)
+		jobs = [job(lat, lon, 0.0, 'a.jpg'), job(blank_lat, blank_lon, 0.0, 'b.jpg'), job(blank_lat, blank_lon, 180.0, 'c.jpg')]
+		kept = self.gate.filter(jobs)
+		self.assertEqual([kept_job[3] for kept_job in kept], ['a.jpg'])
+		self.assertTrue(kept[0][6].startswith('stub_')) # The pano id found is filled in...
+		stats = self.gate.stats()
+		self.assertEqual((stats['checked'], stats['no_imagery'], stats['avoided']), (3, 2, 2))
+
+	def test_duplicate_pano_dropped(self):
+		lat, lon = self.location(imagery = True)
+		near_lat, near_lon = lat + LAT_STEP / 4, lon + LON_STEP / 4 # Another location of the same panorama...
+		kept = self.gate.filter([job(lat, lon, 0.0, 'a.jpg'), job(near_lat, near_lon, 0.0, 'b.jpg'), job(near_lat, near_lon, 180.0, 'c.jpg')])
+		self.assertEqual([kept_job[3] for kept_job in kept], ['a.jpg', 'c.jpg'])
+
+		# Across batches too, unless it is the job passed on, being retried...
+		kept = self.gate.filter([job(lat, lon, 0.0, 'a.jpg'), job(near_lat, near_lon, 360.0, 'd.jpg')])
+		self.assertEqual([kept_job[3] for kept_job in kept], ['a.jpg'])
+		self.assertEqual(self.gate.stats()['duplicates'], 2)
+
+	def test_mark_taken(self):
+		# The images of a resumed run are taken already, whether their jobs carry a pano id or not...
+		lat, lon = self.location(imagery = True)
+		self.gate.mark_taken([job(lat, lon, 0.0, 'a.jpg'), job(0.0, 0.0, 90.0, 'b.jpg', 'stub_7_7')])
+		kept = self.gate.filter([job(lat, lon, 0.0, 'c.jpg'), job(lat, lon, 90.0, 'd.jpg')])
+		self.assertEqual([kept_job[3] for kept_job in kept], ['d.jpg'])
+
+	def test_unchecked_kept(self):
+		# A job whose metadata could not be checked is downloaded anyway...
+		self.google.failure_rate = {METADATA_PATH: 1.0}
+		kept = self.gate.filter([job(45.3, -75.8, 0.0, 'a.jpg')])
+		self.assertEqual(len(kept), 1)
+		self.assertEqual(self.gate.stats()['unchecked'], 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,128 @@
+####################################
+#       test_node_engine.py        #
+#                                  #
+#  NodeEngine round trips through  #
+#  rpc_s3.js, against a fake_google#
+#  .py server and its stub Maps... #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python; the rpc_s3.js tests need node and the S3-Node dependencies)
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+import SocketServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from node_engine import NodeEngine, EngineError, ENGINE_SCRIPT
+from quota_scheduler import QuotaScheduler, QuotaExhausted, ApiBudget, STREETVIEW, METADATA
+from fake_google import FakeGoogle, FakeGoogleServer, STREETVIEW_PATH, MAPS_JS_PATH
+
+IMAGE_BYTES = 5000
+
+
+def has_engine():
+	try:
+		with open(os.devnull, 'w') as devnull: # Not the require stack of a missing module...
+			return subprocess.call(['node', '-e', "require('argparse'); require('axios'); require('jsdom')"], cwd = os.path.dirname(ENGINE_SCRIPT), stderr = devnull) == 0
+	except OSError: # No node...
+		return False
+
+
+@unittest.skipUnless(has_engine(), 'node and the S3-Node dependencies are required')
+class NodeEngineTest(unittest.TestCase):
+
+	def setUp(self):
+		self.google = FakeGoogle(water = 0.0, no_imagery = 0.0, image_bytes = IMAGE_BYTES)
+		self.server = FakeGoogleServer(self.google).start()
+		self.addCleanup(self.server.stop)
+		self.dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.dir)
+		self.engine = NodeEngine.launch(os.path.join(self.dir, 'engine.sock'), 'K', self.server.url, self.server.url + MAPS_JS_PATH, timeout = 20.0)
+		self.addCleanup(self.engine.close)
+
+	def test_adjacency(self):
+		# A street every 0.001 deg of latitude, a panorama every 0.0005 deg of longitude...
+		first, second = self.engine.lookup_many([(0.002, 0.001), (0.003, 0.001)])
+		self.assertEqual(sorted(first['pano']), ['stub_2_1', 'stub_2_3'])
+		self.assertEqual(sorted(second['pano']), ['stub_3_1', 'stub_3_3'])
+
+	def test_metadata(self):
+		self.assertEqual([found['pano_id'] for found in self.engine.metadata_many([(0.002, 0.001), (0.003, 0.0015)])], ['stub_2_2', 'stub_3_3'])
+
+	def test_download(self):
+		jobs = [(self.server.url + STREETVIEW_PATH + '?location=0.002,' + str(0.0005 * i) + '&key=K', os.path.join(self.dir, str(i) + '.jpg')) for i in range(10)]
+		self.assertEqual(self.engine.download(jobs), [(filename, IMAGE_BYTES, None) for url, filename in jobs])
+		for url, filename in jobs: self.assertEqual(os.path.getsize(filename), IMAGE_BYTES)
+
+		# A failed image leaves neither an image nor a .part file behind...
+		self.google.failure_rate = {STREETVIEW_PATH: 1.0}
+		filename, size, error = self.engine.download([(jobs[0][0], os.path.join(self.dir, 'failed.jpg'))])[0]
+		self.assertIsInstance(error, EngineError)
+		self.assertEqual([name for name in os.listdir(self.dir) if name.startswith('failed')], [])
+
+	def test_bad_method(self):
+		with self.assertRaises(EngineError) as raised: self.engine.call('teleport', {}, 1, 10.0)
+		self.assertEqual(raised.exception.code, 'BAD_METHOD')
+
+
+class FakeEngineHandler(SocketServer.StreamRequestHandler):
+	# Answers every metadata location and download job, counting them...
+	def handle(self):
+		for line in self.rfile:
+			request = json.loads(line)
+			if request['method'] == 'metadata': results = [{'status': 'OK', 'pano_id': 'p'} for location in request['params']['locations']]
+			else:                               results = [{'bytes': 1} for job in request['params']['jobs']]
+			with self.server.lock: self.server.items[request['method']] += len(results)
+			self.wfile.write(json.dumps({'id': request['id'], 'results': results}) + '\n')
+			self.wfile.flush()
+
+
+class FakeEngine(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+	def __init__(self, socket_path):
+		SocketServer.UnixStreamServer.__init__(self, socket_path, FakeEngineHandler)
+		self.items = {'metadata': 0, 'download': 0}
+		self.lock  = threading.Lock()
+		thread = threading.Thread(target = self.serve_forever)
+		thread.daemon = True
+		thread.start()
+
+
+class PacedEngineTest(unittest.TestCase):
+	# The engine's metadata checks and downloads count against the budgets of the scheduler...
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.dir)
+		self.fake = FakeEngine(os.path.join(self.dir, 'engine.sock'))
+		self.addCleanup(self.fake.server_close)
+		self.addCleanup(self.fake.shutdown)
+		budgets = {METADATA: ApiBudget(daily_limit = 3), STREETVIEW: ApiBudget(daily_limit = 2)}
+		self.scheduler = QuotaScheduler(budgets, wait_for_reset = False)
+		self.engine = NodeEngine(self.fake.server_address, timeout = 10.0, scheduler = self.scheduler)
+		self.addCleanup(self.engine.close)
+
+	def test_metadata_budget(self):
+		self.assertEqual(len(self.engine.metadata_many([(0.0, 0.0), (0.0, 0.1)])), 2)
+		self.assertRaises(QuotaExhausted, self.engine.metadata_many, [(0.0, 0.2), (0.0, 0.3)])
+		self.assertEqual(self.fake.items['metadata'], 2)
+		stats = self.scheduler.stats()[METADATA]
+		self.assertEqual((stats['requests'], stats['remaining_today']), (3, 0))
+
+	def test_download_budget(self):
+		# The jobs past the budget are not sent, and fail as over quota...
+		results = self.engine.download([('url', str(i) + '.jpg') for i in range(3)])
+		self.assertEqual([(filename, size) for filename, size, error in results], [('0.jpg', 1), ('1.jpg', 1), ('2.jpg', None)])
+		self.assertIsInstance(results[2][2], QuotaExhausted)
+		self.assertEqual(self.fake.items['download'], 2)
+		self.assertEqual(self.scheduler.stats()[STREETVIEW]['requests'], 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
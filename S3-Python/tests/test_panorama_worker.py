@@ -0,0 +1,131 @@
+####################################
+#     test_panorama_worker.py      #
+#                                  #
+#  panorama_worker.js against the  #
+#  offline stub_maps.js, and when  #
+#  the Maps script fails to load.  #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python; needs node and jsdom)
+import os
+import sys
+import time
+import socket
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from panorama_workers import PanoramaWorkerPool
+
+SCRIPTS = os.path.join(os.path.dirname(HERE), 'javascript_panoramas')
+WORKER  = os.path.join(SCRIPTS, 'panorama_worker.js')
+STUB    = 'file://' + os.path.join(SCRIPTS, 'stub_maps.js')
+
+
+def has_node():
+	try:
+		return subprocess.call(['node', '-e', '']) == 0
+	except OSError:
+		return False
+
+def has_jsdom():
+	try:
+		with open(os.devnull, 'w') as devnull: # Not the require stack of a missing module...
+			return subprocess.call(['node', '-e', "require('jsdom')"], cwd = SCRIPTS, stderr = devnull) == 0
+	except OSError: # No node...
+		return False
+
+
+@unittest.skipUnless(has_jsdom(), 'node and jsdom are required')
+class PanoramaWorkerTest(unittest.TestCase):
+
+	def pool(self, maps_script_url):
+		pool = PanoramaWorkerPool('KEY', 1, maps_script_url, script = WORKER, timeout = 20.0)
+		self.addCleanup(pool.close)
+		return pool
+
+	def test_stub_lookup(self):
+		# A street every 0.001 deg of latitude, a panorama every 0.0005 deg of longitude...
+		records = self.pool(STUB).lookup(0.002, 0.001)
+		self.assertEqual(sorted(records['pano']), ['stub_2_1', 'stub_2_3'])
+		self.assertTrue((records['lat'] == 0.002).all())
+
+	def test_failed_load(self):
+		pool = self.pool('file://' + os.path.join(SCRIPTS, 'missing_maps.js'))
+		start = time.time()
+		self.assertEqual(pool.lookup_many([(0.002, 0.001), (0.003, 0.001)]), [None, None])
+		self.assertLess(time.time() - start, pool.timeout)
+		pool.workers[0].process.wait()
+		self.assertEqual(pool.workers[0].process.returncode, 1)
+
+	def test_load_timeout(self):
+		# A server that never answers: the script never loads...
+		server = socket.socket()
+		server.bind(('127.0.0.1', 0))
+		server.listen(8)
+		self.addCleanup(server.close)
+		os.environ['MAPS_LOAD_TIMEOUT_MS'] = '500'
+		try:
+			pool = self.pool('http://127.0.0.1:%d/maps/api/js' % server.getsockname()[1])
+			start = time.time()
+			self.assertEqual(pool.lookup(0.002, 0.001), None)
+		finally:
+			del os.environ['MAPS_LOAD_TIMEOUT_MS']
+		self.assertLess(time.time() - start, pool.timeout)
+		pool.workers[0].process.wait()
+		self.assertEqual(pool.workers[0].process.returncode, 1)
+
+		# The dead worker is replaced on the next lookup...
+		pool.args[-1] = STUB
+		self.assertEqual(len(pool.lookup(0.002, 0.001)), 2)
+
+
+@unittest.skipUnless(has_node(), 'node is required')
+class ScriptedWorkerTest(unittest.TestCase):
+
+	def test_timeout_abandons_request(self):
+		# A worker ready at once, reading the requests without ever answering them...
+		scripts = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, scripts)
+		script = os.path.join(scripts, 'silent_worker.js')
+		with open(script, 'w') as f: f.write("console.log(JSON.stringify({ready: true}));\nprocess.stdin.on('data', function () {});\n")
+		pool = PanoramaWorkerPool('KEY', 1, script = script, timeout = 0.2)
+		self.addCleanup(pool.close)
+
+		self.assertEqual(pool.lookup_many([(0.002, 0.001), (0.003, 0.001)]), [None, None])
+		self.assertEqual(pool.workers[0].pending, {})
+
+	def test_slow_start(self):
+		# A worker taking longer to load than a request may take: the requests it holds meanwhile are not timed out...
+		scripts = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, scripts)
+		script = os.path.join(scripts, 'slow_worker.js')
+		with open(script, 'w') as f: f.write(SLOW_WORKER)
+		pool = PanoramaWorkerPool('KEY', 1, script = script, timeout = 0.5)
+		self.addCleanup(pool.close)
+
+		records = pool.lookup_many([(0.002, 0.001), (0.003, 0.001)])
+		self.assertEqual([len(location) for location in records], [0, 0])
+
+
+# Ready after 1.5s, then answers every location with no panorama...
+SLOW_WORKER = '''
+var ready = false, held = [];
+function answer(request) {
+	console.log(JSON.stringify({id: request.id, results: request.locations.map(function () { return {status: 'ZERO_RESULTS', links: []}; })}));
+}
+setTimeout(function () {
+	ready = true;
+	console.log(JSON.stringify({ready: true}));
+	held.forEach(answer);
+}, 1500);
+require('readline').createInterface({input: process.stdin}).on('line', function (line) {
+	if (ready) answer(JSON.parse(line)); else held.push(JSON.parse(line));
+});
+'''
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,121 @@
+####################################
+#     test_quota_scheduler.py      #
+#                                  #
+#  QuotaScheduler backoff and daily#
+#  budgets against a fake_google.py#
+#  server, and the shared state.   #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python)
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from quota_scheduler import QuotaScheduler, QuotaExhausted, ApiBudget, parse_budgets, STREETVIEW, ROADS
+from fake_google import FakeGoogle, FakeGoogleServer, STREETVIEW_PATH
+
+
+class QuotaSchedulerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.google = FakeGoogle(image_bytes = 100)
+		self.server = FakeGoogleServer(self.google).start()
+		self.addCleanup(self.server.stop)
+		self.url    = self.server.url + STREETVIEW_PATH + '?location=0.002,0.001&key=K'
+		self.delays = []
+
+	def scheduler(self, daily_limit = None, **kwargs):
+		budget = ApiBudget(rate = 100.0, burst = 10, daily_limit = daily_limit)
+		return QuotaScheduler({STREETVIEW: budget}, sleep = self.delays.append, **kwargs)
+
+	def test_retry_after_429(self):
+		# The server throttles until the scheduler has backed off once, as long as it said (Retry-After: 0)...
+		self.google.throttle_rate = 1.0
+		def sleep(seconds):
+			self.delays.append(seconds)
+			self.google.throttle_rate = 0.0
+		scheduler = self.scheduler(daily_limit = 3, wait_for_reset = False)
+		scheduler.sleep = sleep
+
+		self.assertEqual(scheduler.get(STREETVIEW, self.url).status_code, 200)
+		self.assertEqual(self.delays, [0.0])
+		stats = scheduler.stats()[STREETVIEW]
+		self.assertEqual((stats['throttled'], stats['retries']), (1, 1))
+		self.assertEqual(stats['rate'], 55.0) # Halved by the 429, then a step back up on the success...
+		# The throttled request counts against the daily budget too...
+		self.assertEqual((stats['used_today'], stats['remaining_today']), (2, 1))
+		self.assertEqual(self.google.stats()[STREETVIEW_PATH], 2)
+
+		scheduler.get(STREETVIEW, self.url)
+		self.assertRaises(QuotaExhausted, scheduler.get, STREETVIEW, self.url)
+		self.assertEqual(scheduler.stats()[STREETVIEW]['used_today'], 3)
+		self.assertEqual(self.google.stats()[STREETVIEW_PATH], 3)
+
+	def test_exponential_backoff(self):
+		# 503s carry no Retry-After: the delays double, jittered, until max_retries...
+		self.google.failure_rate = 1.0
+		scheduler = self.scheduler(max_retries = 3, backoff = 1.0)
+		self.assertEqual(scheduler.get(STREETVIEW, self.url).status_code, 503)
+		self.assertEqual(len(self.delays), 3)
+		for attempt, delay in enumerate(self.delays):
+			self.assertTrue(0.5 * 2 ** attempt <= delay <= 2 ** attempt, delay)
+		stats = scheduler.stats()[STREETVIEW]
+		self.assertEqual((stats['retries'], stats['throttled'], stats['used_today']), (3, 0, 4))
+
+
+class SharedStateTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.dir)
+		self.state_file = os.path.join(self.dir, 'quota.json')
+
+	def scheduler(self, api_key = 'K'):
+		budget = ApiBudget(daily_limit = 5)
+		return QuotaScheduler({STREETVIEW: budget}, state_file = self.state_file, wait_for_reset = False, api_key = api_key, lease = 2)
+
+	def reserve(self, scheduler):
+		try:
+			scheduler.reserve(STREETVIEW)
+			return True
+		except QuotaExhausted:
+			return False
+
+	def test_shared_budget(self):
+		# Two processes of the same key never send more than its daily budget between them...
+		first, second = self.scheduler(), self.scheduler()
+		sent = [self.reserve(scheduler) for _ in range(4) for scheduler in (first, second)]
+		self.assertEqual(sent.count(True), 5)
+
+		# Another key has a budget of its own...
+		self.assertTrue(self.reserve(self.scheduler('OTHER')))
+
+	def test_close_gives_leases_back(self):
+		first = self.scheduler()
+		self.reserve(first) # Leases 2, sends 1...
+		first.close()
+		self.assertEqual(first.stats()[STREETVIEW]['used_today'], 1)
+		second = self.scheduler()
+		self.assertEqual(sum(self.reserve(second) for _ in range(10)), 4)
+
+
+class ParseBudgetsTest(unittest.TestCase):
+
+	def test_budgets(self):
+		budgets = parse_budgets('roads=50,streetview=20.5', 'streetview=300')
+		self.assertEqual(sorted(budgets), [ROADS, STREETVIEW])
+		self.assertEqual((budgets[ROADS].rate, budgets[ROADS].daily_limit), (50.0, None))
+		self.assertEqual((budgets[STREETVIEW].rate, budgets[STREETVIEW].daily_limit), (20.5, 300))
+		self.assertEqual(parse_budgets(), {})
+
+	def test_unknown_api(self):
+		# A typo is an error rather than a budget that never applies...
+		self.assertRaises(ValueError, parse_budgets, 'roads=50', 'streetveiw=300')
+		self.assertRaises(ValueError, parse_budgets, 'streetview')
+		self.assertRaises(ValueError, parse_budgets, 'roads=fast')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,67 @@
+####################################
+#      test_region_filter.py       #
+#                                  #
+#  RegionFilter.mask vs. the per-  #
+#  point regional_validity test... #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python)
+import os
+import sys
+import unittest
+import numpy as np
+from shapely.geometry import Point, Polygon, box
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import S3
+
+# An L-shaped region (lat, lon), and exclusions: inside it, across its edge, outside it, and a round one...
+REGION     = Polygon([(45.30, -75.80), (45.30, -75.76), (45.32, -75.76), (45.32, -75.78), (45.34, -75.78), (45.34, -75.80)])
+EXCLUSIONS = [box(45.305, -75.795, 45.310, -75.790),
+              box(45.315, -75.770, 45.325, -75.750),
+              box(45.350, -75.800, 45.360, -75.790),
+              Point(45.330, -75.790).buffer(0.004)]
+
+
+def boundary_points(polygon, per_edge = 8):
+	# The vertices of the polygon and points along each of its edges...
+	coords = list(polygon.exterior.coords)
+	points = []
+	for (lat_0, lon_0), (lat_1, lon_1) in zip(coords[:-1], coords[1:]):
+		for t in np.linspace(0.0, 1.0, per_edge, endpoint = False):
+			points.append((lat_0 + t * (lat_1 - lat_0), lon_0 + t * (lon_1 - lon_0)))
+	return points
+
+
+class RegionFilterTest(unittest.TestCase):
+
+	def assertSameMask(self, region_filter, points):
+		lats, lons = np.array(points).T
+		expected = [S3.regional_validity(Point(lat, lon), region_filter.region, region_filter.exclusions) for lat, lon in points]
+		self.assertEqual(region_filter.mask(lats, lons).tolist(), expected)
+		self.assertEqual([region_filter.is_valid(lat, lon) for lat, lon in points], expected)
+
+	def test_grid(self):
+		region_filter = S3.RegionFilter(REGION, EXCLUSIONS)
+		grid = [(lat, lon) for lats, lons in S3.grid_points((45.29, -75.81, 45.37, -75.74), 50) for lat, lon in zip(lats, lons)]
+		mask = region_filter.mask(*np.array(grid).T)
+		self.assertTrue(0 < mask.sum() < len(grid))
+		self.assertSameMask(region_filter, grid)
+
+	def test_random_points(self):
+		random = np.random.RandomState(0)
+		points = zip(random.uniform(45.29, 45.37, 2000), random.uniform(-75.81, -75.74, 2000))
+		self.assertSameMask(S3.RegionFilter(REGION, EXCLUSIONS), points)
+
+	def test_boundaries(self):
+		# Points on the region and exclusion edges, vertices included...
+		points = boundary_points(REGION)
+		for city in EXCLUSIONS: points += boundary_points(city, 4)
+		self.assertSameMask(S3.RegionFilter(REGION, EXCLUSIONS), points)
+
+	def test_no_exclusions(self):
+		points = boundary_points(REGION) + [(45.31, -75.79), (45.33, -75.77), (45.40, -75.70)]
+		self.assertSameMask(S3.RegionFilter(REGION, []), points)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,71 @@
+####################################
+#       test_road_snapper.py       #
+#                                  #
+#  RoadSnapper requests filled and #
+#  roads passed on once, with the  #
+#  Roads API of fake_google.py...  #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python)
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import S3
+from road_snapper import RoadSnapper
+from fake_google import FakeGoogle, FakeGoogleServer, ROADS_PATH
+
+BATCH_LIMIT = 10
+
+
+def points(count, lat = 45.3001, start = 0):
+	# Grid points along the street at 45.3, a road apart...
+	return [(lat, round(-75.8 + 0.001 * i, 5)) for i in range(start, start + count)]
+
+
+class RoadSnapperTest(unittest.TestCase):
+
+	def setUp(self):
+		self.google = FakeGoogle(water = 0.0)
+		self.server = FakeGoogleServer(self.google).start()
+		self.addCleanup(self.server.stop)
+		S3.set_google_url(self.server.url)
+		self.snapper = RoadSnapper(S3.google_nearest_roads, BATCH_LIMIT)
+
+	def requests(self):
+		return self.google.stats().get(ROADS_PATH, 0)
+
+	def test_fill(self):
+		# A short request is topped up with the points due next, which then need no request of their own...
+		upcoming = points(20, start = 4)
+		roads = self.snapper.snap_batch(points(4), lambda n: upcoming[:n])
+		self.assertEqual(len(roads), 4)
+		self.assertEqual(self.requests(), 1)
+		self.assertEqual(self.snapper.stats()['prefetched'], BATCH_LIMIT - 4)
+
+		roads = self.snapper.snap_batch(upcoming[:6])
+		self.assertEqual(len(roads), 6)
+		self.assertEqual(self.requests(), 1)
+		stats = self.snapper.stats()
+		self.assertEqual((stats['requests'], stats['points'], stats['fill']), (1, BATCH_LIMIT, 1.0))
+
+	def test_distinct_points(self):
+		# A point repeated (to the snap precision) is looked up once...
+		batch = points(BATCH_LIMIT) + [(lat + 1e-7, lon) for lat, lon in points(BATCH_LIMIT)]
+		self.assertEqual(len(self.snapper.snap(batch)), 2 * BATCH_LIMIT)
+		self.assertEqual((self.requests(), self.snapper.stats()['points']), (1, BATCH_LIMIT))
+
+	def test_roads_passed_once(self):
+		# Points on either side of the street snap to its same roads: each is walked from once per run...
+		north = self.snapper.snap_batch(points(5, lat = 45.3002))
+		self.assertEqual([self.snapper.key(*road[:2]) for road in north], [(45.3, lon) for lat, lon in points(5)])
+		self.assertEqual(self.snapper.snap_batch(points(5, lat = 45.2998)), [])
+		self.assertEqual(self.snapper.stats()['duplicates'], 5)
+
+		# So are the roads of the run resumed...
+		self.snapper.mark_passed([(45.3, lon) for lat, lon in points(3, start = 5)])
+		self.assertEqual([self.snapper.key(*road[:2]) for road in self.snapper.snap_batch(points(5, start = 5))], [(45.3, lon) for lat, lon in points(2, start = 8)])
+
+
+if __name__ == '__main__':
+	unittest.main()
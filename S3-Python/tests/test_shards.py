@@ -0,0 +1,62 @@
+####################################
+#          test_shards.py          #
+#                                  #
+#  A sharded survey against a fake #
+#  _google.py server finds the     #
+#  images of an unsharded one...   #
+####################################
+# Usage: $ python -m unittest discover -s tests  (from S3-Python)
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from manifest import manifest_path, read_manifest
+from fake_google import FakeGoogle, FakeGoogleServer
+
+RUN_S3 = os.path.join(os.path.dirname(HERE), 'run_S3.py')
+REGION = [(45.300, -75.800), (45.300, -75.785), (45.310, -75.785), (45.310, -75.800)]
+
+
+class ShardsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.server = FakeGoogleServer(FakeGoogle(seed = 0)).start()
+		self.addCleanup(self.server.stop)
+		self.dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.dir)
+		self.region = os.path.join(self.dir, 'region.txt')
+		with open(self.region, 'w') as f:
+			for lat, lon in REGION + REGION[:1]: f.write(repr(lon) + ',' + repr(lat) + '\n')
+
+	def survey(self, name, *args):
+		output_dir = os.path.join(self.dir, name)
+		os.makedirs(output_dir)
+		with open(os.path.join(self.dir, name + '.log'), 'w') as log:
+			status = subprocess.call([sys.executable, RUN_S3, '-a', 'K', '-gu', self.server.url, '-c', self.region, '-d', '100',
+			                          '-w', '0', '-mf', 'csv', '-o', output_dir + '/'] + list(args),
+			                         cwd = os.path.dirname(RUN_S3), stdout = log, stderr = subprocess.STDOUT)
+		self.assertEqual(status, 0, 'see ' + name + '.log')
+		return output_dir
+
+	def rows(self, output_dir):
+		records = read_manifest(manifest_path(output_dir, 'csv'))
+		return sorted(zip(*[records[name].tolist() for name in ('lat', 'lon', 'heading', 'grid_lat', 'grid_lon')]))
+
+	def test_same_rows_as_unsharded(self):
+		unsharded = self.rows(self.survey('unsharded'))
+		self.assertTrue(unsharded)
+		self.assertEqual(len(set(unsharded)), len(unsharded))
+
+		sharded = self.survey('sharded', '-sh', '2')
+		self.assertTrue(os.path.isdir(os.path.join(sharded, 'shard_0')))
+		self.assertTrue(os.path.isdir(os.path.join(sharded, 'shard_1')))
+		self.assertEqual(self.rows(sharded), unsharded)
+
+
+if __name__ == '__main__':
+	unittest.main()